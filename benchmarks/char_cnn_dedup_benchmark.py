@@ -0,0 +1,94 @@
+"""
+Benchmark of encoding only the distinct words of a batch with the character CNN
+(``cached_character_encoding``) against encoding every token position (``character_encoding``).
+
+For training batches of synthetic SQuAD-shaped passages at several lengths, measures:
+
+1. The char-CNN FLOPs of a batch when every token position (padding included) is encoded, and
+   when only the distinct words are (``char_cnn_gflops_*``).
+2. The time of a forward/backward pass through the embedder, both ways.
+
+and compares them against ``benchmarks/baselines/char_cnn_dedup.json``::
+
+    python -m benchmarks.char_cnn_dedup_benchmark
+"""
+import argparse
+import os
+import tempfile
+from typing import Dict
+
+import torch
+
+from allennlp.common import Params
+from allennlp.data import Vocabulary
+from allennlp.modules.token_embedders import TokenCharactersEncoder
+
+from reading_comprehension.modules.cached_token_characters_encoder import CachedTokenCharactersEncoder
+from benchmarks.common import BASELINES_ROOT, FIXTURES_ROOT, main, synthesize_squad_file, time_function
+from benchmarks.qanet_benchmark import build_reader, make_batch
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--config', type=str, default=os.path.join(FIXTURES_ROOT, "qanet", "experiment.json"),
+                        help='The experiment config whose reader and token_characters embedder we benchmark.')
+    parser.add_argument('--passage-lengths', type=int, nargs='+', default=[100, 400])
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--num-questions', type=int, default=64)
+
+
+def char_cnn_flops(embedder: TokenCharactersEncoder, num_words: int, num_characters: int) -> float:
+    """
+    The multiply-adds (counted as two FLOPs) of the convolutions of a ``CnnEncoder`` over
+    ``num_words`` words of ``num_characters`` characters.
+    """
+    # pylint: disable=protected-access
+    encoder = embedder._encoder._module
+    flops = 0.0
+    for convolution_layer in encoder._convolution_layers:
+        kernel_size = convolution_layer.kernel_size[0]
+        num_windows = max(num_characters - kernel_size + 1, 0)
+        flops += 2.0 * num_windows * kernel_size * convolution_layer.in_channels * convolution_layer.out_channels
+    return num_words * flops
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    config = Params.from_file(args.config)
+    embedder_params = config.get("model").get("text_field_embedder").get("token_embedders").get("token_characters")
+    embedder_params.pop("type", None)
+    results: Dict[str, float] = {}
+    data_dir = tempfile.mkdtemp()
+
+    for passage_length in args.passage_lengths:
+        data_path = synthesize_squad_file(os.path.join(data_dir, f"synthetic_dev_{passage_length}.json"),
+                                          passage_length, args.num_questions)
+        instances = list(build_reader(config, passage_length).read(data_path))
+        vocab = Vocabulary.from_instances(instances)
+        embedder = TokenCharactersEncoder.from_params(vocab, embedder_params.duplicate())
+        cached_embedder = CachedTokenCharactersEncoder.from_params(vocab, embedder_params.duplicate())
+        cached_embedder.load_state_dict(embedder.state_dict())
+        embedder.train()
+        cached_embedder.train()
+
+        # Shape: (batch_size, num_tokens, num_characters)
+        token_characters = make_batch(instances, vocab, args.batch_size)["passage"]["token_characters"]
+        num_positions = token_characters.size(0) * token_characters.size(1)
+        num_characters = token_characters.size(2)
+        num_unique_words = torch.unique(token_characters.view(-1, num_characters), dim=0).size(0)
+        all_flops = char_cnn_flops(embedder, num_positions, num_characters)
+        unique_flops = char_cnn_flops(embedder, num_unique_words, num_characters)
+        results[f"char_cnn_gflops_all_positions_p{passage_length}"] = all_flops / 1e9
+        results[f"char_cnn_gflops_unique_words_p{passage_length}"] = unique_flops / 1e9
+        results[f"char_cnn_unique_word_fraction_p{passage_length}"] = num_unique_words / num_positions
+
+        for name, module in [("all_positions", embedder), ("unique_words", cached_embedder)]:
+            def step(module=module):
+                module.zero_grad()
+                module(token_characters).sum().backward()
+
+            results[f"char_cnn_train_step_seconds_{name}_p{passage_length}_b{args.batch_size}"] = \
+                time_function(step, args.num_warmup, args.num_repeats)
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "char_cnn_dedup.json"))
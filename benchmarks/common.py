@@ -0,0 +1,200 @@
+"""
+Shared helpers for the CPU benchmarks in this directory.
+
+Every benchmark module exposes an ``add_arguments(parser)`` function and a ``run(args)`` function
+returning a flat ``Dict[str, float]`` of measurements, and hands both to :func:`main`.  ``main``
+takes care of seeding, thread settings, printing, and comparing the results against a stored
+baseline JSON file, exiting with a non-zero status if any measurement regressed by more than the
+allowed threshold.
+
+By convention, measurement names containing ``_per_second`` are throughputs (higher is better);
+everything else (seconds, megabytes, FLOPs) is a cost (lower is better).
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+FIXTURES_ROOT = os.path.join(PROJECT_ROOT, "fixtures")
+BASELINES_ROOT = os.path.join(PROJECT_ROOT, "benchmarks", "baselines")
+
+
+def set_seed(seed: int) -> None:
+    """
+    Seeds python, numpy and torch so that synthetic data and model initialisation are identical
+    across runs.
+    """
+    random.seed(seed)
+    try:
+        import numpy
+        numpy.random.seed(seed)
+    except ImportError:
+        pass
+    try:
+        import torch
+        torch.manual_seed(seed)
+    except ImportError:
+        pass
+
+
+def set_num_threads(num_threads: int) -> None:
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+
+def time_function(function: Callable[[], Any], num_warmup: int = 2, num_repeats: int = 10) -> float:
+    """
+    Returns the median wall clock time in seconds of ``num_repeats`` calls to ``function``, after
+    ``num_warmup`` untimed calls.  We use the median rather than the mean so that a single
+    scheduling hiccup does not show up as a regression.
+    """
+    for _ in range(num_warmup):
+        function()
+    timings = []
+    for _ in range(num_repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    middle = len(timings) // 2
+    if len(timings) % 2 == 1:
+        return timings[middle]
+    return (timings[middle - 1] + timings[middle]) / 2
+
+
+def peak_memory_mb() -> float:
+    """
+    Peak resident set size of this process in megabytes.  ``ru_maxrss`` is in kilobytes on Linux
+    and in bytes on OSX.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 1000000
+    return peak / 1000
+
+
+def synthesize_squad_file(output_path: str,
+                          passage_length: int,
+                          num_questions: int,
+                          fixture_path: str = None) -> str:
+    """
+    Writes a SQuAD-shaped json file to ``output_path`` whose passages have (at least)
+    ``passage_length`` whitespace tokens, built by concatenating the paragraphs of
+    ``fixtures/qanet/squad.json``.  Each question of the fixture is attached to a passage that
+    starts with its original paragraph, so the gold answer offsets stay valid whenever the
+    original paragraph fits in the passage.  Questions are cycled until we have ``num_questions``
+    of them.
+    """
+    fixture_path = fixture_path or os.path.join(FIXTURES_ROOT, "qanet", "squad.json")
+    with open(fixture_path) as fixture_file:
+        fixture = json.load(fixture_file)
+    paragraphs = [paragraph for article in fixture["data"] for paragraph in article["paragraphs"]]
+
+    synthetic_paragraphs: List[Dict[str, Any]] = []
+    question_count = 0
+    while question_count < num_questions:
+        for paragraph_index, paragraph in enumerate(paragraphs):
+            contexts = [paragraph["context"]]
+            num_tokens = len(paragraph["context"].split())
+            next_index = paragraph_index
+            while num_tokens < passage_length:
+                next_index = (next_index + 1) % len(paragraphs)
+                contexts.append(paragraphs[next_index]["context"])
+                num_tokens += len(paragraphs[next_index]["context"].split())
+            qas = []
+            for question_answer in paragraph["qas"]:
+                if question_count >= num_questions:
+                    break
+                qas.append(dict(question_answer, id=f"{question_answer['id']}_{question_count}"))
+                question_count += 1
+            if qas:
+                synthetic_paragraphs.append({"context": " ".join(contexts), "qas": qas})
+    dataset = {"version": "synthetic",
+               "data": [{"title": f"synthetic_{passage_length}", "paragraphs": synthetic_paragraphs}]}
+    with open(output_path, "w") as output_file:
+        json.dump(dataset, output_file)
+    return output_path
+
+
+def compare_with_baseline(results: Dict[str, float],
+                          baseline: Dict[str, float],
+                          threshold: float) -> List[str]:
+    """
+    Returns a human readable description of every measurement in ``results`` that is worse than
+    its value in ``baseline`` by more than ``threshold`` (a fraction of the baseline value).
+    Measurements missing from the baseline are ignored.
+    """
+    regressions = []
+    for name, value in sorted(results.items()):
+        if name not in baseline or not baseline[name]:
+            continue
+        reference = baseline[name]
+        if "_per_second" in name:
+            change = (reference - value) / reference
+        else:
+            change = (value - reference) / reference
+        if change > threshold:
+            regressions.append(f"{name}: {value:.6g} vs baseline {reference:.6g} ({change:+.1%} worse)")
+    return regressions
+
+
+def main(description: str,
+         add_arguments: Callable[[argparse.ArgumentParser], None],
+         run: Callable[[argparse.Namespace], Dict[str, float]],
+         default_baseline: str) -> None:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--baseline', type=str, default=default_baseline,
+                        help='The json file with the reference measurements.')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Overwrite the baseline with the measurements of this run.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='The relative slowdown (or memory growth) that counts as a regression.')
+    parser.add_argument('--output', type=str, help='Also write the measurements of this run here.')
+    parser.add_argument('--seed', type=int, default=13370)
+    parser.add_argument('--num-threads', type=int, default=1,
+                        help='The number of intra-op threads torch may use.')
+    parser.add_argument('--num-warmup', type=int, default=2)
+    parser.add_argument('--num-repeats', type=int, default=10)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s', level=logging.INFO)
+    set_seed(args.seed)
+    set_num_threads(args.num_threads)
+
+    results = run(args)
+    for name, value in sorted(results.items()):
+        print(f"{name:<60} {value:.6g}")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        if not args.update_baseline:
+            logger.warning("No baseline found at %s, recording this run as the baseline.", args.baseline)
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        return
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare_with_baseline(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} measurement(s) regressed by more than {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"    {regression}")
+        sys.exit(1)
+    print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}.")
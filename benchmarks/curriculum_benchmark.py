@@ -0,0 +1,103 @@
+"""
+Benchmark of the passage length curriculum of the ``ema_trainer``: the training time QANet takes
+to reach a target validation F1 when trained on whole passages from the first epoch, against when
+trained on short passages first (``passage_length_curriculum``).
+
+Both runs train the model of ``--config`` from the same initialization on the same synthetic
+SQuAD-shaped data, validating after each epoch with the moving averages of the parameters.  Only
+the training time counts.  Reports the seconds to the target F1 of both runs (``inf`` if a run
+does not reach it within ``--max-epochs``), and compares them against
+``benchmarks/baselines/curriculum.json``::
+
+    python -m benchmarks.curriculum_benchmark --passage-length 400 --curriculum 100 200 --target-f1 0.5
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import torch
+
+from allennlp.common import Params
+from allennlp.data import Instance, Vocabulary
+from allennlp.data.iterators import BasicIterator
+from allennlp.models import Model
+
+from reading_comprehension.ema_trainer import EMATrainer
+from reading_comprehension.qanet import QaNet  # pylint: disable=unused-import
+from reading_comprehension.qanet_encoder import QaNetEncoder  # pylint: disable=unused-import
+from benchmarks.common import BASELINES_ROOT, FIXTURES_ROOT, main, set_seed, synthesize_squad_file
+from benchmarks.qanet_benchmark import build_reader
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--config', type=str, default=os.path.join(FIXTURES_ROOT, "qanet", "experiment.json"),
+                        help='The experiment config whose dataset reader and model we train.')
+    parser.add_argument('--passage-length', type=int, default=400)
+    parser.add_argument('--curriculum', type=int, nargs='+', default=[100, 200],
+                        help='The passage length limits of the stages before the whole passages.')
+    parser.add_argument('--epochs-per-stage', type=int, default=1)
+    parser.add_argument('--target-f1', type=float, default=0.5)
+    parser.add_argument('--max-epochs', type=int, default=20)
+    parser.add_argument('--num-questions', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=16)
+
+
+def _time_to_target_f1(model: Model,
+                       train_instances: List[Instance],
+                       validation_instances: List[Instance],
+                       vocab: Vocabulary,
+                       passage_length_curriculum: List[Tuple[int, int]],
+                       args: argparse.Namespace) -> float:
+    iterator = BasicIterator(batch_size=args.batch_size)
+    iterator.index_with(vocab)
+    optimizer = torch.optim.Adam([parameter for parameter in model.parameters() if parameter.requires_grad],
+                                 lr=0.001, betas=(0.8, 0.999))
+    trainer = EMATrainer(model, optimizer, iterator, train_instances, num_epochs=args.max_epochs,
+                         exponential_moving_average_decay=0.999,
+                         passage_length_curriculum=passage_length_curriculum)
+    training_seconds = 0.0
+    for epoch in range(args.max_epochs):
+        start = time.perf_counter()
+        trainer._train_epoch(epoch)  # pylint: disable=protected-access
+        training_seconds += time.perf_counter() - start
+
+        model.eval()
+        trainer.exp_moving_average.assign_average_value()
+        with torch.no_grad():
+            for batch in iterator(validation_instances, num_epochs=1, shuffle=False):
+                model(**batch)
+        trainer.exp_moving_average.restore()
+        if model.get_metrics(reset=True)["f1"] >= args.target_f1:
+            return training_seconds
+    return float("inf")
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    config = Params.from_file(args.config)
+    data_dir = tempfile.mkdtemp()
+    reader = build_reader(config, args.passage_length)
+    # The reader drops the questions whose answer is cut from the training file, not the "dev" one.
+    train_path = synthesize_squad_file(os.path.join(data_dir, "synthetic_train.json"),
+                                       args.passage_length, args.num_questions)
+    validation_path = synthesize_squad_file(os.path.join(data_dir, "synthetic_dev.json"),
+                                            args.passage_length, args.num_questions)
+    train_instances = list(reader.read(train_path))
+    validation_instances = list(reader.read(validation_path))
+    vocab = Vocabulary.from_instances(train_instances + validation_instances)
+
+    curriculum = [(stage * args.epochs_per_stage, passage_length_limit)
+                  for stage, passage_length_limit in enumerate(args.curriculum)]
+    curriculum.append((len(args.curriculum) * args.epochs_per_stage, args.passage_length))
+    results: Dict[str, float] = {}
+    for name, passage_length_curriculum in [("fixed", None), ("curriculum", curriculum)]:
+        set_seed(args.seed)
+        model = Model.from_params(vocab=vocab, params=config.get("model").duplicate())
+        results[f"time_to_target_f1_seconds_{name}_p{args.passage_length}"] = _time_to_target_f1(
+                model, train_instances, validation_instances, vocab, passage_length_curriculum, args)
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "curriculum.json"))
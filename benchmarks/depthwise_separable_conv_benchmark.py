@@ -0,0 +1,53 @@
+"""
+Per-layer CPU benchmark of ``DepthwiseSeparableConv`` as used in ``QaNetEncoderBlock``: the
+original channel-first module (with the two transposes of the block around it) against the
+channel-last fast path, for the forward pass and the forward/backward pass::
+
+    python -m benchmarks.depthwise_separable_conv_benchmark
+
+The measurements are compared against ``benchmarks/baselines/depthwise_separable_conv.json``.
+"""
+import argparse
+import os
+from typing import Dict
+
+import torch
+
+from reading_comprehension.modules.depthwise_separable_conv import DepthwiseSeparableConv
+from benchmarks.common import BASELINES_ROOT, main, time_function
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--hidden-dim', type=int, default=128)
+    parser.add_argument('--kernel-sizes', type=int, nargs='+', default=[5, 7],
+                        help='The kernel sizes of the modeling and phrase layers.')
+    parser.add_argument('--timesteps', type=int, nargs='+', default=[50, 400])
+    parser.add_argument('--batch-size', type=int, default=32)
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    for kernel_size in args.kernel_sizes:
+        conv = DepthwiseSeparableConv(args.hidden_dim, args.hidden_dim, kernel_size, activation="relu", dim=1)
+        for timesteps in args.timesteps:
+            inputs = torch.randn(args.batch_size, timesteps, args.hidden_dim, requires_grad=True)
+            implementations = {"channel_first": lambda x: conv(x.transpose(1, 2)).transpose(1, 2),
+                               "channel_last": conv.forward_channel_last}
+            for name, implementation in implementations.items():
+                def forward(implementation=implementation):
+                    with torch.no_grad():
+                        implementation(inputs)
+
+                def forward_backward(implementation=implementation):
+                    conv.zero_grad()
+                    implementation(inputs).sum().backward()
+
+                suffix = f"{name}_k{kernel_size}_t{timesteps}_b{args.batch_size}"
+                results[f"forward_seconds_{suffix}"] = time_function(forward, args.num_warmup, args.num_repeats)
+                results[f"forward_backward_seconds_{suffix}"] = \
+                    time_function(forward_backward, args.num_warmup, args.num_repeats)
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "depthwise_separable_conv.json"))
@@ -0,0 +1,109 @@
+"""
+Benchmark of a distilled QANet student against its teacher: the inference latency at several
+batch sizes, and the EM and F1 on a validation file, printed as a comparison table.
+
+With ``--teacher-archive`` and ``--student-archive`` (e.g. trained with
+``training_configs/squad_qanet.jsonnet`` and ``training_configs/squad_qanet_distilled.jsonnet``),
+the trained models are compared on ``--validation-file``.  Without them, the teacher is built
+from ``--config`` and the student from the same config with ``--student-num-blocks`` modeling
+blocks and ``--student-num-attention-heads`` heads, both untrained, on synthetic data: only the
+latencies are meaningful then.  Reports the latencies, and compares them against
+``benchmarks/baselines/distillation.json``::
+
+    python -m benchmarks.distillation_benchmark --teacher-archive teacher.tar.gz \\
+        --student-archive student.tar.gz --validation-file squad-dev-v1.1.json
+"""
+import argparse
+import os
+import tempfile
+from typing import Dict, List, Tuple
+
+import torch
+
+from allennlp.common import Params
+from allennlp.data import DatasetReader, Instance, Vocabulary
+from allennlp.data.iterators import BasicIterator
+from allennlp.models import Model
+from allennlp.models.archival import load_archive
+
+from reading_comprehension.qanet import QaNet  # pylint: disable=unused-import
+from reading_comprehension.qanet_encoder import QaNetEncoder  # pylint: disable=unused-import
+from benchmarks.common import BASELINES_ROOT, FIXTURES_ROOT, main, synthesize_squad_file, time_function
+from benchmarks.qanet_benchmark import build_reader, make_batch
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--teacher-archive', type=str)
+    parser.add_argument('--student-archive', type=str)
+    parser.add_argument('--validation-file', type=str,
+                        help='The SQuAD-format file to evaluate on (synthetic data if not given).')
+    parser.add_argument('--config', type=str, default=os.path.join(FIXTURES_ROOT, "qanet", "experiment.json"),
+                        help='The experiment config of the teacher, without archives.')
+    parser.add_argument('--student-num-blocks', type=int, default=1)
+    parser.add_argument('--student-num-attention-heads', type=int, default=4)
+    parser.add_argument('--passage-length', type=int, default=400)
+    parser.add_argument('--num-questions', type=int, default=64)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+
+
+def _load_models(args: argparse.Namespace) -> Tuple[Dict[str, Model], DatasetReader, str]:
+    if args.teacher_archive and args.student_archive:
+        teacher_archive = load_archive(args.teacher_archive)
+        models = {"teacher": teacher_archive.model, "student": load_archive(args.student_archive).model}
+        reader = DatasetReader.from_params(teacher_archive.config.duplicate().pop("dataset_reader"))
+        return models, reader, args.validation_file
+
+    config = Params.from_file(args.config)
+    reader = build_reader(config, args.passage_length)
+    validation_file = args.validation_file or synthesize_squad_file(
+            os.path.join(tempfile.mkdtemp(), "synthetic_dev.json"), args.passage_length, args.num_questions)
+    vocab = Vocabulary.from_instances(reader.read(validation_file))
+    student_params = config.get("model").duplicate()
+    student_params["modeling_layer"]["num_blocks"] = args.student_num_blocks
+    for layer in ["phrase_layer", "modeling_layer"]:
+        student_params[layer]["num_attention_heads"] = args.student_num_attention_heads
+    models = {"teacher": Model.from_params(vocab=vocab, params=config.get("model").duplicate()),
+              "student": Model.from_params(vocab=vocab, params=student_params)}
+    return models, reader, validation_file
+
+
+def _evaluate(model: Model, instances: List[Instance]) -> Dict[str, float]:
+    iterator = BasicIterator(batch_size=32)
+    iterator.index_with(model.vocab)
+    with torch.no_grad():
+        for batch in iterator(instances, num_epochs=1, shuffle=False):
+            model(**batch)
+    return model.get_metrics(reset=True)
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    models, reader, validation_file = _load_models(args)
+    instances = list(reader.read(validation_file))
+    results: Dict[str, float] = {}
+    rows = []
+    for name, model in models.items():
+        model.eval()
+        metrics = _evaluate(model, instances)
+        num_parameters = sum(parameter.numel() for parameter in model.parameters() if parameter.requires_grad)
+        latencies = []
+        for batch_size in args.batch_sizes:
+            batch = make_batch(instances, model.vocab, batch_size)
+
+            def inference(batch=batch, model=model):
+                with torch.no_grad():
+                    model(**batch)
+
+            seconds = time_function(inference, args.num_warmup, args.num_repeats)
+            results[f"inference_seconds_{name}_b{batch_size}"] = seconds
+            latencies.append(f"{seconds * 1000:>12.1f}")
+        rows.append(f"{name:<10}{num_parameters:>14,}{metrics['em']:>8.3f}{metrics['f1']:>8.3f}" +
+                    "".join(latencies))
+
+    header = f"{'model':<10}{'parameters':>14}{'EM':>8}{'F1':>8}" + \
+            "".join(f"{f'ms b{batch_size}':>12}" for batch_size in args.batch_sizes)
+    print("\n".join([header] + rows))
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "distillation.json"))
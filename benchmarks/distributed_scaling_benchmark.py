@@ -0,0 +1,106 @@
+"""
+Scaling benchmark of data-parallel CPU training with ``gloo``, as done by the
+``train-distributed`` command: for each number of processes, measures the time of one training
+step (forward, backward with the gradient all-reduce, and optimizer step) of the slowest process,
+each process training on its own batch of ``--batch-size`` instances.
+
+Reports the training throughput in instances per second and the scaling overhead, i.e. the
+fraction of the ideal linear speedup over one process that is lost::
+
+    python -m benchmarks.distributed_scaling_benchmark --num-processes 1 2 4 8 --num-threads 1
+
+The measurements are compared against ``benchmarks/baselines/distributed_scaling.json``.  Give
+each process its own physical cores (``num_processes * num_threads`` at most the number of
+cores), or the measured overhead is mostly contention.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import tempfile
+from typing import Dict
+
+import torch
+import torch.distributed
+import torch.multiprocessing
+
+from allennlp.common import Params
+from allennlp.common.util import import_submodules
+from allennlp.data import Vocabulary
+from allennlp.models import Model
+
+from benchmarks.common import BASELINES_ROOT, FIXTURES_ROOT, main, set_seed, synthesize_squad_file, \
+    time_function
+from benchmarks.qanet_benchmark import build_reader, make_batch
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--config', type=str, default=os.path.join(FIXTURES_ROOT, "qanet", "experiment.json"),
+                        help='The experiment config whose model we train.')
+    parser.add_argument('--num-processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--passage-length', type=int, default=400)
+    parser.add_argument('--batch-size', type=int, default=8, help='The batch size of each process.')
+    parser.add_argument('--num-questions', type=int, default=64)
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        return free_socket.getsockname()[1]
+
+
+def _train_process(rank: int, world_size: int, port: int, data_path: str,
+                   args: argparse.Namespace, step_seconds: Dict[int, float]) -> None:
+    import_submodules("reading_comprehension")
+    set_seed(args.seed)
+    torch.set_num_threads(args.num_threads)
+    torch.distributed.init_process_group("gloo", init_method=f"tcp://127.0.0.1:{port}",
+                                         rank=rank, world_size=world_size)
+    config = Params.from_file(args.config)
+    instances = list(build_reader(config, args.passage_length).read(data_path))
+    vocab = Vocabulary.from_instances(instances)
+    model = Model.from_params(vocab=vocab, params=config.get("model").duplicate())
+    for parameter in model.parameters():
+        torch.distributed.broadcast(parameter.data, src=0)
+    distributed_model = torch.nn.parallel.DistributedDataParallel(model, find_unused_parameters=True)
+    optimizer = torch.optim.Adam([parameter for parameter in model.parameters() if parameter.requires_grad])
+    model.train()
+    batch = make_batch(instances[rank::world_size], vocab, args.batch_size)
+
+    def train_step():
+        optimizer.zero_grad()
+        loss = distributed_model(**batch)["loss"] + model.get_regularization_penalty()
+        loss.backward()
+        optimizer.step()
+
+    seconds = torch.Tensor([time_function(train_step, args.num_warmup, args.num_repeats)])
+    torch.distributed.all_reduce(seconds, op=torch.distributed.ReduceOp.MAX)
+    if rank == 0:
+        step_seconds[world_size] = seconds.item()
+    torch.distributed.destroy_process_group()
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    data_path = synthesize_squad_file(os.path.join(tempfile.mkdtemp(), "synthetic_dev.json"),
+                                      args.passage_length, args.num_questions)
+    step_seconds = multiprocessing.Manager().dict()
+    for num_processes in args.num_processes:
+        torch.multiprocessing.spawn(_train_process,
+                                    args=(num_processes, _free_port(), data_path, args, step_seconds),
+                                    nprocs=num_processes,
+                                    join=True)
+
+    results: Dict[str, float] = {}
+    suffix = f"p{args.passage_length}_b{args.batch_size}_t{args.num_threads}"
+    for num_processes in args.num_processes:
+        throughput = num_processes * args.batch_size / step_seconds[num_processes]
+        results[f"train_instances_per_second_n{num_processes}_{suffix}"] = throughput
+        if 1 in step_seconds:
+            single_process_throughput = args.batch_size / step_seconds[1]
+            results[f"scaling_overhead_fraction_n{num_processes}_{suffix}"] = \
+                1.0 - throughput / (num_processes * single_process_throughput)
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "distributed_scaling.json"))
@@ -0,0 +1,86 @@
+"""
+Benchmark of QaNet's ``fuse_question_and_passage``: the question and passage encoding (embedding,
+highway and projection layers and phrase layer) with one call of each layer for both, against one
+call for the questions and another one for the passages.
+
+Measures the time of the encoding alone, and of a whole forward pass, in inference at several
+batch sizes, with the same weights both ways, and compares them against
+``benchmarks/baselines/fused_encoding.json``::
+
+    python -m benchmarks.fused_encoding_benchmark --passage-lengths 100 400
+
+Set the phrase layer's ``use_packed_sequences`` in ``--config`` to measure the fused mode as
+recommended.
+"""
+import argparse
+import os
+import tempfile
+from typing import Dict
+
+import torch
+
+from allennlp.common import Params
+from allennlp.data import Vocabulary
+from allennlp.models import Model
+from allennlp.nn import util
+
+from benchmarks.common import BASELINES_ROOT, FIXTURES_ROOT, main, synthesize_squad_file, time_function
+from benchmarks.qanet_benchmark import build_reader, make_batch
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--config', type=str, default=os.path.join(FIXTURES_ROOT, "qanet", "experiment.json"),
+                        help='The experiment config whose model we benchmark.')
+    parser.add_argument('--passage-lengths', type=int, nargs='+', default=[100, 400])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--num-questions', type=int, default=64)
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    # pylint: disable=protected-access
+    config = Params.from_file(args.config)
+    results: Dict[str, float] = {}
+    data_dir = tempfile.mkdtemp()
+
+    for passage_length in args.passage_lengths:
+        data_path = synthesize_squad_file(os.path.join(data_dir, f"synthetic_dev_{passage_length}.json"),
+                                          passage_length, args.num_questions)
+        instances = list(build_reader(config, passage_length).read(data_path))
+        vocab = Vocabulary.from_instances(instances)
+        model = Model.from_params(vocab=vocab, params=config.get("model").duplicate())
+        model.eval()
+
+        for batch_size in args.batch_sizes:
+            batch = make_batch(instances, vocab, batch_size)
+            question_mask = util.get_text_field_mask(batch["question"]).float()
+            passage_mask = util.get_text_field_mask(batch["passage"]).float()
+
+            def separate_encoding(batch=batch, question_mask=question_mask, passage_mask=passage_mask):
+                model._encode_text(batch["question"], question_mask)
+                model._encode_text(batch["passage"], passage_mask)
+
+            def fused_encoding(batch=batch, question_mask=question_mask, passage_mask=passage_mask):
+                model._encode_question_and_passage(batch["question"], question_mask,
+                                                   batch["passage"], passage_mask)
+
+            for name, encoding in [("separate", separate_encoding), ("fused", fused_encoding)]:
+                def encode(encoding=encoding):
+                    with torch.no_grad():
+                        encoding()
+
+                results[f"encoding_seconds_{name}_p{passage_length}_b{batch_size}"] = \
+                    time_function(encode, args.num_warmup, args.num_repeats)
+
+            for name, fuse in [("separate", False), ("fused", True)]:
+                def inference(batch=batch, fuse=fuse):
+                    model._fuse_question_and_passage = fuse
+                    with torch.no_grad():
+                        model(**batch)
+
+                results[f"inference_seconds_{name}_p{passage_length}_b{batch_size}"] = \
+                    time_function(inference, args.num_warmup, args.num_repeats)
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "fused_encoding.json"))
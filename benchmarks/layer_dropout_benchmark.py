@@ -0,0 +1,79 @@
+"""
+Benchmark of the training speedup that layer dropout (stochastic depth) realizes now that the
+dropped sublayers of ``QaNetEncoderBlock`` are not computed at all.
+
+For each passage length and each ``layer_dropout_undecayed_prob``, measures the training steps per
+second of the model of the experiment config, and the fraction of the sublayers that were dropped
+during these steps::
+
+    python -m benchmarks.layer_dropout_benchmark --layer-dropout-probs 0 0.1 0.5
+
+The measurements are compared against ``benchmarks/baselines/layer_dropout.json``.
+"""
+import argparse
+import os
+import tempfile
+from typing import Dict, List
+
+from allennlp.common import Params
+from allennlp.data import Instance, Vocabulary
+from allennlp.models import Model
+
+from reading_comprehension.modules.layer_dropout import ResidualWithLayerDropout
+from benchmarks.common import BASELINES_ROOT, FIXTURES_ROOT, main, synthesize_squad_file, time_function
+from benchmarks.qanet_benchmark import build_reader, make_batch
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--config', type=str, default=os.path.join(FIXTURES_ROOT, "qanet", "experiment.json"),
+                        help='The experiment config whose model we train.')
+    parser.add_argument('--passage-lengths', type=int, nargs='+', default=[400])
+    parser.add_argument('--layer-dropout-probs', type=float, nargs='+', default=[0.0, 0.1, 0.5])
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--num-questions', type=int, default=64)
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    config = Params.from_file(args.config)
+    results: Dict[str, float] = {}
+    data_dir = tempfile.mkdtemp()
+
+    for passage_length in args.passage_lengths:
+        data_path = synthesize_squad_file(os.path.join(data_dir, f"synthetic_dev_{passage_length}.json"),
+                                          passage_length, args.num_questions)
+        instances: List[Instance] = list(build_reader(config, passage_length).read(data_path))
+        vocab = Vocabulary.from_instances(instances)
+        batch = make_batch(instances, vocab, args.batch_size)
+
+        for layer_dropout_prob in args.layer_dropout_probs:
+            model_params = config.get("model").duplicate()
+            for layer in ["phrase_layer", "modeling_layer"]:
+                model_params[layer]["layer_dropout_undecayed_prob"] = layer_dropout_prob
+            model = Model.from_params(vocab=vocab, params=model_params)
+            model.train()
+            residuals = [module for module in model.modules() if isinstance(module, ResidualWithLayerDropout)]
+
+            def train_step(model=model):
+                model.zero_grad()
+                loss = model(**batch)["loss"] + model.get_regularization_penalty()
+                loss.backward()
+
+            seconds = time_function(train_step, args.num_warmup, args.num_repeats)
+            suffix = f"p{passage_length}_b{args.batch_size}_prob{layer_dropout_prob:g}"
+            results[f"train_steps_per_second_{suffix}"] = 1.0 / seconds
+            num_decisions = sum(residual.num_decisions for residual in residuals)
+            num_dropped = sum(residual.num_dropped for residual in residuals)
+            results[f"dropped_sublayer_fraction_{suffix}"] = num_dropped / num_decisions if num_decisions else 0.0
+
+        no_dropout_key = f"train_steps_per_second_p{passage_length}_b{args.batch_size}_prob0"
+        if no_dropout_key in results:
+            for layer_dropout_prob in args.layer_dropout_probs:
+                suffix = f"p{passage_length}_b{args.batch_size}_prob{layer_dropout_prob:g}"
+                # A relative throughput, hence the "_per_second" name: higher is better.
+                results[f"speedup_train_steps_per_second_{suffix}"] = \
+                    results[f"train_steps_per_second_{suffix}"] / results[no_dropout_key]
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "layer_dropout.json"))
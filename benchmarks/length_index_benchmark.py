@@ -0,0 +1,89 @@
+"""
+Benchmark of the padding of the training batches of a lazy ``squad_limited`` reader: batches
+sorted by length within chunks of ``max_instances_in_memory`` instances (as the ``bucket``
+iterator does), against batches sorted by length over the whole file from the reader's length
+index (``length_index_batch_size``).
+
+The synthetic training file mixes passages of several lengths in a random order.  Reports the
+fraction of padding tokens in the passage and question tensors both ways, and the instances read
+per second (the length index being built by a first, untimed read), and compares them against
+``benchmarks/baselines/length_index.json``::
+
+    python -m benchmarks.length_index_benchmark --passage-lengths 50 200 400 --batch-size 32
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+from typing import Dict, Iterable, List, Tuple
+
+from allennlp.common.util import lazy_groups_of
+from allennlp.data.instance import Instance
+
+from reading_comprehension.squad_reader import SquadReader
+from benchmarks.common import BASELINES_ROOT, main, synthesize_squad_file, time_function
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--passage-lengths', type=int, nargs='+', default=[50, 200, 400])
+    parser.add_argument('--num-questions', type=int, default=1000, help="per passage length")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-instances-in-memory', type=int, default=600)
+
+
+def _get_lengths(instance: Instance) -> Tuple[int, int]:
+    return instance.fields["passage"].sequence_length(), instance.fields["question"].sequence_length()
+
+
+def _padding_fraction(batches: Iterable[List[Tuple[int, int]]]) -> float:
+    num_tokens = num_padded_tokens = 0
+    for batch in batches:
+        for field_index in range(2):
+            lengths = [lengths[field_index] for lengths in batch]
+            num_tokens += sum(lengths)
+            num_padded_tokens += max(lengths) * len(lengths)
+    return 1 - num_tokens / num_padded_tokens
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    data_dir = tempfile.mkdtemp()
+    paragraphs = []
+    for passage_length in args.passage_lengths:
+        data_path = synthesize_squad_file(os.path.join(data_dir, f"synthetic_{passage_length}.json"),
+                                          passage_length, args.num_questions)
+        with open(data_path) as data_file:
+            paragraphs.extend(json.load(data_file)["data"][0]["paragraphs"])
+    random.shuffle(paragraphs)
+    train_path = os.path.join(data_dir, "synthetic_train.json")
+    with open(train_path, "w") as train_file:
+        json.dump({"data": [{"title": "synthetic", "paragraphs": paragraphs}]}, train_file)
+
+    chunked_reader = SquadReader(lazy=True)
+    length_index_reader = SquadReader(lazy=True, length_index_batch_size=args.batch_size)
+
+    def chunked_batches() -> List[List[Tuple[int, int]]]:
+        batches = []
+        instances = chunked_reader.read(train_path)
+        for chunk in lazy_groups_of(iter(instances), args.max_instances_in_memory):
+            chunk_lengths = sorted(_get_lengths(instance) for instance in chunk)
+            batches.extend(lazy_groups_of(iter(chunk_lengths), args.batch_size))
+        return batches
+
+    def length_index_batches() -> List[List[Tuple[int, int]]]:
+        instances = length_index_reader.read(train_path)
+        lengths = [_get_lengths(instance) for instance in instances]
+        return list(lazy_groups_of(iter(lengths), args.batch_size))
+
+    results: Dict[str, float] = {}
+    # The first read builds the sidecar length index, so that only the reading is timed below.
+    num_instances = sum(len(batch) for batch in length_index_batches())
+    for name, read_batches in [("chunked", chunked_batches), ("length_index", length_index_batches)]:
+        results[f"padding_fraction_{name}_b{args.batch_size}"] = _padding_fraction(read_batches())
+        seconds = time_function(read_batches, args.num_warmup, args.num_repeats)
+        results[f"reader_instances_per_second_{name}"] = num_instances / seconds
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "length_index.json"))
@@ -0,0 +1,121 @@
+"""
+Benchmark of CPU ``bfloat16`` mixed precision against float32 for QANet.
+
+Measures, with the same weights in both precisions:
+
+1. The inference throughput and the time of one training forward/backward step.
+2. How much EM and F1 drop in bfloat16, and the fraction of questions whose best span changes.
+
+By default, the model of the experiment config is randomly initialised and evaluated on synthetic
+data, which only measures speed and agreement; give ``--archive-file`` and ``--data-file`` (e.g.
+the SQuAD dev set) to measure the accuracy of a trained model::
+
+    python -m benchmarks.mixed_precision_benchmark --archive-file model.tar.gz --data-file dev-v1.1.json
+
+The measurements are compared against ``benchmarks/baselines/mixed_precision.json``.  bfloat16
+needs torch >= 1.10, and is only faster on CPUs with native bfloat16 instructions.
+"""
+import argparse
+import logging
+import os
+import tempfile
+from typing import Dict, List
+
+import torch
+
+from allennlp.common import Params
+from allennlp.data import Instance, Vocabulary
+from allennlp.models import Model
+from allennlp.models.archival import load_archive
+
+from reading_comprehension.qanet import QaNet  # pylint: disable=unused-import
+from reading_comprehension.utils import bfloat16_autocast
+from benchmarks.common import BASELINES_ROOT, FIXTURES_ROOT, main, synthesize_squad_file, time_function
+from benchmarks.qanet_benchmark import build_reader, make_batch
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+PRECISIONS = {"fp32": False, "bf16": True}
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--config', type=str, default=os.path.join(FIXTURES_ROOT, "qanet", "experiment.json"),
+                        help='The experiment config of the model, unless --archive-file is given.')
+    parser.add_argument('--archive-file', type=str, help='A trained model to benchmark.')
+    parser.add_argument('--data-file', type=str, help='The SQuAD-format file to evaluate on.')
+    parser.add_argument('--passage-length', type=int, default=400)
+    parser.add_argument('--num-questions', type=int, default=64,
+                        help='The number of synthetic questions, without --data-file.')
+    parser.add_argument('--batch-size', type=int, default=16)
+
+
+def evaluate(model: Model, vocab: Vocabulary, instances: List[Instance],
+             batch_size: int, use_bfloat16: bool) -> Dict[str, object]:
+    model.eval()
+    model.get_metrics(reset=True)
+    best_spans = []
+    with torch.no_grad(), bfloat16_autocast(use_bfloat16):
+        for start in range(0, len(instances), batch_size):
+            batch_instances = instances[start:start + batch_size]
+            output_dict = model(**make_batch(batch_instances, vocab, len(batch_instances)))
+            best_spans.extend(tuple(span) for span in output_dict["best_span"].tolist())
+    metrics = model.get_metrics(reset=True)
+    return {"em": metrics["em"], "f1": metrics["f1"], "best_spans": best_spans}
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    if args.archive_file:
+        archive = load_archive(args.archive_file)
+        config = archive.config
+        model = archive.model
+        vocab = model.vocab
+    else:
+        config = Params.from_file(args.config)
+
+    data_path = args.data_file or synthesize_squad_file(os.path.join(tempfile.mkdtemp(), "synthetic_dev.json"),
+                                                        args.passage_length, args.num_questions)
+    instances = list(build_reader(config, args.passage_length).read(data_path))
+    if not args.archive_file:
+        vocab = Vocabulary.from_instances(instances)
+        model = Model.from_params(vocab=vocab, params=config.get("model").duplicate())
+
+    results: Dict[str, float] = {}
+    batch = make_batch(instances, vocab, args.batch_size)
+    suffix = f"p{args.passage_length}_b{args.batch_size}"
+    evaluations = {}
+    for precision, use_bfloat16 in PRECISIONS.items():
+        model.eval()
+
+        def inference(use_bfloat16=use_bfloat16):
+            with torch.no_grad(), bfloat16_autocast(use_bfloat16):
+                model(**batch)
+
+        seconds = time_function(inference, args.num_warmup, args.num_repeats)
+        results[f"inference_instances_per_second_{precision}_{suffix}"] = args.batch_size / seconds
+
+        model.train()
+
+        def train_step(use_bfloat16=use_bfloat16):
+            model.zero_grad()
+            with bfloat16_autocast(use_bfloat16):
+                loss = model(**batch)["loss"] + model.get_regularization_penalty()
+            loss.backward()
+
+        results[f"train_step_seconds_{precision}_{suffix}"] = \
+            time_function(train_step, args.num_warmup, args.num_repeats)
+
+        evaluations[precision] = evaluate(model, vocab, instances, args.batch_size, use_bfloat16)
+        logger.info("%s: EM %.4f, F1 %.4f on %d questions.", precision,
+                    evaluations[precision]["em"], evaluations[precision]["f1"], len(instances))
+
+    fp32, bf16 = evaluations["fp32"], evaluations["bf16"]
+    results["em_drop_bf16_vs_fp32"] = fp32["em"] - bf16["em"]
+    results["f1_drop_bf16_vs_fp32"] = fp32["f1"] - bf16["f1"]
+    num_changed = sum(fp32_span != bf16_span
+                      for fp32_span, bf16_span in zip(fp32["best_spans"], bf16["best_spans"]))
+    results["changed_best_span_fraction_bf16_vs_fp32"] = num_changed / len(instances)
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "mixed_precision.json"))
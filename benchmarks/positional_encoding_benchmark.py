@@ -0,0 +1,61 @@
+"""
+Benchmark of the positional encoding of ``QaNetEncoderBlock``: computing the sinusoids in every
+call (``allennlp.nn.util.add_positional_features``) against slicing them from the shared table of
+:class:`~reading_comprehension.modules.positional_encoding.SinusoidalPositionalEncoding`.
+
+Measures the one-off cost of building the table (``startup``), and the time of adding the features
+both ways in as many calls as in a QANet forward pass (1 phrase layer block, and 3 passes over the
+7 modeling layer blocks), and compares them against ``benchmarks/baselines/positional_encoding.json``::
+
+    python -m benchmarks.positional_encoding_benchmark
+"""
+import argparse
+import os
+from typing import Dict
+
+import torch
+
+from allennlp.nn.util import add_positional_features
+
+from reading_comprehension.modules.positional_encoding import SinusoidalPositionalEncoding
+from benchmarks.common import BASELINES_ROOT, main, time_function
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--hidden-dim', type=int, default=128)
+    parser.add_argument('--timesteps', type=int, nargs='+', default=[50, 400, 1000])
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-timesteps', type=int, default=512)
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    # pylint: disable=protected-access
+    results: Dict[str, float] = {}
+
+    def build_table():
+        SinusoidalPositionalEncoding._shared_tables.clear()
+        SinusoidalPositionalEncoding(args.max_timesteps).get_features(1, args.hidden_dim, torch.device("cpu"))
+
+    results[f"positional_table_startup_seconds_t{args.max_timesteps}"] = \
+        time_function(build_table, args.num_warmup, args.num_repeats)
+
+    positional_encoding = SinusoidalPositionalEncoding(args.max_timesteps)
+    # One phrase layer block, and 3 passes over the 7 blocks of the modeling layer.
+    num_block_calls = 1 + 3 * 7
+    for timesteps in args.timesteps:
+        inputs = torch.randn(args.batch_size, timesteps, args.hidden_dim)
+        positional_encoding(inputs)
+        implementations = {"recomputed": add_positional_features, "table": positional_encoding}
+        for name, implementation in implementations.items():
+            def forward(implementation=implementation):
+                with torch.no_grad():
+                    for _ in range(num_block_calls):
+                        implementation(inputs)
+
+            results[f"positional_encoding_forward_seconds_{name}_t{timesteps}_b{args.batch_size}"] = \
+                time_function(forward, args.num_warmup, args.num_repeats)
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "positional_encoding.json"))
@@ -0,0 +1,116 @@
+"""
+Reproducible CPU benchmark suite for QANet.
+
+Measures, for synthetic SQuAD-shaped data built from ``fixtures/qanet`` at several passage
+lengths:
+
+1. ``SquadReader`` throughput (instances per second, tokenization included).
+2. The time of one training forward/backward step.
+3. Inference latency at several batch sizes.
+4. The peak resident memory of the process after each passage length.
+
+and compares them against ``benchmarks/baselines/qanet.json``::
+
+    python -m benchmarks.qanet_benchmark                    # compare against the baseline
+    python -m benchmarks.qanet_benchmark --update-baseline  # record a new baseline
+
+Baselines are only comparable on the same machine with the same ``--num-threads``, so record
+one on the reference machine before relying on the regression check.
+"""
+import argparse
+import os
+import tempfile
+from typing import Dict, List
+
+import torch
+
+from allennlp.common import Params
+from allennlp.data import DatasetReader, Instance, Vocabulary
+from allennlp.data.dataset import Batch
+from allennlp.models import Model
+
+from reading_comprehension.qanet import QaNet  # pylint: disable=unused-import
+from reading_comprehension.qanet_encoder import QaNetEncoder  # pylint: disable=unused-import
+from reading_comprehension.squad_reader import SquadReader  # pylint: disable=unused-import
+from benchmarks.common import BASELINES_ROOT, FIXTURES_ROOT, main, peak_memory_mb, \
+    synthesize_squad_file, time_function
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--config', type=str, default=os.path.join(FIXTURES_ROOT, "qanet", "experiment.json"),
+                        help='The experiment config whose dataset reader and model we benchmark.')
+    parser.add_argument('--passage-lengths', type=int, nargs='+', default=[100, 400, 1000])
+    parser.add_argument('--inference-batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--train-batch-size', type=int, default=16)
+    parser.add_argument('--num-questions', type=int, default=64,
+                        help='The number of synthetic questions read per passage length.')
+
+
+def make_batch(instances: List[Instance], vocab: Vocabulary, batch_size: int) -> Dict[str, torch.Tensor]:
+    batch_instances = [instances[i % len(instances)] for i in range(batch_size)]
+    batch = Batch(batch_instances)
+    batch.index_instances(vocab)
+    return batch.as_tensor_dict()
+
+
+def build_reader(config: Params, passage_length: int) -> DatasetReader:
+    reader_params = config.get("dataset_reader").duplicate()
+    reader_params["passage_length_limit"] = passage_length
+    reader_params["passage_length_limit_for_evaluation"] = passage_length
+    return DatasetReader.from_params(reader_params)
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    config = Params.from_file(args.config)
+    results: Dict[str, float] = {}
+    data_dir = tempfile.mkdtemp()
+
+    datasets = {}
+    for passage_length in args.passage_lengths:
+        # "dev" in the name makes the reader keep (rather than drop) questions whose answer is cut.
+        data_path = synthesize_squad_file(os.path.join(data_dir, f"synthetic_dev_{passage_length}.json"),
+                                          passage_length, args.num_questions)
+        reader = build_reader(config, passage_length)
+        instances: List[Instance] = []
+
+        def read(reader=reader, data_path=data_path, instances=instances):
+            instances[:] = list(reader.read(data_path))
+
+        seconds = time_function(read, num_warmup=1, num_repeats=max(1, args.num_repeats // 5))
+        results[f"reader_instances_per_second_p{passage_length}"] = len(instances) / seconds
+        datasets[passage_length] = instances
+
+    vocab = Vocabulary.from_instances([instance for instances in datasets.values() for instance in instances])
+    model = Model.from_params(vocab=vocab, params=config.get("model").duplicate())
+
+    for passage_length in args.passage_lengths:
+        instances = datasets[passage_length]
+
+        model.train()
+        train_batch = make_batch(instances, vocab, args.train_batch_size)
+
+        def train_step(train_batch=train_batch):
+            model.zero_grad()
+            loss = model(**train_batch)["loss"] + model.get_regularization_penalty()
+            loss.backward()
+
+        results[f"train_step_seconds_p{passage_length}_b{args.train_batch_size}"] = \
+            time_function(train_step, args.num_warmup, args.num_repeats)
+
+        model.eval()
+        for batch_size in args.inference_batch_sizes:
+            inference_batch = make_batch(instances, vocab, batch_size)
+
+            def inference(inference_batch=inference_batch):
+                with torch.no_grad():
+                    model(**inference_batch)
+
+            results[f"inference_seconds_p{passage_length}_b{batch_size}"] = \
+                time_function(inference, args.num_warmup, args.num_repeats)
+
+        results[f"peak_memory_mb_p{passage_length}"] = peak_memory_mb()
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "qanet.json"))
@@ -0,0 +1,69 @@
+"""
+Benchmark of the alignment of the answers' character spans to token spans in the
+``squad_limited`` reader: one linear scan over the tokens per answer
+(``util.char_span_to_token_span``), against binary searches for all the answers of a paragraph at
+once (:func:`~reading_comprehension.utils.char_spans_to_token_spans`).
+
+The paragraphs of a synthetic SQuAD-shaped file are tokenized once up front, so that only the
+alignment is timed.  Reports the answers aligned per second both ways, and compares them against
+``benchmarks/baselines/span_alignment.json``::
+
+    python -m benchmarks.span_alignment_benchmark --passage-lengths 100 400 1000
+"""
+import argparse
+import json
+import os
+import tempfile
+from typing import Dict
+
+import numpy
+
+from allennlp.data.dataset_readers.reading_comprehension import util
+from allennlp.data.tokenizers import WordTokenizer
+
+from reading_comprehension.utils import char_spans_to_token_spans
+from benchmarks.common import BASELINES_ROOT, main, synthesize_squad_file, time_function
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--passage-lengths', type=int, nargs='+', default=[100, 400, 1000])
+    parser.add_argument('--num-questions', type=int, default=500)
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    tokenizer = WordTokenizer()
+    results: Dict[str, float] = {}
+    data_dir = tempfile.mkdtemp()
+
+    for passage_length in args.passage_lengths:
+        data_path = synthesize_squad_file(os.path.join(data_dir, f"synthetic_train_{passage_length}.json"),
+                                          passage_length, args.num_questions)
+        with open(data_path) as data_file:
+            paragraphs = json.load(data_file)["data"][0]["paragraphs"]
+        aligned_paragraphs = []
+        for paragraph in paragraphs:
+            tokens = tokenizer.tokenize(paragraph["context"])
+            offsets = [(token.idx, token.idx + len(token.text)) for token in tokens]
+            char_spans = [(answer["answer_start"], answer["answer_start"] + len(answer["text"]))
+                          for question_answer in paragraph["qas"] for answer in question_answer["answers"]]
+            aligned_paragraphs.append((offsets, char_spans))
+        num_answers = sum(len(char_spans) for _, char_spans in aligned_paragraphs)
+
+        def align_each_answer():
+            for offsets, char_spans in aligned_paragraphs:
+                for char_span in char_spans:
+                    util.char_span_to_token_span(offsets, char_span)
+
+        def align_paragraphs():
+            # Includes the conversion of the offsets, which the reader does once per paragraph.
+            for offsets, char_spans in aligned_paragraphs:
+                char_spans_to_token_spans(numpy.array(offsets), numpy.array(char_spans))
+
+        for name, function in [("linear_scan", align_each_answer), ("binary_search", align_paragraphs)]:
+            seconds = time_function(function, args.num_warmup, args.num_repeats)
+            results[f"span_alignment_answers_per_second_{name}_p{passage_length}"] = num_answers / seconds
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "span_alignment.json"))
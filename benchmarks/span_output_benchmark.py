@@ -0,0 +1,68 @@
+"""
+Benchmark of the masking in QaNet's output layer, for the span start and end logits of a batch:
+``memory_effient_masked_softmax``, ``replace_masked_values`` and ``masked_log_softmax`` (three
+maskings of the logits per head), against one :func:`~reading_comprehension.utils.masked_span_scores`
+per head.  Measures the time of the forward pass, and of the forward/backward pass of the loss, at
+several passage lengths, and compares them against ``benchmarks/baselines/span_output.json``::
+
+    python -m benchmarks.span_output_benchmark --passage-lengths 400 1000
+"""
+import argparse
+import os
+from typing import Dict
+
+import torch
+from torch.nn.functional import nll_loss
+
+from allennlp.nn.util import masked_log_softmax, replace_masked_values
+
+from reading_comprehension.utils import masked_span_scores, memory_effient_masked_softmax
+from benchmarks.common import BASELINES_ROOT, main, time_function
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--passage-lengths', type=int, nargs='+', default=[150, 400, 1000])
+    parser.add_argument('--batch-size', type=int, default=32)
+
+
+def separate_masking(logits: torch.Tensor, mask: torch.Tensor, gold: torch.Tensor) -> torch.Tensor:
+    probs = memory_effient_masked_softmax(logits, mask)
+    masked_logits = replace_masked_values(logits, mask, -1e7)
+    loss = nll_loss(masked_log_softmax(logits, mask), gold)
+    return loss + 0 * (probs.sum() + masked_logits.sum())
+
+
+def single_masking(logits: torch.Tensor, mask: torch.Tensor, gold: torch.Tensor) -> torch.Tensor:
+    masked_logits, probs, log_probs = masked_span_scores(logits, mask)
+    loss = nll_loss(log_probs, gold)
+    return loss + 0 * (probs.sum() + masked_logits.sum())
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    for passage_length in args.passage_lengths:
+        # Passages of a bucketed batch: the longest one fills the batch, the others are 80 to 100% of it.
+        lengths = torch.randint(int(0.8 * passage_length), passage_length + 1, (args.batch_size,))
+        lengths[0] = passage_length
+        mask = (torch.arange(passage_length).unsqueeze(0) < lengths.unsqueeze(1)).float()
+        gold = torch.zeros(args.batch_size, dtype=torch.long)
+        for name, scores in [("separate_masking", separate_masking), ("single_masking", single_masking)]:
+            logits = torch.randn(args.batch_size, passage_length, requires_grad=True)
+
+            def forward(scores=scores, logits=logits):
+                with torch.no_grad():
+                    for _ in range(2):  # The start and end heads.
+                        scores(logits, mask, gold)
+
+            def forward_backward(scores=scores, logits=logits):
+                sum(scores(logits, mask, gold) for _ in range(2)).backward()
+
+            results[f"span_output_forward_seconds_{name}_p{passage_length}_b{args.batch_size}"] = \
+                time_function(forward, args.num_warmup, args.num_repeats)
+            results[f"span_output_train_seconds_{name}_p{passage_length}_b{args.batch_size}"] = \
+                time_function(forward_backward, args.num_warmup, args.num_repeats)
+    return results
+
+
+if __name__ == "__main__":
+    main(__doc__, add_arguments, run, os.path.join(BASELINES_ROOT, "span_output.json"))
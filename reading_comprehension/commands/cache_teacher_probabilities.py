@@ -0,0 +1,109 @@
+"""
+The ``cache-teacher-probabilities`` subcommand saves the span start and end probabilities of a
+trained ``qanet`` archive (the teacher) on every question of a SQuAD-format training file, so that
+a smaller student model can distill them without running the teacher in every epoch.
+
+.. code-block:: bash
+
+    $ python -m reading_comprehension.run cache-teacher-probabilities \\
+        teacher.tar.gz squad-train-v1.1.json --output-file teacher_probabilities.npz
+
+The student then reads the file with the ``teacher_probabilities_file`` of its ``squad_limited``
+reader (see ``training_configs/squad_qanet_distilled.jsonnet``).  The passages are cut to the
+training ``passage_length_limit`` of the teacher's reader, unless ``--passage-length-limit`` is
+given, which should be at least the one of the student.
+"""
+import argparse
+import logging
+from typing import Dict, List, Tuple
+
+import numpy
+import torch
+
+from allennlp.commands.subcommand import Subcommand
+from allennlp.common.file_utils import cached_path
+from allennlp.common.util import JsonDict
+from allennlp.data import DatasetReader
+from allennlp.models import Model
+from allennlp.models.archival import load_archive
+from reading_comprehension.commands.predict_squad import read_questions
+from reading_comprehension.squad_reader import save_teacher_probabilities
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class CacheTeacherProbabilities(Subcommand):
+    def add_subparser(self, name: str, parser: argparse._SubParsersAction) -> argparse.ArgumentParser:
+        # pylint: disable=protected-access
+        description = '''Save the span probabilities of a qanet teacher model on a SQuAD training file.'''
+        subparser = parser.add_parser(name, description=description,
+                                      help='Cache the span probabilities of a teacher model for distillation.')
+
+        subparser.add_argument('archive_file', type=str, help='the archived teacher model')
+        subparser.add_argument('input_file', type=str, help='the SQuAD-format training file')
+        subparser.add_argument('--output-file', type=str, required=True,
+                               help='the .npz file to write the probabilities to')
+        subparser.add_argument('--passage-length-limit', type=int, default=None,
+                               help='the number of passage tokens the teacher reads (default: the '
+                                    'training passage_length_limit of its dataset reader)')
+        subparser.add_argument('--batch-size', type=int, default=32, help='the batch size to use')
+        subparser.add_argument('--max-instances-in-memory', type=int, default=1024,
+                               help='the number of instances that are sorted by length together')
+        subparser.add_argument('--cuda-device', type=int, default=-1, help='id of GPU to use (if any)')
+        subparser.add_argument('-o', '--overrides', type=str, default="",
+                               help='a JSON structure used to override the experiment configuration')
+
+        subparser.set_defaults(func=_cache_teacher_probabilities)
+
+        return subparser
+
+
+def _predict_chunk(model: Model,
+                   reader: DatasetReader,
+                   questions: List[JsonDict],
+                   passage_length_limit: int,
+                   batch_size: int) -> Dict[str, Tuple[numpy.ndarray, numpy.ndarray]]:
+    # pylint: disable=protected-access
+    instances = []
+    tokenized_passages: Dict[str, list] = {}
+    for question in questions:
+        passage_text = question["passage"]
+        if passage_text not in tokenized_passages:
+            tokenized_passages[passage_text] = reader._tokenizer.tokenize(passage_text)
+        instances.append(reader.text_to_instance(question["question"].strip().replace("\n", ""),
+                                                 passage_text,
+                                                 passage_tokens=tokenized_passages[passage_text],
+                                                 max_passage_len=passage_length_limit,
+                                                 max_question_len=reader.question_length_limit))
+    probabilities = {}
+    order = sorted(range(len(instances)), key=lambda i: len(instances[i].fields["passage"].tokens))
+    for batch_start in range(0, len(order), batch_size):
+        batch_indices = order[batch_start:batch_start + batch_size]
+        with torch.no_grad():
+            outputs = model.forward_on_instances([instances[i] for i in batch_indices])
+        for index, output in zip(batch_indices, outputs):
+            passage_length = len(instances[index].fields["passage"].tokens)
+            probabilities[questions[index]["id"]] = (output["span_start_probs"][:passage_length],
+                                                     output["span_end_probs"][:passage_length])
+    return probabilities
+
+
+def _cache_teacher_probabilities(args: argparse.Namespace) -> None:
+    archive = load_archive(args.archive_file, cuda_device=args.cuda_device, overrides=args.overrides)
+    model = archive.model
+    model.eval()
+    reader = DatasetReader.from_params(archive.config.duplicate().pop("dataset_reader"))
+    passage_length_limit = args.passage_length_limit or reader.passage_length_limit
+
+    probabilities: Dict[str, Tuple[numpy.ndarray, numpy.ndarray]] = {}
+    chunk: List[JsonDict] = []
+    for question in read_questions(cached_path(args.input_file), "squad"):
+        chunk.append(question)
+        if len(chunk) >= args.max_instances_in_memory:
+            probabilities.update(_predict_chunk(model, reader, chunk, passage_length_limit, args.batch_size))
+            logger.info("Predicted %d questions.", len(probabilities))
+            chunk = []
+    if chunk:
+        probabilities.update(_predict_chunk(model, reader, chunk, passage_length_limit, args.batch_size))
+    save_teacher_probabilities(args.output_file, probabilities)
+    logger.info("Saved the teacher probabilities of %d questions to %s", len(probabilities), args.output_file)
@@ -0,0 +1,40 @@
+"""
+The ``convert-pretrained-vectors`` subcommand converts a pretrained embeddings text file into a
+memory-mapped :class:`~reading_comprehension.pretrained_vector_store.PretrainedVectorStore`, once.
+
+.. code-block:: bash
+
+    $ python -m reading_comprehension.run convert-pretrained-vectors \\
+        https://s3-us-west-2.amazonaws.com/yizhongw-dev/glove/glove.840B.300d.lower.zip \\
+        /data/glove.840B.300d.lower --embedding-dim 300
+
+See ``training_configs/squad_qanet_vector_store.jsonnet`` for a configuration using the store.
+"""
+import argparse
+
+from allennlp.commands.subcommand import Subcommand
+from reading_comprehension.pretrained_vector_store import PretrainedVectorStore
+
+
+class ConvertPretrainedVectors(Subcommand):
+    def add_subparser(self, name: str, parser: argparse._SubParsersAction) -> argparse.ArgumentParser:
+        # pylint: disable=protected-access
+        description = '''Convert a pretrained embeddings text file into a memory-mapped vector store.'''
+        subparser = parser.add_parser(name, description=description,
+                                      help='Convert pretrained embeddings into a vector store.')
+
+        subparser.add_argument('embeddings_file', type=str,
+                               help='the (possibly zipped or remote) embeddings text file')
+        subparser.add_argument('output_dir', type=str, help='the directory to write the store to')
+        subparser.add_argument('--embedding-dim', type=int, required=True,
+                               help='the dimension of the pretrained vectors')
+        subparser.add_argument('--dtype', type=str, default='float32', choices=['float32', 'float16'],
+                               help='the type the vectors are stored with')
+
+        subparser.set_defaults(func=_convert)
+
+        return subparser
+
+
+def _convert(args: argparse.Namespace) -> None:
+    PretrainedVectorStore.convert(args.embeddings_file, args.output_dir, args.embedding_dim, args.dtype)
@@ -0,0 +1,237 @@
+"""
+The ``predict-squad`` subcommand scores a (large) SQuAD-format or JSON-lines file of questions with
+a trained ``qanet`` archive, streaming the predictions to disk.
+
+.. code-block:: bash
+
+    $ python -m reading_comprehension.run predict-squad \\
+        model.tar.gz questions.jsonl --output-file predictions.jsonl \\
+        --n-best-file n_best.jsonl --num-workers 4 --num-threads 2
+
+Each line of the output file is a one-entry json dictionary ``{question_id: best_span_str}``;
+merging all the lines gives the input expected by the official SQuAD evaluation script.  If
+``--n-best-file`` is given, each of its lines is ``{question_id: [n_best spans]}``.
+
+JSON-lines input has one ``{"id": ..., "question": ..., "passage": ...}`` object per line (we also
+accept ``"context"`` for the passage) and is read lazily.  A SQuAD-format file is a single json
+document, so it is parsed as a whole, but its instances are still created lazily.  Either way, at
+most ``--max-instances-in-memory`` instances exist at any time: they are sorted by passage length
+and split into batches, so that little computation is wasted on padding.
+
+The command is resumable: questions whose id is already in the output file are skipped, so
+re-running the same command after an interruption only scores the remaining questions.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+from typing import Dict, Iterator, List, Set, TextIO
+
+import torch
+
+from allennlp.commands.subcommand import Subcommand
+from allennlp.common.util import JsonDict
+from allennlp.data import Instance
+from allennlp.models.archival import load_archive
+from allennlp.predictors.predictor import Predictor
+from reading_comprehension.qanet_predictor import QaNetPredictor
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class PredictSquad(Subcommand):
+    def add_subparser(self, name: str, parser: argparse._SubParsersAction) -> argparse.ArgumentParser:
+        # pylint: disable=protected-access
+        description = '''Batch-score a SQuAD-format or JSON-lines question file with a qanet model.'''
+        subparser = parser.add_parser(name, description=description,
+                                      help='Stream SQuAD predictions of a qanet model to disk.')
+
+        subparser.add_argument('archive_file', type=str, help='the archived model to make predictions with')
+        subparser.add_argument('input_file', type=str, help='the SQuAD-format or JSON-lines input file')
+        subparser.add_argument('--output-file', type=str, required=True,
+                               help='the JSON-lines file to write (or resume writing) predictions to')
+        subparser.add_argument('--input-format', type=str, choices=['squad', 'jsonl'],
+                               help='the format of the input file (default: jsonl for a .jsonl '
+                                    'extension, squad otherwise)')
+        subparser.add_argument('--n-best-file', type=str,
+                               help='if given, also write the n best spans of every question here')
+        subparser.add_argument('--n-best-size', type=int, default=20,
+                               help='the number of spans to write to the n-best file')
+        subparser.add_argument('--max-span-length', type=int, default=None,
+                               help='the maximum number of tokens of a span in the n-best file')
+        subparser.add_argument('--batch-size', type=int, default=32, help='the batch size to use')
+        subparser.add_argument('--max-instances-in-memory', type=int, default=1024,
+                               help='the number of instances that are sorted by length together')
+        subparser.add_argument('--num-workers', type=int, default=1,
+                               help='the number of worker processes, each scoring one shard of the input')
+        subparser.add_argument('--num-threads', type=int, default=None,
+                               help='the number of intra-op threads of each worker')
+        subparser.add_argument('--cuda-device', type=int, default=-1, help='id of GPU to use (if any)')
+        subparser.add_argument('--bfloat16', action='store_true',
+                               help='run the model under a bfloat16 autocast (needs torch >= 1.10)')
+        subparser.add_argument('-o', '--overrides', type=str, default="",
+                               help='a JSON structure used to override the experiment configuration')
+
+        subparser.set_defaults(func=_predict_squad)
+
+        return subparser
+
+
+def read_questions(input_file: str, input_format: str) -> Iterator[JsonDict]:
+    if input_format == "jsonl":
+        with open(input_file) as questions_file:
+            for line in questions_file:
+                if not line.strip():
+                    continue
+                question = json.loads(line)
+                yield {"id": question["id"],
+                       "question": question["question"],
+                       "passage": question["passage"] if "passage" in question else question["context"]}
+    else:
+        with open(input_file) as dataset_file:
+            dataset = json.load(dataset_file)["data"]
+        for article in dataset:
+            for paragraph_json in article["paragraphs"]:
+                for question_answer in paragraph_json["qas"]:
+                    yield {"id": question_answer["id"],
+                           "question": question_answer["question"],
+                           "passage": paragraph_json["context"]}
+
+
+def _load_completed_ids(predictions_path: str) -> Set[str]:
+    """
+    Returns the question ids already in a (possibly interrupted) JSON-lines predictions file.  A
+    trailing partial line, written when the process was killed, is truncated away, so that we can
+    keep appending to the file.
+    """
+    completed_ids: Set[str] = set()
+    if not os.path.exists(predictions_path):
+        return completed_ids
+    valid_length = 0
+    with open(predictions_path, "rb+") as predictions_file:
+        for line in predictions_file:
+            if not line.endswith(b"\n"):
+                break
+            completed_ids.update(json.loads(line.decode("utf-8")).keys())
+            valid_length += len(line)
+        predictions_file.truncate(valid_length)
+    return completed_ids
+
+
+def _questions_to_instances(predictor: QaNetPredictor, questions: List[JsonDict]) -> List[Instance]:
+    # Consecutive SQuAD questions usually share a passage, so we only tokenize it once.
+    reader = predictor._dataset_reader  # pylint: disable=protected-access
+    instances = []
+    tokenized_passages: Dict[str, list] = {}
+    for question in questions:
+        passage_text = question["passage"]
+        if passage_text not in tokenized_passages:
+            tokenized_passages[passage_text] = reader._tokenizer.tokenize(passage_text)  # pylint: disable=protected-access
+        instances.append(reader.text_to_instance(question["question"].strip().replace("\n", ""),
+                                                 passage_text,
+                                                 passage_tokens=tokenized_passages[passage_text],
+                                                 max_passage_len=reader.passage_length_limit_for_eval,
+                                                 max_question_len=reader.question_length_limit_for_eval))
+    return instances
+
+
+def _predict_chunk(predictor: QaNetPredictor,
+                   questions: List[JsonDict],
+                   args: argparse.Namespace,
+                   predictions_file: TextIO,
+                   n_best_file: TextIO = None,
+                   n_best_completed_ids: Set[str] = None) -> None:
+    instances = _questions_to_instances(predictor, questions)
+    order = sorted(range(len(instances)), key=lambda i: len(instances[i].fields["passage"].tokens))
+    for batch_start in range(0, len(order), args.batch_size):
+        batch_indices = order[batch_start:batch_start + args.batch_size]
+        with torch.no_grad():
+            predictions = predictor.predict_instances([instances[i] for i in batch_indices],
+                                                      n_best_size=args.n_best_size if n_best_file else 0,
+                                                      max_span_length=args.max_span_length)
+        for index, prediction in zip(batch_indices, predictions):
+            question_id = questions[index]["id"]
+            # The n-best line goes first: the predictions file decides what is completed.
+            if n_best_file is not None and question_id not in n_best_completed_ids:
+                n_best_file.write(json.dumps({question_id: prediction["n_best"]}) + "\n")
+            predictions_file.write(json.dumps({question_id: prediction["best_span_str"]}) + "\n")
+        if n_best_file is not None:
+            n_best_file.flush()
+        predictions_file.flush()
+
+
+def _shard_path(path: str, shard_index: int, num_shards: int) -> str:
+    if path is None or num_shards == 1:
+        return path
+    return f"{path}.part{shard_index}-of-{num_shards}"
+
+
+def _predict_shard(args: argparse.Namespace, shard_index: int, num_shards: int) -> None:
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    archive = load_archive(args.archive_file, cuda_device=args.cuda_device, overrides=args.overrides)
+    predictor = Predictor.from_archive(archive, "qanet")
+    predictor.use_bfloat16 = args.bfloat16
+
+    predictions_path = _shard_path(args.output_file, shard_index, num_shards)
+    n_best_path = _shard_path(args.n_best_file, shard_index, num_shards)
+    completed_ids = _load_completed_ids(predictions_path)
+    if predictions_path != args.output_file:
+        completed_ids |= _load_completed_ids(args.output_file)
+    n_best_completed_ids = _load_completed_ids(n_best_path) if n_best_path else None
+    if completed_ids:
+        logger.info("Shard %d: resuming after %d completed questions.", shard_index, len(completed_ids))
+
+    input_format = args.input_format or ("jsonl" if args.input_file.endswith(".jsonl") else "squad")
+    n_best_file = open(n_best_path, "a") if n_best_path else None
+    num_predicted = 0
+    try:
+        with open(predictions_path, "a") as predictions_file:
+            chunk: List[JsonDict] = []
+            for index, question in enumerate(read_questions(args.input_file, input_format)):
+                if index % num_shards != shard_index or question["id"] in completed_ids:
+                    continue
+                chunk.append(question)
+                if len(chunk) >= args.max_instances_in_memory:
+                    _predict_chunk(predictor, chunk, args, predictions_file, n_best_file, n_best_completed_ids)
+                    num_predicted += len(chunk)
+                    logger.info("Shard %d: predicted %d questions.", shard_index, num_predicted)
+                    chunk = []
+            if chunk:
+                _predict_chunk(predictor, chunk, args, predictions_file, n_best_file, n_best_completed_ids)
+                num_predicted += len(chunk)
+    finally:
+        if n_best_file is not None:
+            n_best_file.close()
+    logger.info("Shard %d: done, predicted %d questions.", shard_index, num_predicted)
+
+
+def _merge_shards(path: str, num_shards: int) -> None:
+    with open(path, "a") as merged_file:
+        for shard_index in range(num_shards):
+            shard_path = _shard_path(path, shard_index, num_shards)
+            with open(shard_path) as shard_file:
+                for line in shard_file:
+                    merged_file.write(line)
+    for shard_index in range(num_shards):
+        os.remove(_shard_path(path, shard_index, num_shards))
+
+
+def _predict_squad(args: argparse.Namespace) -> None:
+    if args.num_workers == 1:
+        _predict_shard(args, 0, 1)
+        return
+
+    workers = [multiprocessing.Process(target=_predict_shard, args=(args, shard_index, args.num_workers))
+               for shard_index in range(args.num_workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    failed = [shard_index for shard_index, worker in enumerate(workers) if worker.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Shards {failed} failed; re-run the same command to resume them.")
+    _merge_shards(args.output_file, args.num_workers)
+    if args.n_best_file:
+        _merge_shards(args.n_best_file, args.num_workers)
@@ -0,0 +1,173 @@
+"""
+The ``prune-archive`` subcommand turns a trained archive into a slim deployment archive whose
+token vocabulary (and embedding matrix) only keeps the words observed in a sample of production
+traffic.
+
+.. code-block:: bash
+
+    $ python -m reading_comprehension.run prune-archive model.tar.gz traffic_sample.jsonl \\
+        --output-archive slim_model.tar.gz --fp16 --memory-mapped-embedding /models/slim_tokens.npy
+
+Every other word is mapped to the OOV token, exactly as a word outside the original vocabulary
+already was.  All the other vocabulary namespaces (e.g. ``token_characters``) and parameters are
+kept as they are, so for observed words the slim model makes exactly the same predictions (up to
+the rounding of the embeddings with ``--fp16``).
+
+With ``--memory-mapped-embedding``, the pruned matrix is written to the given ``.npy`` file and the
+slim model reads it through a
+:class:`~reading_comprehension.modules.memory_mapped_embedding.MemoryMappedEmbedding`, which keeps
+it out of the resident memory of the inference workers.  The archive refers to the file by its
+absolute path, so it must be deployed at that same path.  ``--fp16`` requires
+``--memory-mapped-embedding``: an ``Embedding`` would load float16 weights back into its float32
+parameter, which saves nothing once the archive is loaded.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, List
+
+import numpy
+import torch
+
+from allennlp.commands.subcommand import Subcommand
+from allennlp.common.checks import ConfigurationError
+from allennlp.data import DatasetReader, Vocabulary
+from allennlp.models.archival import archive_model, load_archive, CONFIG_NAME
+from reading_comprehension.commands.predict_squad import read_questions
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class PruneArchive(Subcommand):
+    def add_subparser(self, name: str, parser: argparse._SubParsersAction) -> argparse.ArgumentParser:
+        # pylint: disable=protected-access
+        description = '''Prune the token vocabulary and embedding of an archive to the words of a corpus.'''
+        subparser = parser.add_parser(name, description=description,
+                                      help='Write a slim archive for deployment.')
+
+        subparser.add_argument('archive_file', type=str, help='the archived model to prune')
+        subparser.add_argument('corpus_files', type=str, nargs='+',
+                               help='SQuAD-format or JSON-lines samples of the traffic the model will see')
+        subparser.add_argument('--output-archive', type=str, required=True, help='where to write the slim archive')
+        subparser.add_argument('--input-format', type=str, choices=['squad', 'jsonl'],
+                               help='the format of the corpus files (default: jsonl for a .jsonl '
+                                    'extension, squad otherwise)')
+        subparser.add_argument('--token-embedder', type=str, default='tokens',
+                               help='the key of the token embedder to prune in the text field embedder')
+        subparser.add_argument('--min-count', type=int, default=1,
+                               help='keep the words observed at least this many times')
+        subparser.add_argument('--fp16', action='store_true',
+                               help='store the pruned embedding in float16 (requires --memory-mapped-embedding)')
+        subparser.add_argument('--memory-mapped-embedding', type=str,
+                               help='write the pruned embedding to this .npy file and memory-map it')
+
+        subparser.set_defaults(func=_prune_archive)
+
+        return subparser
+
+
+def count_corpus_tokens(reader: DatasetReader,
+                        corpus_files: List[str],
+                        input_format: str = None) -> Dict[str, Dict[str, int]]:
+    """
+    Counts the vocabulary items that the token indexers of ``reader`` produce for the questions
+    and passages of ``corpus_files``, by namespace.
+    """
+    # pylint: disable=protected-access
+    counter: Dict[str, Dict[str, int]] = collections.defaultdict(lambda: collections.defaultdict(int))
+    for corpus_file in corpus_files:
+        file_format = input_format or ("jsonl" if corpus_file.endswith(".jsonl") else "squad")
+        last_passage = None
+        for question in read_questions(corpus_file, file_format):
+            texts = [question["question"]]
+            # Consecutive SQuAD questions share a passage, which we only count once.
+            if question["passage"] != last_passage:
+                texts.append(question["passage"])
+                last_passage = question["passage"]
+            for text in texts:
+                for token in reader._tokenizer.tokenize(text):
+                    for indexer in reader._token_indexers.values():
+                        indexer.count_vocab_items(token, counter)
+    return counter
+
+
+def prune_namespace(vocab: Vocabulary, namespace: str, tokens_to_keep: Dict[str, int]) -> List[int]:
+    """
+    Returns, in order, the indices in ``vocab`` of the tokens of ``namespace`` that we keep: the
+    padding and OOV tokens, followed by the tokens in ``tokens_to_keep``.
+    """
+    # pylint: disable=protected-access
+    kept_indices = []
+    for index, token in vocab.get_index_to_token_vocabulary(namespace).items():
+        if token in (vocab._padding_token, vocab._oov_token) or token in tokens_to_keep:
+            kept_indices.append(index)
+    return sorted(kept_indices)
+
+
+def _prune_archive(args: argparse.Namespace) -> None:
+    # pylint: disable=protected-access
+    if args.fp16 and not args.memory_mapped_embedding:
+        raise ConfigurationError("--fp16 requires --memory-mapped-embedding: an Embedding loads its "
+                                 "weight as float32.")
+    archive = load_archive(args.archive_file)
+    model = archive.model
+    config = archive.config.duplicate()
+    reader = DatasetReader.from_params(config.get("dataset_reader").duplicate())
+
+    token_embedders_params = config.get("model").get("text_field_embedder").get("token_embedders")
+    embedder_params = token_embedders_params.get(args.token_embedder)
+    embedder = getattr(model._text_field_embedder, f"token_embedder_{args.token_embedder}")
+    if getattr(embedder, "_projection", None) is not None:
+        raise ConfigurationError("We can only prune token embedders without a projection.")
+    namespace = embedder_params.get("vocab_namespace", "tokens")
+
+    counter = count_corpus_tokens(reader, args.corpus_files, args.input_format)
+    observed_tokens = {token: count for token, count in counter[namespace].items() if count >= args.min_count}
+    kept_indices = prune_namespace(model.vocab, namespace, observed_tokens)
+    logger.info("Keeping %d of the %d entries of the '%s' namespace.",
+                len(kept_indices), model.vocab.get_vocab_size(namespace), namespace)
+
+    serialization_dir = tempfile.mkdtemp()
+    try:
+        # The vocabulary files list the tokens in index order, without the padding token.
+        vocab_dir = os.path.join(serialization_dir, "vocabulary")
+        model.vocab.save_to_files(vocab_dir)
+        index_to_token = model.vocab.get_index_to_token_vocabulary(namespace)
+        with open(os.path.join(vocab_dir, f"{namespace}.txt"), "w", encoding="utf-8") as namespace_file:
+            for index in kept_indices:
+                if index_to_token[index] != model.vocab._padding_token:
+                    namespace_file.write(index_to_token[index].replace('\n', '@@NEWLINE@@') + '\n')
+        if Vocabulary.from_files(vocab_dir).get_vocab_size(namespace) != len(kept_indices):
+            raise ConfigurationError(f"Could not rebuild the '{namespace}' namespace.")
+
+        weight_name = f"_text_field_embedder.token_embedder_{args.token_embedder}.weight"
+        model_state = model.state_dict()
+        pruned_weight = model_state[weight_name].index_select(0, torch.LongTensor(kept_indices))
+        if args.fp16:
+            pruned_weight = pruned_weight.half()
+
+        for key in ("pretrained_file", "num_embeddings"):
+            if key in embedder_params:
+                embedder_params.pop(key)
+        if args.memory_mapped_embedding:
+            embedding_file = os.path.abspath(args.memory_mapped_embedding)
+            numpy.save(embedding_file, pruned_weight.cpu().numpy())
+            del model_state[weight_name]
+            embedder_params = {"type": "memory_mapped_embedding",
+                               "embedding_file": embedding_file,
+                               "vocab_namespace": namespace}
+            config["model"]["text_field_embedder"]["token_embedders"][args.token_embedder] = embedder_params
+        else:
+            model_state[weight_name] = pruned_weight
+            embedder_params["num_embeddings"] = len(kept_indices)
+
+        torch.save(model_state, os.path.join(serialization_dir, "weights.th"))
+        with open(os.path.join(serialization_dir, CONFIG_NAME), "w") as config_file:
+            json.dump(config.as_dict(quiet=True), config_file, indent=4)
+        archive_model(serialization_dir, weights="weights.th", archive_path=args.output_archive)
+    finally:
+        shutil.rmtree(serialization_dir, ignore_errors=True)
@@ -0,0 +1,394 @@
+"""
+The ``serve-qanet`` subcommand serves a trained ``qanet`` archive for online question answering on
+CPU, either over HTTP or over stdin/stdout.
+
+.. code-block:: bash
+
+    $ python -m reading_comprehension.run serve-qanet model.tar.gz --port 8000 \\
+        --num-workers 4 --num-threads 2 --max-batch-size 16 --max-batch-latency-ms 10
+    $ curl -d '{"question": "...", "passage": "..."}' localhost:8000/predict
+    $ curl localhost:8000/metrics
+
+    $ python -m reading_comprehension.run serve-qanet model.tar.gz --stdin < questions.jsonl
+
+The archive is loaded once, in the parent process, and its tensors are moved to shared memory
+before forking the workers, so all workers read the same copy of the weights (most notably of the
+large pretrained embedding matrix) instead of holding one copy each.
+
+Requests go through a single queue.  A worker takes the oldest request and keeps collecting more
+until it has ``--max-batch-size`` of them or the oldest one has waited ``--max-batch-latency-ms``,
+then runs the whole micro-batch through the model at once.  ``/metrics`` reports the p50/p99
+latency over the most recent requests, the number of requests waiting in the queue and the number
+of requests in flight.
+
+A malformed request only fails itself: it gets an ``{"error": ...}`` response (an error line, with
+``--stdin``), and the requests batched with it are still answered.  HTTP requests that get no
+predictions within ``--request-timeout`` seconds are answered with a 504.
+"""
+import argparse
+import collections
+import itertools
+import json
+import logging
+import queue
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict
+
+import torch
+import torch.multiprocessing
+
+from allennlp.commands.subcommand import Subcommand
+from allennlp.common.util import JsonDict
+from allennlp.models.archival import load_archive
+from allennlp.predictors.predictor import Predictor
+from reading_comprehension.qanet_predictor import QaNetPredictor
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class ServeQaNet(Subcommand):
+    def add_subparser(self, name: str, parser: argparse._SubParsersAction) -> argparse.ArgumentParser:
+        # pylint: disable=protected-access
+        description = '''Serve a qanet model with several CPU worker processes sharing its weights.'''
+        subparser = parser.add_parser(name, description=description,
+                                      help='Serve a qanet model over HTTP or stdin/stdout.')
+
+        subparser.add_argument('archive_file', type=str, help='the archived model to serve')
+        subparser.add_argument('--stdin', action='store_true',
+                               help='read JSON-lines requests from stdin and write predictions to '
+                                    'stdout, instead of serving HTTP')
+        subparser.add_argument('--host', type=str, default='127.0.0.1', help='the interface to listen on')
+        subparser.add_argument('--port', type=int, default=8000, help='the port to listen on')
+        subparser.add_argument('--num-workers', type=int, default=1, help='the number of worker processes')
+        subparser.add_argument('--num-threads', type=int, default=1,
+                               help='the number of intra-op threads of each worker')
+        subparser.add_argument('--max-batch-size', type=int, default=16,
+                               help='the maximum number of requests in a micro-batch')
+        subparser.add_argument('--max-batch-latency-ms', type=float, default=10.0,
+                               help='how long the oldest request may wait for a micro-batch to fill up')
+        subparser.add_argument('--request-timeout', type=float, default=30.0,
+                               help='how many seconds an HTTP request waits for its predictions')
+        subparser.add_argument('--n-best-size', type=int, default=0,
+                               help='if positive, also return this many best spans per request')
+        subparser.add_argument('--max-span-length', type=int, default=None,
+                               help='the maximum number of tokens of an n-best span')
+        subparser.add_argument('--bfloat16', action='store_true',
+                               help='run the model under a bfloat16 autocast (needs torch >= 1.10)')
+        subparser.add_argument('-o', '--overrides', type=str, default="",
+                               help='a JSON structure used to override the experiment configuration')
+
+        subparser.set_defaults(func=_serve)
+
+        return subparser
+
+
+class LatencyMetrics:
+    """
+    Thread-safe latency and throughput statistics over the most recent ``window_size`` requests.
+    """
+    def __init__(self, window_size: int = 10000) -> None:
+        self._latencies = collections.deque(maxlen=window_size)
+        self._lock = threading.Lock()
+        self._num_requests = 0
+        self._num_errors = 0
+        self._start_time = time.time()
+
+    def record(self, latency: float, error: bool = False) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+            self._num_requests += 1
+            if error:
+                self._num_errors += 1
+
+    def get_metrics(self) -> Dict[str, float]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            num_requests = self._num_requests
+            num_errors = self._num_errors
+        metrics = {"num_requests": num_requests,
+                   "num_errors": num_errors,
+                   "requests_per_second": num_requests / (time.time() - self._start_time)}
+        for percentile in (50, 90, 99):
+            if latencies:
+                index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+                metrics[f"latency_p{percentile}_ms"] = 1000 * latencies[index]
+            else:
+                metrics[f"latency_p{percentile}_ms"] = 0.0
+        return metrics
+
+
+class _PendingRequest:
+    def __init__(self, arrival_time: float) -> None:
+        self.arrival_time = arrival_time
+        self.done = threading.Event()
+        self.result: JsonDict = None
+
+
+def _worker_loop(predictor: QaNetPredictor,
+                 request_queue: torch.multiprocessing.Queue,
+                 response_queue: torch.multiprocessing.Queue,
+                 num_threads: int,
+                 max_batch_size: int,
+                 max_batch_latency: float,
+                 n_best_size: int,
+                 max_span_length: int) -> None:
+    torch.set_num_threads(num_threads)
+    stopping = False
+    while not stopping:
+        request = request_queue.get()
+        if request is None:
+            break
+        batch = [request]
+        # The batch is due when its oldest request has waited long enough; after that, we only
+        # add the requests that are already waiting in the queue.
+        deadline = request[2] + max_batch_latency
+        while len(batch) < max_batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    request = request_queue.get(timeout=timeout)
+                else:
+                    request = request_queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                stopping = True
+                break
+            batch.append(request)
+
+        # A malformed request only fails itself, not the requests batched with it.
+        request_ids = []
+        instances = []
+        for request_id, inputs, _ in batch:
+            try:
+                instances.append(predictor._json_to_instance(inputs))  # pylint: disable=protected-access
+                request_ids.append(request_id)
+            except Exception as error:  # pylint: disable=broad-except
+                response_queue.put((request_id, None, f"{type(error).__name__}: {error}"))
+        if not instances:
+            continue
+        try:
+            with torch.no_grad():
+                predictions = predictor.predict_instances(instances, n_best_size, max_span_length)
+            for request_id, prediction in zip(request_ids, predictions):
+                response_queue.put((request_id, prediction, None))
+        except Exception as error:  # pylint: disable=broad-except
+            logger.exception("Failed to predict a batch of %d requests.", len(instances))
+            for request_id in request_ids:
+                response_queue.put((request_id, None, f"{type(error).__name__}: {error}"))
+
+
+class QaNetServer:
+    """
+    Owns the worker processes and the request/response queues, and hands out predictions to the
+    threads waiting for them.
+
+    Parameters
+    ----------
+    predictor : ``QaNetPredictor``
+        The predictor to serve.  Its model parameters are moved to shared memory.
+    num_workers : ``int``
+        The number of worker processes.
+    num_threads : ``int``
+        The number of intra-op threads of each worker.
+    max_batch_size : ``int``
+        The maximum number of requests in a micro-batch.
+    max_batch_latency : ``float``
+        How long (in seconds) the oldest request in a micro-batch may wait for the batch to fill.
+    n_best_size : ``int``, optional (default = 0)
+        If positive, we also return this many best spans per request.
+    max_span_length : ``int``, optional (default = None)
+        The maximum number of tokens of an n-best span.
+    """
+    def __init__(self,
+                 predictor: QaNetPredictor,
+                 num_workers: int,
+                 num_threads: int,
+                 max_batch_size: int,
+                 max_batch_latency: float,
+                 n_best_size: int = 0,
+                 max_span_length: int = None) -> None:
+        predictor._model.eval()  # pylint: disable=protected-access
+        predictor._model.share_memory()  # pylint: disable=protected-access
+
+        # With "fork", the workers inherit the predictor (and the shared weights) without pickling.
+        context = torch.multiprocessing.get_context("fork")
+        self._request_queue = context.Queue()
+        self._response_queue = context.Queue()
+        self._workers = [context.Process(target=_worker_loop,
+                                         args=(predictor, self._request_queue, self._response_queue,
+                                               num_threads, max_batch_size, max_batch_latency,
+                                               n_best_size, max_span_length),
+                                         daemon=True)
+                         for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+        self.metrics = LatencyMetrics()
+        self._pending: Dict[int, _PendingRequest] = {}
+        self._pending_lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._dispatcher = threading.Thread(target=self._dispatch_responses, daemon=True)
+        self._dispatcher.start()
+
+    def _dispatch_responses(self) -> None:
+        while True:
+            response = self._response_queue.get()
+            if response is None:
+                break
+            request_id, prediction, error = response
+            with self._pending_lock:
+                pending = self._pending.pop(request_id)
+            self.metrics.record(time.time() - pending.arrival_time, error is not None)
+            pending.result = prediction if error is None else {"error": error}
+            pending.done.set()
+
+    def submit(self, inputs: JsonDict) -> _PendingRequest:
+        arrival_time = time.time()
+        request_id = next(self._request_ids)
+        pending = _PendingRequest(arrival_time)
+        with self._pending_lock:
+            self._pending[request_id] = pending
+        self._request_queue.put((request_id, inputs, arrival_time))
+        return pending
+
+    def predict(self, inputs: JsonDict, timeout: float = None) -> JsonDict:
+        pending = self.submit(inputs)
+        if not pending.done.wait(timeout):
+            return {"error": "timed out"}
+        return pending.result
+
+    def get_metrics(self) -> Dict[str, Any]:
+        metrics = self.metrics.get_metrics()
+        try:
+            metrics["queue_depth"] = self._request_queue.qsize()
+        except NotImplementedError:  # qsize() is not available on OSX.
+            metrics["queue_depth"] = -1
+        with self._pending_lock:
+            metrics["requests_in_flight"] = len(self._pending)
+        metrics["num_workers"] = sum(worker.is_alive() for worker in self._workers)
+        return metrics
+
+    def shutdown(self) -> None:
+        for _ in self._workers:
+            self._request_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._response_queue.put(None)
+        self._dispatcher.join()
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _make_handler(server: QaNetServer, request_timeout: float):
+    class QaNetRequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: Any) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path == "/metrics":
+                self._send_json(200, server.get_metrics())
+            else:
+                self._send_json(404, {"error": f"unknown path {self.path}"})
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            if self.path != "/predict":
+                self._send_json(404, {"error": f"unknown path {self.path}"})
+                return
+            try:
+                inputs = json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+            except (TypeError, ValueError) as error:
+                self._send_json(400, {"error": f"invalid json: {error}"})
+                return
+            # A list of questions is submitted at once, so that they can share micro-batches.
+            if isinstance(inputs, list):
+                pendings = [server.submit(question) for question in inputs]
+                deadline = time.time() + request_timeout
+                for pending in pendings:
+                    if not pending.done.wait(max(0.0, deadline - time.time())):
+                        self._send_json(504, {"error": "timed out"})
+                        return
+                self._send_json(200, [pending.result for pending in pendings])
+            else:
+                pending = server.submit(inputs)
+                if pending.done.wait(request_timeout):
+                    self._send_json(200, pending.result)
+                else:
+                    self._send_json(504, {"error": "timed out"})
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            logger.debug(format, *args)
+
+    return QaNetRequestHandler
+
+
+def _serve_stdin(server: QaNetServer, max_in_flight: int) -> None:
+    # Requests are submitted as soon as they are read (up to `max_in_flight` of them), so that they
+    # can be micro-batched, and their predictions are written in the order of the input lines.
+    in_flight: "queue.Queue[_PendingRequest]" = queue.Queue(maxsize=max_in_flight)
+
+    def submit_lines():
+        try:
+            for line in sys.stdin:
+                if not line.strip():
+                    continue
+                try:
+                    inputs = json.loads(line)
+                except ValueError as error:
+                    # The error takes the place of the prediction, so the output stays aligned.
+                    pending = _PendingRequest(time.time())
+                    pending.result = {"error": f"invalid json: {error}"}
+                    pending.done.set()
+                    in_flight.put(pending)
+                    continue
+                in_flight.put(server.submit(inputs))
+        finally:
+            in_flight.put(None)
+
+    threading.Thread(target=submit_lines, daemon=True).start()
+    while True:
+        pending = in_flight.get()
+        if pending is None:
+            break
+        pending.done.wait()
+        sys.stdout.write(json.dumps(pending.result) + "\n")
+        sys.stdout.flush()
+    logger.info("Metrics: %s", json.dumps(server.get_metrics()))
+
+
+def _serve(args: argparse.Namespace) -> None:
+    archive = load_archive(args.archive_file, cuda_device=-1, overrides=args.overrides)
+    predictor = Predictor.from_archive(archive, "qanet")
+    predictor.use_bfloat16 = args.bfloat16
+    server = QaNetServer(predictor,
+                         num_workers=args.num_workers,
+                         num_threads=args.num_threads,
+                         max_batch_size=args.max_batch_size,
+                         max_batch_latency=args.max_batch_latency_ms / 1000,
+                         n_best_size=args.n_best_size,
+                         max_span_length=args.max_span_length)
+    try:
+        if args.stdin:
+            _serve_stdin(server, max_in_flight=args.num_workers * args.max_batch_size * 4)
+        else:
+            http_server = _ThreadingHTTPServer((args.host, args.port), _make_handler(server, args.request_timeout))
+            logger.info("Serving %s on http://%s:%d with %d workers.",
+                        args.archive_file, args.host, args.port, args.num_workers)
+            try:
+                http_server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            http_server.server_close()
+    finally:
+        server.shutdown()
@@ -0,0 +1,114 @@
+"""
+The ``train-distributed`` subcommand trains a model with an ``ema_trainer`` in several CPU
+processes, on one or several hosts, with data-parallel ``gloo`` collectives.
+
+.. code-block:: bash
+
+    $ python -m reading_comprehension.run train-distributed training_configs/squad_qanet.jsonnet \\
+        -s /output --num-processes 4 --num-threads 8
+
+    # Two hosts with 2 processes each, run on both hosts with their --node-rank:
+    $ python -m reading_comprehension.run train-distributed config.jsonnet -s /output \\
+        --num-processes 2 --num-nodes 2 --node-rank 0 --master-addr host0 --master-port 29500
+
+The vocabulary is built once per host before starting the processes, so that all of them use the
+same one.  Each process then reads its own shard of the training data (the ``squad_limited``
+reader's ``shard_training_data``), and its ``EMATrainer`` all-reduces the gradients (its
+``distributed`` option).  Only the process of rank 0 writes to the serialization directory; the
+other ones write their (identical) checkpoints to temporary directories, which are deleted at the
+end.  With ``P`` processes, the effective batch size is ``P`` times the one of the iterator.  Set
+the trainer's ``shard_optimizer_state`` to partition the optimizer state and the moving averages
+across the processes, instead of keeping all of them in every process.
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+
+import torch
+import torch.distributed
+import torch.multiprocessing
+
+from allennlp.commands.make_vocab import make_vocab_from_params
+from allennlp.commands.subcommand import Subcommand
+from allennlp.commands.train import train_model
+from allennlp.common import Params
+from allennlp.common.util import import_submodules
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class TrainDistributed(Subcommand):
+    def add_subparser(self, name: str, parser: argparse._SubParsersAction) -> argparse.ArgumentParser:
+        # pylint: disable=protected-access
+        description = '''Train a model with data-parallel CPU processes.'''
+        subparser = parser.add_parser(name, description=description,
+                                      help='Train a model with data-parallel CPU processes.')
+
+        subparser.add_argument('param_path', type=str, help='path to the experiment configuration')
+        subparser.add_argument('-s', '--serialization-dir', type=str, required=True,
+                               help='directory in which to save the model and its logs')
+        subparser.add_argument('-o', '--overrides', type=str, default="",
+                               help='a JSON structure used to override the experiment configuration')
+        subparser.add_argument('-f', '--force', action='store_true',
+                               help='overwrite the output directory if it exists')
+        subparser.add_argument('--num-processes', type=int, default=2,
+                               help='the number of training processes on this host')
+        subparser.add_argument('--num-threads', type=int, default=None,
+                               help='the number of intra-op threads of each process')
+        subparser.add_argument('--num-nodes', type=int, default=1, help='the number of hosts')
+        subparser.add_argument('--node-rank', type=int, default=0, help='the index of this host')
+        subparser.add_argument('--master-addr', type=str, default='127.0.0.1',
+                               help='the address of the host with node rank 0')
+        subparser.add_argument('--master-port', type=int, default=29500,
+                               help='a free port on the host with node rank 0')
+        subparser.add_argument('--file-friendly-logging', action='store_true',
+                               help='outputs tqdm status on separate lines and slows tqdm refresh rate')
+
+        subparser.set_defaults(func=_train_distributed)
+
+        return subparser
+
+
+def _train_process(local_rank: int, args: argparse.Namespace, vocabulary_dir: str) -> None:
+    # The processes are spawned, so we register the classes of this package again.
+    import_submodules("reading_comprehension")
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    rank = args.node_rank * args.num_processes + local_rank
+    world_size = args.num_nodes * args.num_processes
+    torch.distributed.init_process_group("gloo",
+                                         init_method=f"tcp://{args.master_addr}:{args.master_port}",
+                                         rank=rank,
+                                         world_size=world_size)
+
+    params = Params.from_file(args.param_path, args.overrides)
+    params["vocabulary"] = {"directory_path": vocabulary_dir}
+    params["dataset_reader"]["shard_training_data"] = True
+    params["trainer"]["distributed"] = True
+
+    if rank == 0:
+        serialization_dir = args.serialization_dir
+    else:
+        serialization_dir = tempfile.mkdtemp(prefix=f"rank_{rank}_")
+    try:
+        train_model(params, serialization_dir, args.file_friendly_logging, force=args.force and rank == 0)
+    finally:
+        if rank != 0:
+            shutil.rmtree(serialization_dir, ignore_errors=True)
+        torch.distributed.destroy_process_group()
+
+
+def _train_distributed(args: argparse.Namespace) -> None:
+    vocabulary_root = tempfile.mkdtemp()
+    try:
+        make_vocab_from_params(Params.from_file(args.param_path, args.overrides), vocabulary_root)
+        vocabulary_dir = os.path.join(vocabulary_root, "vocabulary")
+        logger.info("Starting %d training processes.", args.num_processes)
+        torch.multiprocessing.spawn(_train_process,
+                                    args=(args, vocabulary_dir),
+                                    nprocs=args.num_processes,
+                                    join=True)
+    finally:
+        shutil.rmtree(vocabulary_root, ignore_errors=True)
@@ -1,5 +1,17 @@
+import contextlib
+import itertools
+import math
+import random
+import re
+
+import numpy
+
 from allennlp.training.trainer import *
+from allennlp.common.util import is_lazy, lazy_groups_of
+from allennlp.nn.regularizers.regularizers import L2Regularizer
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
 from overrides import overrides
+from reading_comprehension.utils import bfloat16_autocast
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -7,15 +19,27 @@ logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 class ExponentialMovingAverage:
     """
     Maintain Exponential Moving Average for model parameters.
+
+    The averages are always kept in float32, whatever the precision of the parameters: with a
+    decay of 0.9999, each update is far below the resolution of a reduced precision type.
+
+    With ``parameter_owners`` (a rank of the ``torch.distributed`` process group for each trainable
+    parameter name), each process only keeps and updates the averages of its own parameters, and
+    ``assign_average_value`` gathers all the averages from their owners.  It is then a collective
+    operation, which all the processes have to call.  The frozen parameters have no owner and no
+    average, as they never change.
     """
-    def __init__(self, model: Model, decay: float = 0.9999):
+    def __init__(self, model: Model, decay: float = 0.9999, parameter_owners: Dict[str, int] = None):
         self.decay = decay
         self._average_values = {}
+        # Only holds a copy of the parameters between ``assign_average_value`` and ``restore``.
         self._backup_values = {}
         self._model = model
+        self._parameter_owners = parameter_owners
+        rank = torch.distributed.get_rank() if parameter_owners is not None else None
         for name, param in model.named_parameters():
-            self._average_values[name] = param.data.clone()
-            self._backup_values[name] = param.data.clone()
+            if parameter_owners is None or parameter_owners.get(name) == rank:
+                self._average_values[name] = param.data.clone().float()
 
     def apply(self, num_updates: int = None, named_parameters: Iterable = None) -> None:
         """
@@ -35,7 +59,9 @@ class ExponentialMovingAverage:
         if named_parameters is None:
             named_parameters = self._model.named_parameters()
         for name, param in named_parameters:
-            new_average_value = (1.0 - decay) * param.data + decay * self._average_values[name]
+            if name not in self._average_values:
+                continue
+            new_average_value = (1.0 - decay) * param.data.float() + decay * self._average_values[name]
             self._average_values[name] = new_average_value.clone()
 
     def assign_average_value(self, named_parameters=None) -> None:
@@ -44,9 +70,14 @@ class ExponentialMovingAverage:
         """
         if named_parameters is None:
             named_parameters = self._model.named_parameters()
+        named_parameters = list(named_parameters)
         for name, param in named_parameters:
             self._backup_values[name] = param.data.clone()
-            param.data = self._average_values[name]
+            if name in self._average_values:
+                param.data = self._average_values[name].to(param.data.dtype)
+        if self._parameter_owners is not None:
+            broadcast_from_owners([(name, param.data) for name, param in named_parameters],
+                                  self._parameter_owners)
 
     def restore(self, named_parameters=None) -> None:
         """
@@ -55,7 +86,17 @@ class ExponentialMovingAverage:
         if named_parameters is None:
             named_parameters = self._model.named_parameters()
         for name, param in named_parameters:
-            param.data = self._backup_values[name].clone()
+            param.data = self._backup_values.pop(name)
+
+    def state_dict(self) -> Dict[str, torch.Tensor]:
+        """
+        The moving averages kept by this process, by parameter name.
+        """
+        return dict(self._average_values)
+
+    def load_state_dict(self, state_dict: Dict[str, torch.Tensor]) -> None:
+        for name in self._average_values:
+            self._average_values[name] = state_dict[name].to(self._average_values[name].device).float()
 
 
 @Trainer.register("ema_trainer")
@@ -69,6 +110,74 @@ class EMATrainer(Trainer):
     Be careful that when saving the checkpoint, we will save the moving averages of parameters. This
     is necessary because we want the saved model to perform as well as the validated model if we load
     it later. But this may cause problems if you restart the training from checkpoint.
+
+    With ``use_bfloat16``, the forward passes run under a CPU ``bfloat16`` autocast (see
+    :func:`~reading_comprehension.utils.bfloat16_autocast`), while the parameters, gradients,
+    optimizer states and moving averages stay in float32.
+
+    With ``distributed``, this trainer is one process of a data-parallel run over an initialized
+    ``torch.distributed`` process group (e.g. ``gloo`` on CPU, see the ``train-distributed``
+    command), and each process should read a different shard of the training data.  The model is
+    wrapped in a ``DistributedDataParallel``, which all-reduces the gradients bucket by bucket
+    while the backward pass is still running.  All processes start from the parameters of rank 0
+    and apply the same averaged gradients, so their parameters, and hence their moving averages,
+    stay identical without further communication.  Every process runs the number of batches of the
+    smallest shard in each epoch, and validates on the whole validation data.  With a ``lazy``
+    reader (and an iterator without ``instances_per_epoch``), the number of batches of a shard is
+    unknown, so each process counts them in an extra pass over its shard at the start of every
+    epoch.
+
+    With ``num_gradient_accumulation_steps`` > 1, each optimizer step (and moving average update)
+    accumulates the gradients of that many batches of the iterator, for a larger effective batch.
+    The batch count of the trainer then counts optimizer steps, not iterator batches: it is what
+    the ``step_batch`` of the learning rate scheduler gets, and what ``summary_interval`` and
+    ``histogram_interval`` count.  With ``max_tokens_per_micro_batch``, each batch is further split
+    into micro-batches of at most that many padded tokens (the batch size times the padded length
+    of its longest field), so that the batch size is not limited by memory.  The memory budget is
+    thus given as a number of padded tokens, not of bytes: the activation memory grows with it, by
+    a factor that depends on the model, so the right value is found by measuring the peak memory of
+    a few batches.  A single instance with more padded tokens still makes a micro-batch of its own.
+    The loss of each micro-batch is weighted by its share of the instances of the effective batch,
+    so the gradients are those of the mean loss over the effective batch.  In a distributed run,
+    the gradients are only all-reduced after the last micro-batch.
+
+    With ``shard_optimizer_state`` (in a distributed run), the parameters are partitioned across
+    the processes, as in the first stage of ZeRO: each process only keeps the optimizer state (e.g.
+    the Adam moments) and the moving averages of its own parameters, and only applies the
+    optimizer step to them, after which each process broadcasts its updated parameters to the
+    others.  The moving averages are only gathered for the validation and the checkpoints.  The
+    training state of a checkpoint only holds the optimizer state of the shard of the process that
+    writes it, so a sharded run cannot resume from it, and ``model_save_interval``, whose
+    checkpoints only serve to resume, is not supported.
+
+    With ``weight_decay_from_regularizer``, the ``l2`` regularizers of the model are not added to
+    the loss anymore, which builds a graph over all the weights in every batch: they become
+    decoupled weight decays, applied to the parameters of the optimizer right before each step, as
+    in AdamW, in one fused multiplication per parameter group and regularizer.  The decay
+    coefficient is the one the penalty would give to a gradient step, ``2 * alpha``, so the two are
+    equivalent with plain SGD; with an adaptive optimizer, the decoupled decay is not rescaled.
+
+    With a ``passage_length_curriculum``, a list of ``[first_epoch, passage_length_limit]`` stages,
+    training starts on short passages, whose limit grows on that schedule: from each stage's first
+    epoch, the model is trained on windows of ``passage_length_limit`` tokens of the passages (the
+    passage tensors of each batch are cut), each holding the answer at a random position, so that
+    the answers are not biased towards the start of the passages.  Only the instances whose answer
+    is longer than the limit, which no window holds, are left out (their number is logged in every
+    stage).  The attention of the model being quadratic in the passage length, the early epochs are
+    much faster.  The training instances are read once at the longest length, and cut in memory,
+    so the reader must not be ``lazy``.  Validation always uses the whole passages.
+
+    The training state of every checkpoint also holds the trainable parameters (the model state
+    holding their moving averages), the moving averages, and the random number generator states,
+    including the generators of the modules of the model (e.g. of a ``layer_dropout_seed``), so
+    that training resumes from the checkpoint with the same parameters as if it had not stopped.
+    The checkpoints saved every ``model_save_interval`` seconds also hold the position in the
+    epoch: the random states at its start, from which the iterator replays the same batches, and
+    the number of batches (and loss) done.  Training resumes from such a checkpoint in the same
+    epoch, at the next batch, skipping the batches already done without running the model, with
+    the same results as an uninterrupted run, as long as only the data (and not the model) draws
+    from the ``random`` and ``numpy`` generators.  The training metrics of the model, though, only
+    cover the batches after the restart.  Only single-process runs resume from a checkpoint.
     """
     def __init__(self,
                  model: Model,
@@ -93,7 +202,14 @@ class EMATrainer(Trainer):
                  histogram_interval: int = None,
                  should_log_parameter_statistics: bool = True,
                  should_log_learning_rate: bool = False,
-                 exponential_moving_average_decay: float = None) -> None:
+                 exponential_moving_average_decay: float = None,
+                 use_bfloat16: bool = False,
+                 distributed: bool = False,
+                 num_gradient_accumulation_steps: int = 1,
+                 max_tokens_per_micro_batch: int = None,
+                 shard_optimizer_state: bool = False,
+                 weight_decay_from_regularizer: bool = False,
+                 passage_length_curriculum: List[Tuple[int, int]] = None) -> None:
         super().__init__(model, optimizer, iterator, train_dataset, validation_dataset,
                          patience, validation_metric, validation_iterator, shuffle, num_epochs,
                          serialization_dir, num_serialized_models_to_keep,
@@ -101,15 +217,146 @@ class EMATrainer(Trainer):
                          model_save_interval, cuda_device, grad_norm, grad_clipping,
                          learning_rate_scheduler, summary_interval, histogram_interval,
                          should_log_parameter_statistics, should_log_learning_rate)
+        self._distributed_model = None
+        if distributed:
+            if not torch.distributed.is_available() or not torch.distributed.is_initialized():
+                raise ConfigurationError("A distributed EMATrainer needs an initialized torch.distributed "
+                                         "process group.")
+            for tensor in itertools.chain(model.parameters(), model.buffers()):
+                torch.distributed.broadcast(tensor.data, src=0)
+            # Layer dropout skips whole sublayers, whose parameters then get no gradient.
+            self._distributed_model = torch.nn.parallel.DistributedDataParallel(model, find_unused_parameters=True)
+        self._parameter_owners = None
+        if shard_optimizer_state:
+            if model_save_interval is not None:
+                raise ConfigurationError("A sharded optimizer state cannot be resumed from a checkpoint, "
+                                         "so shard_optimizer_state does not support model_save_interval.")
+            if not distributed:
+                raise ConfigurationError("shard_optimizer_state needs a distributed EMATrainer.")
+            self._parameter_owners = partition_parameters(model, torch.distributed.get_world_size())
         if exponential_moving_average_decay is not None:
-            self.exp_moving_average = ExponentialMovingAverage(model, exponential_moving_average_decay)
+            self.exp_moving_average = ExponentialMovingAverage(model, exponential_moving_average_decay,
+                                                               self._parameter_owners)
         else:
             self.exp_moving_average = None
+        self._use_bfloat16 = use_bfloat16
+        if num_gradient_accumulation_steps < 1:
+            raise ConfigurationError("num_gradient_accumulation_steps must be at least 1.")
+        self._num_gradient_accumulation_steps = num_gradient_accumulation_steps
+        self._max_tokens_per_micro_batch = max_tokens_per_micro_batch
+        self._weight_decays: List[Tuple[Dict[str, Any], float, List[torch.nn.Parameter]]] = []
+        if weight_decay_from_regularizer:
+            self._weight_decays = get_weight_decays_from_regularizer(model, optimizer)
+        if passage_length_curriculum is not None and not isinstance(train_dataset, list):
+            raise ConfigurationError("A passage_length_curriculum needs the training instances in memory: "
+                                     "the dataset reader must not be lazy.")
+        self._passage_length_curriculum = sorted(passage_length_curriculum or [])
+        # The position in the epoch of a restored mid-epoch checkpoint, and the validation metrics
+        # of the last epochs, which the mid-epoch checkpoints are not given.
+        self._epoch_position: Optional[Dict[str, Any]] = None
+        self._val_metric_per_epoch: List[float] = []
+
+    @overrides
+    def batch_loss(self, batch: torch.Tensor, for_training: bool) -> torch.Tensor:
+        # The backward pass happens outside of the autocast, as it should.
+        with bfloat16_autocast(self._use_bfloat16):
+            if self._distributed_model is None or not for_training:
+                return super().batch_loss(batch, for_training)
+            batch = util.move_to_device(batch, self._cuda_devices[0])
+            output_dict = self._distributed_model(**batch)
+            try:
+                return output_dict["loss"] + self.model.get_regularization_penalty()
+            except KeyError:
+                raise RuntimeError("The model you are trying to optimize does not contain a"
+                                   " 'loss' key in the output of model.forward(inputs).")
+
+    def _split_into_micro_batches(self, batch: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if self._max_tokens_per_micro_batch is None:
+            return [batch]
+        batch_size = _get_batch_size(batch)
+        micro_batch_size = max(1, self._max_tokens_per_micro_batch * batch_size // _get_num_padded_tokens(batch))
+        return [_slice_batch(batch, start, start + micro_batch_size)
+                for start in range(0, batch_size, micro_batch_size)]
+
+    def _accumulate_gradients(self, batches: List[Dict[str, Any]]) -> float:
+        """
+        Runs the forward and backward passes of the micro-batches of ``batches``, accumulating the
+        gradients of their mean loss, and returns that loss.
+        """
+        micro_batches = [micro_batch for batch in batches for micro_batch in self._split_into_micro_batches(batch)]
+        num_instances = sum(_get_batch_size(micro_batch) for micro_batch in micro_batches)
+        total_loss = 0.0
+        for index, micro_batch in enumerate(micro_batches):
+            if self._distributed_model is not None and index < len(micro_batches) - 1:
+                sync_context = self._distributed_model.no_sync()
+            else:
+                sync_context = contextlib.suppress()
+            with sync_context:
+                # The regularization penalty of each micro-batch is weighted as well, so it counts once.
+                loss = self.batch_loss(micro_batch, for_training=True) * \
+                        (_get_batch_size(micro_batch) / num_instances)
+                loss.backward()
+            total_loss += loss.item()
+        return total_loss
+
+    def _optimizer_step(self) -> None:
+        for parameter_group, weight_decay, parameters in self._weight_decays:
+            # Like AdamW, we do not decay the parameters without a gradient, e.g. in a dropped layer.
+            decayed_tensors = [parameter.data for parameter in parameters if parameter.grad is not None]
+            decay_factor = 1.0 - parameter_group["lr"] * weight_decay
+            if hasattr(torch, "_foreach_mul_"):
+                torch._foreach_mul_(decayed_tensors, decay_factor)  # pylint: disable=protected-access
+            else:
+                for tensor in decayed_tensors:
+                    tensor.mul_(decay_factor)
+        self.optimizer.step()
+        if self._parameter_owners is not None:
+            broadcast_from_owners([(name, param.data) for name, param in self.model.named_parameters()
+                                   if param.requires_grad],
+                                  self._parameter_owners)
+
+    def _get_passage_length_limit(self, epoch: int) -> Optional[int]:
+        """
+        The passage length limit of the stage of the ``passage_length_curriculum`` that ``epoch``
+        is in, or ``None`` before the first stage or without a curriculum.
+        """
+        passage_length_limit = None
+        for first_epoch, stage_passage_length_limit in self._passage_length_curriculum:
+            if epoch >= first_epoch:
+                passage_length_limit = stage_passage_length_limit
+        return passage_length_limit
+
+    def _num_batches_on_every_rank(self, num_batches: int) -> int:
+        """
+        The smallest ``num_batches`` of all the processes of a distributed run: a process that ran
+        more batches than the others would wait forever for their gradients.
+        """
+        if self._distributed_model is None:
+            return num_batches
+        num_batches_tensor = torch.LongTensor([num_batches])
+        torch.distributed.all_reduce(num_batches_tensor, op=torch.distributed.ReduceOp.MIN)
+        return int(num_batches_tensor.item())
+
+    def _count_batches(self, train_data: Iterable[Instance]) -> int:
+        """
+        The number of batches the iterator makes of lazy ``train_data``, for which
+        ``get_num_batches`` is only a guess.  The random states are restored afterwards, so that
+        the epoch draws the same batches as without counting.
+        """
+        rng_states = get_rng_states()
+        num_batches = sum(1 for _ in self.iterator(train_data, num_epochs=1, shuffle=self.shuffle))
+        set_rng_states(rng_states)
+        return num_batches
 
     def _train_epoch(self, epoch: int) -> Dict[str, float]:
         """
         Exactly the same as Trainer._train_epoch except for
-        the addition of a call to self.exp_moving_average.apply() after each training step.
+        the addition of a call to self.exp_moving_average.apply() after each training step,
+        the gradient accumulation over the batches of each training step,
+        and, in a distributed run, the same number of batches on every process and the broadcast
+        of the parameters updated by each process, the position in the epoch in the mid-epoch
+        checkpoints, from which the epoch resumes after a restart, and the cut of the passages of
+        the stages of the passage length curriculum.
         """
         # pylint: disable=logging-fstring-interpolation
         logger.info(f"Epoch {epoch}/{self._num_epochs - 1}")
@@ -121,25 +368,56 @@ class EMATrainer(Trainer):
         # Set the model to "train" mode.
         self.model.train()
 
+        # The iterator draws the same batches from the same random states.
+        epoch_position, self._epoch_position = self._epoch_position, None
+        if epoch_position is not None:
+            set_rng_states(epoch_position["epoch_rng_states"])
+        epoch_rng_states = get_rng_states()
+
+        train_data = self.train_data
+        passage_length_limit = self._get_passage_length_limit(epoch)
+        if passage_length_limit is not None:
+            train_data = [instance for instance in self.train_data
+                          if instance.fields["span_end"].sequence_index
+                          - instance.fields["span_start"].sequence_index < passage_length_limit]
+            logger.info(f"Training on windows of {passage_length_limit} passage tokens, which hold the answers "
+                        f"of {len(train_data)} out of {len(self.train_data)} instances")
+
         # Get tqdm for the training batches
-        train_generator = self.iterator(self.train_data,
+        train_generator = self.iterator(train_data,
                                         num_epochs=1,
                                         shuffle=self.shuffle)
-        num_training_batches = self.iterator.get_num_batches(self.train_data)
+        num_training_batches = self.iterator.get_num_batches(train_data)
+        if self._distributed_model is not None:
+            if is_lazy(train_data) and self.iterator._instances_per_epoch is None:  # pylint: disable=protected-access
+                num_training_batches = self._count_batches(train_data)
+            num_training_batches = self._num_batches_on_every_rank(num_training_batches)
+            train_generator = itertools.islice(train_generator, num_training_batches)
+        # From here on, a "batch" is the group of iterator batches of one training step.
+        train_generator = lazy_groups_of(train_generator, self._num_gradient_accumulation_steps)
+        num_training_batches = math.ceil(num_training_batches / self._num_gradient_accumulation_steps)
         self._last_log = time.time()
         last_save_time = time.time()
 
         batches_this_epoch = 0
         if self._batch_num_total is None:
             self._batch_num_total = 0
+        if epoch_position is not None:
+            batches_this_epoch = epoch_position["batches_this_epoch"]
+            logger.info(f"Skipping the {batches_this_epoch} batches done before the checkpoint")
+            for _ in itertools.islice(train_generator, batches_this_epoch):
+                pass
+            train_loss = epoch_position["train_loss"]
+            set_rng_states(epoch_position["rng_states"], self.model)
 
         if self._histogram_interval is not None:
             histogram_parameters = set(self.model.get_parameters_for_histogram_tensorboard_logging())
 
         logger.info("Training")
         train_generator_tqdm = Tqdm.tqdm(train_generator,
-                                         total=num_training_batches)
-        for batch in train_generator_tqdm:
+                                         total=num_training_batches,
+                                         initial=batches_this_epoch)
+        for batch_group in train_generator_tqdm:
             batches_this_epoch += 1
             self._batch_num_total += 1
             batch_num_total = self._batch_num_total
@@ -149,10 +427,9 @@ class EMATrainer(Trainer):
 
             self.optimizer.zero_grad()
 
-            loss = self.batch_loss(batch, for_training=True)
-            loss.backward()
-
-            train_loss += loss.item()
+            if passage_length_limit is not None:
+                batch_group = [_cut_passages(batch, passage_length_limit) for batch in batch_group]
+            train_loss += self._accumulate_gradients(batch_group)
 
             batch_grad_norm = self.rescale_gradients()
 
@@ -167,7 +444,7 @@ class EMATrainer(Trainer):
                 # and copy them to CPU so large models won't go OOM on the GPU.
                 param_updates = {name: param.detach().cpu().clone()
                                  for name, param in self.model.named_parameters()}
-                self.optimizer.step()
+                self._optimizer_step()
                 for name, param in self.model.named_parameters():
                     param_updates[name].sub_(param.detach().cpu())
                     update_norm = torch.norm(param_updates[name].view(-1, ))
@@ -176,7 +453,7 @@ class EMATrainer(Trainer):
                                                        update_norm / (param_norm + 1e-7),
                                                        batch_num_total)
             else:
-                self.optimizer.step()
+                self._optimizer_step()
 
             if self.exp_moving_average is not None:
                 self.exp_moving_average.apply(batch_num_total)
@@ -206,7 +483,11 @@ class EMATrainer(Trainer):
             ):
                 last_save_time = time.time()
                 self._save_checkpoint(
-                        '{0}.{1}'.format(epoch, time_to_str(int(last_save_time))), [], is_best=False)
+                        '{0}.{1}'.format(epoch, time_to_str(int(last_save_time))), [], is_best=False,
+                        epoch_position={"epoch_rng_states": epoch_rng_states,
+                                        "batches_this_epoch": batches_this_epoch,
+                                        "train_loss": train_loss,
+                                        "rng_states": get_rng_states(self.model)})
         return self._get_metrics(train_loss, batches_this_epoch, reset=True)
 
     @overrides
@@ -260,14 +541,22 @@ class EMATrainer(Trainer):
         return val_loss, batches_this_epoch
 
     @overrides
-    def _save_checkpoint(self,
+    def _save_checkpoint(self,  # type: ignore
                          epoch: Union[int, str],
                          val_metric_per_epoch: List[float],
-                         is_best: Optional[bool] = None) -> None:
+                         is_best: Optional[bool] = None,
+                         epoch_position: Dict[str, Any] = None) -> None:
         """
         Exactly the same as Trainer._save_checkpoint except that we will save the moving averages
-        of the parameters instead of the original value.
+        of the parameters instead of the original value, and that the training state also holds
+        what resuming the training needs: the original parameters, the moving averages, the random
+        states, and the ``epoch_position`` of the mid-epoch checkpoints.
         """
+        # pylint: disable=arguments-differ
+        if isinstance(epoch, int):
+            self._val_metric_per_epoch = list(val_metric_per_epoch)
+        else:
+            val_metric_per_epoch = self._val_metric_per_epoch
         if self._serialization_dir is not None:
             model_path = os.path.join(self._serialization_dir, "model_state_epoch_{}.th".format(epoch))
 
@@ -283,10 +572,19 @@ class EMATrainer(Trainer):
             training_state = {'epoch': epoch,
                               'val_metric_per_epoch': val_metric_per_epoch,
                               'optimizer': self.optimizer.state_dict(),
-                              'batch_num_total': self._batch_num_total}
+                              'batch_num_total': self._batch_num_total,
+                              'rng_states': get_rng_states(self.model)}
             if self._learning_rate_scheduler is not None:
                 training_state["learning_rate_scheduler"] = \
                     self._learning_rate_scheduler.lr_scheduler.state_dict()
+            if self.exp_moving_average is not None:
+                # The frozen parameters (and the buffers) are the same in the model state.
+                training_state["model"] = {name: parameter.detach()
+                                           for name, parameter in self.model.named_parameters()
+                                           if parameter.requires_grad}
+                training_state["moving_averages"] = self.exp_moving_average.state_dict()
+            if epoch_position is not None:
+                training_state["epoch_position"] = epoch_position
             training_path = os.path.join(self._serialization_dir,
                                          "training_state_epoch_{}.th".format(epoch))
             torch.save(training_state, training_path)
@@ -314,6 +612,61 @@ class EMATrainer(Trainer):
                         for fname in paths_to_remove[1:]:
                             os.remove(fname)
 
+    @overrides
+    def _restore_checkpoint(self) -> Tuple[int, List[float]]:
+        """
+        Exactly the same as Trainer._restore_checkpoint except that we restore the original
+        parameters (the model state holding their moving averages), the moving averages and the
+        random states as well, and that a mid-epoch checkpoint resumes in its epoch, at the batch
+        after the checkpoint.
+        """
+        latest_checkpoint = self.find_latest_checkpoint()
+
+        if latest_checkpoint is None:
+            # No checkpoint to restore, start at 0
+            return 0, []
+
+        model_path, training_state_path = latest_checkpoint
+
+        # Load the parameters onto CPU, then transfer to GPU.
+        model_state = torch.load(model_path, map_location=util.device_mapping(-1))
+        training_state = torch.load(training_state_path, map_location=util.device_mapping(-1))
+        self.model.load_state_dict(model_state)
+        if "model" in training_state:
+            # Only the parameters being trained, which the model state holds the moving averages of.
+            self.model.load_state_dict(training_state["model"], strict=False)
+        if self.exp_moving_average is not None and "moving_averages" in training_state:
+            self.exp_moving_average.load_state_dict(training_state["moving_averages"])
+        self.optimizer.load_state_dict(training_state["optimizer"])
+        if self._learning_rate_scheduler is not None and "learning_rate_scheduler" in training_state:
+            self._learning_rate_scheduler.lr_scheduler.load_state_dict(
+                    training_state["learning_rate_scheduler"])
+        move_optimizer_to_cuda(self.optimizer)
+
+        if "val_metric_per_epoch" not in training_state:
+            logger.warning("trainer state `val_metric_per_epoch` not found, using empty list")
+            val_metric_per_epoch: List[float] = []
+        else:
+            val_metric_per_epoch = training_state["val_metric_per_epoch"]
+        self._val_metric_per_epoch = list(val_metric_per_epoch)
+
+        if isinstance(training_state["epoch"], int):
+            epoch_to_return = training_state["epoch"] + 1
+        else:
+            epoch_to_return = int(training_state["epoch"].split('.')[0]) + 1
+        if "epoch_position" in training_state:
+            # `_train_epoch` replays the epoch up to the checkpoint, then restores the random states.
+            self._epoch_position = training_state["epoch_position"]
+            epoch_to_return -= 1
+        elif "rng_states" in training_state:
+            set_rng_states(training_state["rng_states"], self.model)
+
+        batch_num_total = training_state.get('batch_num_total')
+        if batch_num_total is not None:
+            self._batch_num_total = batch_num_total
+
+        return epoch_to_return, val_metric_per_epoch
+
     # Requires custom from_params.
     @classmethod
     def from_params(cls,  # type: ignore
@@ -334,7 +687,16 @@ class EMATrainer(Trainer):
         grad_clipping = params.pop_float("grad_clipping", None)
         lr_scheduler_params = params.pop("learning_rate_scheduler", None)
 
+        distributed = params.pop_bool("distributed", False)
+        shard_optimizer_state = params.pop_bool("shard_optimizer_state", False)
         parameters = [[n, p] for n, p in model.named_parameters() if p.requires_grad]
+        if shard_optimizer_state:
+            if not distributed:
+                raise ConfigurationError("shard_optimizer_state needs a distributed EMATrainer.")
+            # The optimizer only sees (and keeps a state for) the parameters of this process.
+            parameter_owners = partition_parameters(model, torch.distributed.get_world_size())
+            rank = torch.distributed.get_rank()
+            parameters = [[n, p] for n, p in parameters if parameter_owners[n] == rank]
         optimizer = Optimizer.from_params(parameters, params.pop("optimizer"))
 
         if lr_scheduler_params:
@@ -351,6 +713,14 @@ class EMATrainer(Trainer):
         should_log_parameter_statistics = params.pop_bool("should_log_parameter_statistics", True)
         should_log_learning_rate = params.pop_bool("should_log_learning_rate", False)
         exponential_moving_average_decay = params.pop_float("exponential_moving_average_decay", 0.9999)
+        use_bfloat16 = params.pop_bool("use_bfloat16", False)
+        num_gradient_accumulation_steps = params.pop_int("num_gradient_accumulation_steps", 1)
+        max_tokens_per_micro_batch = params.pop_int("max_tokens_per_micro_batch", None)
+        weight_decay_from_regularizer = params.pop_bool("weight_decay_from_regularizer", False)
+        passage_length_curriculum = params.pop("passage_length_curriculum", None)
+        if passage_length_curriculum is not None:
+            passage_length_curriculum = [(int(first_epoch), int(passage_length_limit))
+                                         for first_epoch, passage_length_limit in passage_length_curriculum]
         params.assert_empty(cls.__name__)
         return cls(model, optimizer, iterator,
                    train_data, validation_data,
@@ -371,4 +741,187 @@ class EMATrainer(Trainer):
                    histogram_interval=histogram_interval,
                    should_log_parameter_statistics=should_log_parameter_statistics,
                    should_log_learning_rate=should_log_learning_rate,
-                   exponential_moving_average_decay=exponential_moving_average_decay)
+                   exponential_moving_average_decay=exponential_moving_average_decay,
+                   use_bfloat16=use_bfloat16,
+                   distributed=distributed,
+                   num_gradient_accumulation_steps=num_gradient_accumulation_steps,
+                   max_tokens_per_micro_batch=max_tokens_per_micro_batch,
+                   shard_optimizer_state=shard_optimizer_state,
+                   weight_decay_from_regularizer=weight_decay_from_regularizer,
+                   passage_length_curriculum=passage_length_curriculum)
+
+
+def get_rng_states(model: Model = None) -> Dict[str, Any]:
+    """
+    The states of the ``random``, ``numpy`` and ``torch`` (CPU and CUDA) random number generators,
+    and, if ``model`` is given, of the ``torch.Generator`` of each of its modules which has one (as
+    its ``_generator``, e.g. a seeded ``ResidualWithLayerDropout``), by module name.
+    """
+    rng_states = {"random": random.getstate(),
+                  "numpy": numpy.random.get_state(),
+                  "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        rng_states["torch_cuda"] = torch.cuda.get_rng_state_all()
+    if model is not None:
+        rng_states["module_generators"] = {name: module._generator.get_state()  # pylint: disable=protected-access
+                                           for name, module in model.named_modules()
+                                           if isinstance(getattr(module, "_generator", None), torch.Generator)}
+    return rng_states
+
+
+def set_rng_states(rng_states: Dict[str, Any], model: Model = None) -> None:
+    random.setstate(rng_states["random"])
+    numpy.random.set_state(rng_states["numpy"])
+    torch.set_rng_state(rng_states["torch"])
+    if "torch_cuda" in rng_states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng_states["torch_cuda"])
+    if model is not None and "module_generators" in rng_states:
+        modules = dict(model.named_modules())
+        for name, generator_state in rng_states["module_generators"].items():
+            modules[name]._generator.set_state(generator_state)  # pylint: disable=protected-access
+
+
+def get_weight_decays_from_regularizer(model: Model,
+                                       optimizer: torch.optim.Optimizer
+                                      ) -> List[Tuple[Dict[str, Any], float, List[torch.nn.Parameter]]]:
+    """
+    Turns the ``l2`` regularizers of ``model`` into weight decays of the parameters of
+    ``optimizer``, and removes the regularizer from the model.  Returns, for each parameter group of
+    the optimizer and each regularizer, the group, the weight decay ``2 * alpha``, and the
+    trainable parameters of the group the regularizer applies to: the frozen ones are never decayed.
+    """
+    # pylint: disable=protected-access
+    regularizer_applicator = model._regularizer
+    if regularizer_applicator is None:
+        return []
+    parameter_names = {id(parameter): name for name, parameter in model.named_parameters()}
+    weight_decays = []
+    for parameter_group in optimizer.param_groups:
+        regularized_parameters: Dict[int, List[torch.nn.Parameter]] = {}
+        for parameter in parameter_group["params"]:
+            if not parameter.requires_grad:
+                continue
+            for index, (regex, regularizer) in enumerate(regularizer_applicator._regularizers):
+                if re.search(regex, parameter_names[id(parameter)]):
+                    if not isinstance(regularizer, L2Regularizer):
+                        raise ConfigurationError(f"weight_decay_from_regularizer only handles l2 regularizers, "
+                                                 f"not {type(regularizer).__name__}.")
+                    regularized_parameters.setdefault(index, []).append(parameter)
+                    break
+        for index, parameters in sorted(regularized_parameters.items()):
+            alpha = regularizer_applicator._regularizers[index][1]._alpha
+            weight_decays.append((parameter_group, 2.0 * alpha, parameters))
+    model._regularizer = None
+    return weight_decays
+
+
+def partition_parameters(model: Model, world_size: int) -> Dict[str, int]:
+    """
+    Assigns each trainable parameter of ``model`` to one of ``world_size`` ranks, balancing the
+    number of elements of each rank: the parameters are assigned from the largest to the smallest,
+    each to the rank with the fewest elements so far.  This is deterministic, so every process
+    computes the same partition.  The frozen parameters (e.g. pretrained word embeddings, often
+    the largest matrix of the model) are left out: they have no optimizer state to shard.
+    """
+    named_parameters = sorted([(name, parameter) for name, parameter in model.named_parameters()
+                               if parameter.requires_grad],
+                              key=lambda item: (-item[1].numel(), item[0]))
+    rank_sizes = [0] * world_size
+    parameter_owners = {}
+    for name, parameter in named_parameters:
+        rank = min(range(world_size), key=lambda index: (rank_sizes[index], index))
+        parameter_owners[name] = rank
+        rank_sizes[rank] += parameter.numel()
+    return parameter_owners
+
+
+def broadcast_from_owners(named_tensors: List[Tuple[str, torch.Tensor]], parameter_owners: Dict[str, int]) -> None:
+    """
+    Overwrites each tensor of every process with the one of its owner, in one broadcast per rank.
+    The tensors without an owner (of the frozen parameters) are left as they are.
+    """
+    for rank in range(torch.distributed.get_world_size()):
+        tensors = [tensor for name, tensor in named_tensors if parameter_owners.get(name) == rank]
+        if not tensors:
+            continue
+        flat_tensors = _flatten_dense_tensors(tensors)
+        torch.distributed.broadcast(flat_tensors, src=rank)
+        for tensor, synced_tensor in zip(tensors, _unflatten_dense_tensors(flat_tensors, tensors)):
+            tensor.copy_(synced_tensor)
+
+
+def _get_batch_size(batch: Any) -> int:
+    """
+    The number of instances of a tensor dictionary, i.e. the size of the first dimension of its
+    tensors.
+    """
+    if isinstance(batch, torch.Tensor):
+        return batch.size(0)
+    if isinstance(batch, dict):
+        for value in batch.values():
+            batch_size = _get_batch_size(value)
+            if batch_size is not None:
+                return batch_size
+    return None
+
+
+def _get_num_padded_tokens(batch: Any) -> int:
+    """
+    The largest ``batch_size * num_tokens`` of the (at least 2 dimensional) tensors of a tensor
+    dictionary, e.g. of the passage of a reading comprehension batch.
+    """
+    if isinstance(batch, torch.Tensor):
+        return batch.size(0) * batch.size(1) if batch.dim() >= 2 else batch.size(0)
+    if isinstance(batch, dict):
+        return max([_get_num_padded_tokens(value) for value in batch.values()] + [1])
+    return 1
+
+
+def _slice_batch(batch: Any, start: int, end: int) -> Any:
+    """
+    The instances ``start`` to ``end`` of a tensor dictionary, whose values are tensors, lists
+    (e.g. of metadata) or nested tensor dictionaries.
+    """
+    if isinstance(batch, (torch.Tensor, list)):
+        return batch[start:end]
+    if isinstance(batch, dict):
+        return {key: _slice_batch(value, start, end) for key, value in batch.items()}
+    return batch
+
+
+def _cut_passages(batch: Dict[str, Any], passage_length_limit: int) -> Dict[str, Any]:
+    """
+    The ``batch`` with its passages cut to windows of ``passage_length_limit`` tokens, each holding
+    the gold span of its instance, at a random position.  The tensors of the ``passage`` field and
+    the teacher probabilities are cut to the windows, the span starts and ends are shifted to them,
+    and so are the token offsets and passage tokens of the metadata.  The answer of every instance
+    must be shorter than the limit.
+    """
+    passage_mask = util.get_text_field_mask(batch["passage"])
+    window_length = min(passage_length_limit, passage_mask.size(1))
+    window_starts = []
+    for passage_length, span_start, span_end in zip(passage_mask.sum(-1).tolist(),
+                                                    batch["span_start"].view(-1).tolist(),
+                                                    batch["span_end"].view(-1).tolist()):
+        first_start = max(0, span_end - window_length + 1)
+        last_start = min(span_start, max(0, passage_length - window_length))
+        window_starts.append(random.randint(first_start, last_start))
+
+    def cut(tensor: torch.Tensor) -> torch.Tensor:
+        starts = tensor.new_tensor(window_starts, dtype=torch.long)
+        positions = starts.unsqueeze(-1) + torch.arange(window_length, device=tensor.device)
+        return tensor[torch.arange(len(window_starts), device=tensor.device).unsqueeze(-1), positions]
+
+    batch = dict(batch)
+    batch["passage"] = {key: cut(tensor) for key, tensor in batch["passage"].items()}
+    for key in ["span_start_teacher_probs", "span_end_teacher_probs"]:
+        if key in batch:
+            batch[key] = cut(batch[key])
+    for key in ["span_start", "span_end"]:
+        batch[key] = batch[key] - batch[key].new_tensor(window_starts).view_as(batch[key])
+    if "metadata" in batch:
+        batch["metadata"] = [dict(metadata,
+                                  token_offsets=metadata["token_offsets"][start:start + window_length],
+                                  passage_tokens=metadata["passage_tokens"][start:start + window_length])
+                             for metadata, start in zip(batch["metadata"], window_starts)]
+    return batch
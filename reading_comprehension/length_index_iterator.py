@@ -0,0 +1,53 @@
+import itertools
+import random
+from typing import Iterable, Optional
+
+from overrides import overrides
+
+from allennlp.common.util import is_lazy
+from allennlp.data.dataset import Batch
+from allennlp.data.instance import Instance
+from allennlp.data.iterators import BasicIterator, DataIterator
+
+
+def _get_length_index_batch(instance: Instance) -> Optional[int]:
+    metadata = instance.fields.get("metadata")
+    if metadata is None or not isinstance(metadata.metadata, dict):
+        return None
+    return metadata.metadata.get("length_index_batch")
+
+
+@DataIterator.register("length_index")
+class LengthIndexIterator(BasicIterator):
+    """
+    Makes a batch of each batch of the training instances of a ``squad_limited`` reader with a
+    ``length_index_batch_size``, which the reader sorted by length over the whole training file:
+    the consecutive instances with the same ``length_index_batch`` in their metadata go in one
+    batch, whatever the ``batch_size``.  With a ``lazy`` reader, only one batch of instances is in
+    memory at a time.  The reader already yields the batches in a random order; when the instances
+    are in memory, they are read once, so we shuffle the batches in every epoch instead.
+
+    The other instances, e.g. the validation ones, are batched as by a ``basic`` iterator, with
+    the same parameters.  The number of batches of instances in memory is counted from the batches
+    themselves, not from the ``batch_size``.
+    """
+    @overrides
+    def get_num_batches(self, instances: Iterable[Instance]) -> int:
+        if is_lazy(instances) or self._instances_per_epoch is not None:
+            return super().get_num_batches(instances)
+        return sum(1 for _ in self._group_batches(instances, shuffle=False))
+
+    @overrides
+    def _create_batches(self, instances: Iterable[Instance], shuffle: bool) -> Iterable[Batch]:
+        batches = self._group_batches(instances, shuffle)
+        if shuffle and not is_lazy(instances):
+            batches = list(batches)
+            random.shuffle(batches)
+        yield from batches
+
+    def _group_batches(self, instances: Iterable[Instance], shuffle: bool) -> Iterable[Batch]:
+        for length_index_batch, batch_instances in itertools.groupby(instances, key=_get_length_index_batch):
+            if length_index_batch is None:
+                yield from super()._create_batches(batch_instances, shuffle)
+            else:
+                yield Batch(list(batch_instances))
@@ -0,0 +1,158 @@
+import collections
+import logging
+
+import torch
+from overrides import overrides
+
+from allennlp.common import Params
+from allennlp.data import Vocabulary
+from allennlp.modules.seq2vec_encoders.seq2vec_encoder import Seq2VecEncoder
+from allennlp.modules.token_embedders.embedding import Embedding
+from allennlp.modules.token_embedders.token_characters_encoder import TokenCharactersEncoder
+from allennlp.modules.token_embedders.token_embedder import TokenEmbedder
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+@TokenEmbedder.register("cached_character_encoding")
+class CachedTokenCharactersEncoder(TokenCharactersEncoder):
+    """
+    A ``TokenCharactersEncoder`` which encodes every distinct word of a batch only once and
+    gathers the results back to the token positions, instead of running the character embedding
+    and encoder over the ``(batch_size, num_tokens, num_characters)`` tensor.  Padding tokens, all
+    identical, are encoded once too.  In training, the gradients of all the occurrences of a word
+    are summed by the backward pass of the gather, so they are the same as without deduplication;
+    the dropout is applied after the gather, so each occurrence still gets its own dropout mask.
+
+    In evaluation mode, the encoded words are also kept in an LRU cache of ``cache_size`` entries
+    across batches, which can be saved to (and loaded from) ``cache_file`` to serve as a
+    persistent word -> vector table.  Cache entries are keyed by the padded character ids of the
+    word: with a CNN encoder, the padding can change the encoding of a word, so this keeps the
+    outputs identical to the uncached ones.  The cache is emptied whenever the module goes back to
+    training mode, as the weights are about to change.
+
+    This has the same parameters (and state dict) as a ``character_encoding`` embedder, so a model
+    trained with one can be evaluated with the other.
+
+    Parameters
+    ----------
+    embedding : ``Embedding``
+    encoder : ``Seq2VecEncoder``
+    dropout : ``float``, optional (default = 0.0)
+    cache_size : ``int``, optional (default = 50000)
+        The maximum number of encoded words kept across batches.  0 disables the cache, but still
+        encodes each distinct word of a batch only once.
+    cache_file : ``str``, optional (default = None)
+        If given and present, the cache is loaded from this file (see :func:`save_cache`).
+    deduplicate_in_training : ``bool``, optional (default = True)
+        Whether to also encode the distinct words only once in training mode.
+    """
+    def __init__(self,
+                 embedding: Embedding,
+                 encoder: Seq2VecEncoder,
+                 dropout: float = 0.0,
+                 cache_size: int = 50000,
+                 cache_file: str = None,
+                 deduplicate_in_training: bool = True) -> None:
+        super().__init__(embedding, encoder, dropout)
+        self._deduplicate_in_training = deduplicate_in_training
+        self._cache_size = cache_size
+        self._cache: "collections.OrderedDict[bytes, torch.Tensor]" = collections.OrderedDict()
+        self._cache_file = cache_file
+        self._pending_cache_file = cache_file
+
+    @overrides
+    def train(self, mode: bool = True) -> 'CachedTokenCharactersEncoder':
+        if mode:
+            self.clear_cache()
+        return super().train(mode)
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    @overrides
+    def forward(self, token_characters: torch.Tensor) -> torch.Tensor:  # pylint: disable=arguments-differ
+        if self.training and not self._deduplicate_in_training:
+            return super().forward(token_characters)
+        if not self.training and self._pending_cache_file is not None:
+            self.load_cache(self._pending_cache_file)
+            self._pending_cache_file = None
+        # Shape: (batch_size * num_tokens, num_characters)
+        words = token_characters.view(-1, token_characters.size(-1))
+        # Shape: (num_unique_words, num_characters), (batch_size * num_tokens,)
+        unique_words, inverse_indices = torch.unique(words, return_inverse=True, dim=0)
+        if self.training or self._cache_size == 0:
+            encoded_words = self._encode_words(unique_words)
+        else:
+            encoded_words = self._encode_with_cache(unique_words)
+        encoded_tokens = encoded_words.index_select(0, inverse_indices.view(-1))
+        return self._dropout(encoded_tokens.view(*token_characters.size()[:-1], -1))
+
+    def _encode_words(self, words: torch.Tensor) -> torch.Tensor:
+        # We call the modules wrapped by ``TimeDistributed`` directly, as we have a flat batch of words.
+        # pylint: disable=protected-access
+        mask = (words != 0).long()
+        return self._encoder._module(self._embedding._module(words), mask)
+
+    def _encode_with_cache(self, words: torch.Tensor) -> torch.Tensor:
+        keys = [word.tobytes() for word in words.cpu().numpy()]
+        missing = [index for index, key in enumerate(keys) if key not in self._cache]
+        if missing:
+            missing_words = words.index_select(0, torch.LongTensor(missing).to(words.device))
+            for index, encoded_word in zip(missing, self._encode_words(missing_words).detach()):
+                self._cache[keys[index]] = encoded_word
+        encoded_words = torch.stack([self._cache[key] for key in keys])
+        for key in keys:
+            self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return encoded_words
+
+    def _weights_checksum(self) -> float:
+        return float(sum(parameter.detach().double().sum() for parameter in self.parameters()))
+
+    def save_cache(self, cache_file: str = None) -> None:
+        """
+        Saves the encoded words to ``cache_file`` (by default, the one we were constructed with),
+        together with a checksum of the weights they were computed with.
+        """
+        cache_file = cache_file or self._cache_file
+        keys = list(self._cache.keys())
+        vectors = torch.stack([self._cache[key] for key in keys]).cpu() if keys else None
+        torch.save({"checksum": self._weights_checksum(), "keys": keys, "vectors": vectors}, cache_file)
+
+    def load_cache(self, cache_file: str) -> None:
+        """
+        Loads encoded words saved with :func:`save_cache`, unless they were computed with different
+        weights.
+        """
+        try:
+            saved_cache = torch.load(cache_file)
+        except FileNotFoundError:
+            logger.info("No character encoding cache at %s yet.", cache_file)
+            return
+        if abs(saved_cache["checksum"] - self._weights_checksum()) > 1e-6 * max(1.0, abs(saved_cache["checksum"])):
+            logger.warning("Ignoring the character encoding cache at %s, computed with other weights.", cache_file)
+            return
+        device = next(self.parameters()).device
+        for key, vector in zip(saved_cache["keys"], saved_cache["vectors"] if saved_cache["keys"] else []):
+            self._cache[key] = vector.to(device)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    @classmethod
+    def from_params(cls, vocab: Vocabulary, params: Params) -> 'CachedTokenCharactersEncoder':  # type: ignore
+        # pylint: disable=arguments-differ
+        embedding_params: Params = params.pop("embedding")
+        # Embedding.from_params() uses "tokens" as the default namespace, but we need to change
+        # that to be "token_characters" by default.
+        embedding_params.setdefault("vocab_namespace", "token_characters")
+        embedding = Embedding.from_params(vocab, embedding_params)
+        encoder_params: Params = params.pop("encoder")
+        encoder = Seq2VecEncoder.from_params(encoder_params)
+        dropout = params.pop_float("dropout", 0.0)
+        cache_size = params.pop_int("cache_size", 50000)
+        cache_file = params.pop("cache_file", None)
+        deduplicate_in_training = params.pop_bool("deduplicate_in_training", True)
+        params.assert_empty(cls.__name__)
+        return cls(embedding, encoder, dropout, cache_size, cache_file, deduplicate_in_training)
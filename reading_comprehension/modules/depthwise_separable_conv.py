@@ -10,6 +10,11 @@ class DepthwiseSeparableConv(torch.nn.Module):
 
     This module Performs a depthwise convolution that acts separately on channels
     followed by a pointwise convolution that mixes channels.
+
+    Besides ``forward``, which takes ``(batch_size, channels, ...)`` inputs, the 1 dimensional
+    version has a :func:`forward_channel_last` fast path for ``(batch_size, timesteps, channels)``
+    inputs, which computes the same thing without transposing its input, nor allocating a padded
+    copy of it.
     """
     def __init__(self,
                  in_channels: int,
@@ -19,9 +24,11 @@ class DepthwiseSeparableConv(torch.nn.Module):
                  dim: int = 1,
                  bias: bool = True) -> None:
         super().__init__()
+        self._dim = dim
         if dim == 1:
             padding_left = kernel_size // 2
             padding_right = padding_left if kernel_size % 2 != 0 else padding_left - 1
+            self._padding = (padding_left, padding_right)
             self.depthwise_conv = torch.nn.Sequential(
                     torch.nn.ReflectionPad1d((padding_left, padding_right)),
                     torch.nn.Conv1d(in_channels=in_channels, out_channels=in_channels,
@@ -56,3 +63,53 @@ class DepthwiseSeparableConv(torch.nn.Module):
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         # pylint: disable=arguments-differ
         return self._activation(self.pointwise_conv(self.depthwise_conv(x)))
+
+    def forward_channel_last(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        The same as ``forward(x.transpose(1, 2)).transpose(1, 2)`` for a 1 dimensional convolution
+        over a ``(batch_size, timesteps, in_channels)`` tensor.
+        """
+        return self.pointwise_channel_last(self.depthwise_channel_last(x))
+
+    def depthwise_channel_last(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        The reflection padded depthwise convolution of a ``(batch_size, timesteps, channels)``
+        tensor, computed as one multiply-add of the shifted input per kernel position.  Instead of
+        allocating a padded copy of the input, the few output positions whose window overlaps the
+        padding add the reflected input rows separately.
+        """
+        if self._dim != 1:
+            raise Exception("The channel last convolution is only implemented for 1 dimensional convolutions.")
+        padding_left, padding_right = self._padding
+        timesteps = x.size(1)
+        if timesteps <= max(padding_left, padding_right):
+            # Too short to be reflection padded: let the original module raise the error.
+            return self.depthwise_conv(x.transpose(1, 2)).transpose(1, 2)
+
+        conv = self.depthwise_conv[1]
+        # Shape: (kernel_size, channels)
+        weight = conv.weight.view(conv.weight.size(0), -1).t()
+        output = x * weight[padding_left]
+        if conv.bias is not None:
+            output = output + conv.bias
+        for kernel_index in range(weight.size(0)):
+            offset = kernel_index - padding_left
+            if offset > 0:
+                output[:, :timesteps - offset].addcmul_(x[:, offset:], weight[kernel_index])
+                # The reflection of the last input rows: x[timesteps - 1 - offset:timesteps - 1], reversed.
+                output[:, timesteps - offset:].addcmul_(x[:, timesteps - 1 - offset:timesteps - 1].flip(1),
+                                                        weight[kernel_index])
+            elif offset < 0:
+                output[:, -offset:].addcmul_(x[:, :timesteps + offset], weight[kernel_index])
+                # The reflection of the first input rows: x[1:1 - offset], reversed.
+                output[:, :-offset].addcmul_(x[:, 1:1 - offset].flip(1), weight[kernel_index])
+        return output
+
+    def pointwise_channel_last(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        Applies the pointwise convolution and the activation to a ``(..., in_channels)`` tensor.
+        The pointwise convolution is position-wise, so it is computed as a linear layer and does
+        not need the ``(batch_size, in_channels, timesteps)`` layout of the depthwise convolution.
+        """
+        weight = self.pointwise_conv.weight.view(self.pointwise_conv.out_channels, -1)
+        return self._activation(torch.nn.functional.linear(x, weight, self.pointwise_conv.bias))
@@ -10,22 +10,64 @@ class ResidualWithLayerDropout(torch.nn.Module):
     be stochastically dropped, returns either the input or output + input. During testing,
     it will re-calibrate the outputs of this layer by the expected number of times it
     participates in training.
+
+    To save the computation of the dropped layers, call :func:`drops_layer` before running the
+    layer, and then this module with ``skip_decision=True`` for the layers that were kept.
+
+    Parameters
+    ----------
+    undecayed_dropout_prob : ``float``, optional (default = 0.5)
+        The dropout probability of the last layer (see ``forward``).
+    seed : ``int``, optional (default = None)
+        If given, the layer dropout decisions are drawn from a ``torch.Generator`` with this
+        seed, rather than from the global torch random state.
     """
-    def __init__(self, undecayed_dropout_prob: float = 0.5) -> None:
+    def __init__(self, undecayed_dropout_prob: float = 0.5, seed: int = None) -> None:
         super().__init__()
         if undecayed_dropout_prob < 0 or undecayed_dropout_prob > 1:
             raise ValueError(f"undecayed dropout probability has to be between 0 and 1, "
                              f"but got {undecayed_dropout_prob}")
         self.undecayed_dropout_prob = undecayed_dropout_prob
+        self._generator = None
+        if seed is not None:
+            self._generator = torch.Generator()
+            self._generator.manual_seed(seed)
+        # The number of layer dropout decisions made in training, and how many of them dropped the layer.
+        self.num_decisions = 0
+        self.num_dropped = 0
 
     def extra_repr(self) -> str:
         inplace_str = ', inplace' if self.inplace else ''
         return f"undecayed_dropout_prob={self.undecayed_dropout_prob}{inplace_str}"
 
+    def get_dropout_prob(self, layer_index: int = None, total_layers: int = None) -> float:
+        if layer_index is not None and total_layers is not None:
+            return 1.0 * self.undecayed_dropout_prob * layer_index / total_layers
+        return 1.0 * self.undecayed_dropout_prob
+
+    def drops_layer(self, layer_index: int = None, total_layers: int = None) -> bool:
+        """
+        Decides whether to drop this layer for this whole mini-batch.  This is always ``False``
+        outside of training.  See ``forward`` for the parameters.
+        """
+        if not self.training:
+            return False
+        dropout_prob = self.get_dropout_prob(layer_index, total_layers)
+        if dropout_prob <= 0:
+            return False
+        if self._generator is not None:
+            dropped = bool(torch.rand(1, generator=self._generator) < dropout_prob)
+        else:
+            dropped = bool(torch.rand(1) < dropout_prob)
+        self.num_decisions += 1
+        self.num_dropped += int(dropped)
+        return dropped
+
     def forward(self, layer_input: torch.Tensor,
                 layer_output: torch.Tensor,
                 layer_index: int = None,
-                total_layers: int = None) -> torch.Tensor:
+                total_layers: int = None,
+                skip_decision: bool = False) -> torch.Tensor:
         # pylint: disable=arguments-differ
         """
         Apply dropout to this layer, for this whole mini-batch.
@@ -44,20 +86,18 @@ class ResidualWithLayerDropout(torch.nn.Module):
             together with the `total_layers` parameter.
         total_layers ``int``
             The total number of layers.
+        skip_decision ``bool``
+            Whether the caller already decided to keep this layer with :func:`drops_layer`.
 
         Returns
         -------
         output: ``torch.FloatTensor``
             A tensor with the same shape as `layer_input` and `layer_output`.
         """
-        if layer_index is not None and total_layers is not None:
-            dropout_prob = 1.0 * self.undecayed_dropout_prob * layer_index / total_layers
-        else:
-            dropout_prob = 1.0 * self.undecayed_dropout_prob
         if self.training:
-            if torch.rand(1) < dropout_prob:
+            if not skip_decision and self.drops_layer(layer_index, total_layers):
                 return layer_input
             else:
                 return layer_output + layer_input
         else:
-            return (1 - dropout_prob) * layer_output + layer_input
+            return (1 - self.get_dropout_prob(layer_index, total_layers)) * layer_output + layer_input
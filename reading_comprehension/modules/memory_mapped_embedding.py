@@ -0,0 +1,65 @@
+import numpy
+import torch
+from overrides import overrides
+
+from allennlp.common import Params
+from allennlp.common.checks import ConfigurationError
+from allennlp.data import Vocabulary
+from allennlp.modules.token_embedders.token_embedder import TokenEmbedder
+
+
+@TokenEmbedder.register("memory_mapped_embedding")
+class MemoryMappedEmbedding(TokenEmbedder):
+    """
+    A frozen embedding whose ``(num_embeddings, embedding_dim)`` weight matrix is a memory-mapped
+    ``.npy`` file instead of a parameter.  Only the pages holding the rows we look up are ever read,
+    and several processes serving the same model share these pages through the OS page cache, so
+    this cuts both the load time and the resident memory of inference workers.
+
+    The matrix may be stored as ``float16``, which halves its size; looked up rows are always
+    returned as ``float32``.  As the weight is not a parameter, it is not part of the state dict of
+    the model.
+
+    Parameters
+    ----------
+    embedding_file : ``str``
+        The ``.npy`` file with the weight matrix, as written by ``numpy.save``.
+    vocab_namespace : ``str``, optional (default = "tokens")
+        The vocabulary namespace the rows of the matrix correspond to.
+    """
+    def __init__(self, embedding_file: str, vocab_namespace: str = "tokens") -> None:
+        super().__init__()
+        self._embedding_file = embedding_file
+        self._vocab_namespace = vocab_namespace
+        self._weight = numpy.load(embedding_file, mmap_mode="r")
+        if self._weight.ndim != 2:
+            raise ConfigurationError(f"{embedding_file} should hold a matrix, but has shape {self._weight.shape}")
+        self.output_dim = self._weight.shape[1]
+
+    @property
+    def num_embeddings(self) -> int:
+        return self._weight.shape[0]
+
+    @overrides
+    def get_output_dim(self) -> int:
+        return self.output_dim
+
+    @overrides
+    def forward(self, inputs: torch.Tensor) -> torch.Tensor:  # pylint: disable=arguments-differ
+        # Indexing the memory map only reads the rows we need, and copies them.
+        indices = inputs.detach().cpu().numpy()
+        embedded = torch.from_numpy(self._weight[indices.reshape(-1)].astype(numpy.float32))
+        return embedded.view(*inputs.size(), self.output_dim).to(inputs.device)
+
+    @classmethod
+    def from_params(cls, vocab: Vocabulary, params: Params) -> 'MemoryMappedEmbedding':  # type: ignore
+        # pylint: disable=arguments-differ
+        embedding_file = params.pop("embedding_file")
+        vocab_namespace = params.pop("vocab_namespace", "tokens")
+        params.assert_empty(cls.__name__)
+        embedding = cls(embedding_file, vocab_namespace)
+        vocab_size = vocab.get_vocab_size(vocab_namespace)
+        if embedding.num_embeddings != vocab_size:
+            raise ConfigurationError(f"{embedding_file} has {embedding.num_embeddings} rows, but the "
+                                     f"'{vocab_namespace}' namespace has {vocab_size} entries.")
+        return embedding
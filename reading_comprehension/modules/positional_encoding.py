@@ -0,0 +1,52 @@
+from typing import Dict, Tuple
+
+import torch
+
+from allennlp.nn.util import add_positional_features
+
+
+class SinusoidalPositionalEncoding(torch.nn.Module):
+    """
+    Adds the sinusoidal timing signal of ``allennlp.nn.util.add_positional_features`` to its
+    input, slicing it from a precomputed table instead of computing the ``sin`` and ``cos`` of
+    every position in every call.
+
+    The table only depends on the input dimension and the timescales, so all the instances share
+    one table per input dimension, timescales and device: in a QANet, all the blocks of the phrase
+    and modeling encoders use the same one.  It holds ``max_timesteps`` positions, and grows (to
+    at least twice its size) when a longer input comes in.  The table can be recomputed at any
+    time, so it is kept out of the state dict, and it is not a module buffer, which
+    ``DistributedDataParallel`` would broadcast before every forward pass.
+
+    Parameters
+    ----------
+    max_timesteps : ``int``, optional (default = 512)
+        The number of positions of the table we start with.
+    min_timescale : ``float``, optional (default = 1.0)
+    max_timescale : ``float``, optional (default = 1.0e4)
+        The timescales of ``add_positional_features``.
+    """
+    _shared_tables: Dict[Tuple[int, float, float, torch.device], torch.Tensor] = {}
+
+    def __init__(self, max_timesteps: int = 512, min_timescale: float = 1.0, max_timescale: float = 1.0e4) -> None:
+        super().__init__()
+        self._max_timesteps = max_timesteps
+        self._min_timescale = min_timescale
+        self._max_timescale = max_timescale
+
+    def get_features(self, timesteps: int, dim: int, device: torch.device) -> torch.Tensor:
+        """
+        Returns the ``(timesteps, dim)`` float positional features on ``device``.
+        """
+        key = (dim, self._min_timescale, self._max_timescale, device)
+        table = self._shared_tables.get(key)
+        if table is None or table.size(0) < timesteps:
+            num_positions = max(self._max_timesteps, timesteps, 2 * table.size(0) if table is not None else 0)
+            table = add_positional_features(torch.zeros(1, num_positions, dim, device=device),
+                                            self._min_timescale, self._max_timescale)[0]
+            self._shared_tables[key] = table
+        return table[:timesteps]
+
+    def forward(self, inputs: torch.Tensor) -> torch.Tensor:  # pylint: disable=arguments-differ
+        _, timesteps, dim = inputs.size()
+        return inputs + self.get_features(timesteps, dim, inputs.device)
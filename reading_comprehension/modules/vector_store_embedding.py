@@ -0,0 +1,57 @@
+from allennlp.common import Params
+from allennlp.common.checks import ConfigurationError
+from allennlp.data import Vocabulary
+from allennlp.modules.token_embedders.embedding import Embedding
+from allennlp.modules.token_embedders.token_embedder import TokenEmbedder
+from reading_comprehension.pretrained_vector_store import PretrainedVectorStore
+
+
+@TokenEmbedder.register("vector_store_embedding")
+class VectorStoreEmbedding(Embedding):
+    """
+    An ``Embedding`` whose ``pretrained_file`` is the directory of a
+    :class:`~reading_comprehension.pretrained_vector_store.PretrainedVectorStore` instead of an
+    embeddings text file.  We only read the rows of the tokens in our vocabulary from the
+    memory-mapped store, which takes seconds instead of the minutes needed to parse a GloVe text
+    file.
+
+    All the other parameters are those of ``Embedding``.  As with ``Embedding``, the
+    ``pretrained_file`` is ignored when loading an archive, whose weights already hold the vectors.
+    """
+    @classmethod
+    def from_params(cls, vocab: Vocabulary, params: Params) -> 'VectorStoreEmbedding':  # type: ignore
+        # pylint: disable=arguments-differ
+        num_embeddings = params.pop_int('num_embeddings', None)
+        vocab_namespace = params.pop("vocab_namespace", "tokens")
+        if num_embeddings is None:
+            num_embeddings = vocab.get_vocab_size(vocab_namespace)
+        embedding_dim = params.pop_int('embedding_dim')
+        pretrained_file = params.pop("pretrained_file", None)
+        projection_dim = params.pop_int("projection_dim", None)
+        trainable = params.pop_bool("trainable", True)
+        padding_index = params.pop_int('padding_index', None)
+        max_norm = params.pop_float('max_norm', None)
+        norm_type = params.pop_float('norm_type', 2.)
+        scale_grad_by_freq = params.pop_bool('scale_grad_by_freq', False)
+        sparse = params.pop_bool('sparse', False)
+        params.assert_empty(cls.__name__)
+
+        if pretrained_file:
+            vector_store = PretrainedVectorStore(pretrained_file)
+            if vector_store.embedding_dim != embedding_dim:
+                raise ConfigurationError(f"The vectors in {pretrained_file} have {vector_store.embedding_dim} "
+                                         f"dimensions, but embedding_dim is {embedding_dim}.")
+            weight = vector_store.read_embedding_matrix(vocab, vocab_namespace)
+        else:
+            weight = None
+
+        return cls(num_embeddings=num_embeddings,
+                   embedding_dim=embedding_dim,
+                   projection_dim=projection_dim,
+                   weight=weight,
+                   padding_index=padding_index,
+                   trainable=trainable,
+                   max_norm=max_norm,
+                   norm_type=norm_type,
+                   scale_grad_by_freq=scale_grad_by_freq,
+                   sparse=sparse)
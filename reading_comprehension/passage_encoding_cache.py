@@ -0,0 +1,63 @@
+import collections
+import hashlib
+from typing import Any, Dict, Optional
+
+import torch
+
+
+class PassageEncodingCache:
+    """
+    A least-recently-used cache of question-independent passage encodings (see
+    :func:`~reading_comprehension.qanet.QaNet.encode_passage`), keyed by a hash of the passage
+    text, whose total tensor size is capped at ``max_memory_mb`` megabytes.
+
+    Each entry is a dictionary; all the tensors in it count towards the memory cap.
+    """
+    def __init__(self, max_memory_mb: float = 256) -> None:
+        self._max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self._entries: "collections.OrderedDict[str, Dict[str, Any]]" = collections.OrderedDict()
+        self._entry_bytes: Dict[str, int] = {}
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(passage_text: str) -> str:
+        return hashlib.sha1(passage_text.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        if key in self._entries:
+            self._remove(key)
+        entry_bytes = sum(value.numel() * value.element_size()
+                          for value in entry.values() if isinstance(value, torch.Tensor))
+        if entry_bytes > self._max_memory_bytes:
+            return
+        self._entries[key] = entry
+        self._entry_bytes[key] = entry_bytes
+        self.memory_bytes += entry_bytes
+        while self.memory_bytes > self._max_memory_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._entry_bytes.clear()
+        self.memory_bytes = 0
+
+    def _remove(self, key: str) -> None:
+        del self._entries[key]
+        self.memory_bytes -= self._entry_bytes.pop(key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
@@ -0,0 +1,136 @@
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, List
+
+import numpy
+import torch
+
+from allennlp.common import Tqdm
+from allennlp.common.checks import ConfigurationError
+from allennlp.data import Vocabulary
+from allennlp.modules.token_embedders.embedding import EmbeddingsTextFile
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class PretrainedVectorStore:
+    """
+    A binary, memory-mapped version of a pretrained embeddings text file (e.g. GloVe), so that
+    we parse the (zipped) text file only once, instead of once for the vocabulary and once for the
+    embedding in every run.
+
+    A store is a directory with two files:
+
+    1. ``vectors.npy``, the ``(num_tokens, embedding_dim)`` matrix of vectors, which we memory-map:
+       reading the vectors of our vocabulary only touches their rows.
+    2. ``tokens.txt``, with one ``"<token> <row>"`` line per token.  As the token comes first on
+       each line, this file can also be given as the ``pretrained_files`` of the vocabulary (with
+       ``only_include_pretrained_words``), which then reads a few megabytes of tokens instead of
+       gigabytes of vectors.
+
+    Use :func:`PretrainedVectorStore.convert` (or the ``convert-pretrained-vectors`` command) to
+    create a store, and a ``vector_store_embedding`` token embedder to read from it.
+    """
+    VECTORS_FILE = "vectors.npy"
+    TOKENS_FILE = "tokens.txt"
+
+    def __init__(self, directory: str) -> None:
+        vectors_path = os.path.join(directory, self.VECTORS_FILE)
+        tokens_path = os.path.join(directory, self.TOKENS_FILE)
+        if not os.path.exists(vectors_path) or not os.path.exists(tokens_path):
+            raise ConfigurationError(f"{directory} is not a pretrained vector store, see "
+                                     f"PretrainedVectorStore.convert.")
+        self.directory = directory
+        self.vectors = numpy.load(vectors_path, mmap_mode="r")
+        self._tokens_path = tokens_path
+        self._token_to_row: Dict[str, int] = None
+
+    @property
+    def embedding_dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def token_to_row(self) -> Dict[str, int]:
+        if self._token_to_row is None:
+            self._token_to_row = {}
+            with open(self._tokens_path, encoding="utf-8") as tokens_file:
+                for line in tokens_file:
+                    token, row = line.rstrip("\n").rsplit(" ", 1)
+                    self._token_to_row[token] = int(row)
+        return self._token_to_row
+
+    def read_embedding_matrix(self, vocab: Vocabulary, namespace: str = "tokens") -> torch.FloatTensor:
+        """
+        Returns the embedding matrix of the ``namespace`` tokens of ``vocab``, exactly like
+        AllenNLP's ``_read_pretrained_embeddings_file`` does for a text file: the rows of tokens
+        without a pretrained vector are sampled from a normal distribution with the mean and
+        standard deviation of the pretrained vectors we found.
+        """
+        token_to_row = self.token_to_row
+        vocab_indices: List[int] = []
+        rows: List[int] = []
+        for index, token in vocab.get_index_to_token_vocabulary(namespace).items():
+            if token in token_to_row:
+                vocab_indices.append(index)
+                rows.append(token_to_row[token])
+        if not rows:
+            raise ConfigurationError(f"No token of the '{namespace}' namespace is in {self.directory}.")
+        logger.info("Found pretrained vectors for %d out of %d tokens",
+                    len(rows), vocab.get_vocab_size(namespace))
+
+        # Reading sorted rows keeps the accesses to the memory map sequential.
+        order = numpy.argsort(rows)
+        found_vectors = numpy.asarray(self.vectors[numpy.asarray(rows)[order]], dtype=numpy.float32)
+        embeddings_mean = float(numpy.mean(found_vectors))
+        embeddings_std = float(numpy.std(found_vectors))
+        embedding_matrix = torch.FloatTensor(vocab.get_vocab_size(namespace),
+                                             self.embedding_dim).normal_(embeddings_mean, embeddings_std)
+        embedding_matrix[torch.LongTensor(vocab_indices)[torch.from_numpy(order)]] = \
+            torch.from_numpy(found_vectors)
+        return embedding_matrix
+
+    @classmethod
+    def convert(cls,
+                embeddings_file_uri: str,
+                directory: str,
+                embedding_dim: int,
+                dtype: str = "float32") -> 'PretrainedVectorStore':
+        """
+        Parses an embeddings text file (anything ``EmbeddingsTextFile`` accepts, e.g. a zipped
+        GloVe file) into a store in ``directory``.  Like AllenNLP, we skip the lines without
+        ``embedding_dim`` values, and the last vector of a repeated token wins.
+        """
+        os.makedirs(directory, exist_ok=True)
+        token_to_row: Dict[str, int] = {}
+        num_rows = 0
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as raw_vectors_file:
+            raw_vectors_path = raw_vectors_file.name
+            with EmbeddingsTextFile(embeddings_file_uri) as embeddings_file:
+                for line in Tqdm.tqdm(embeddings_file):
+                    fields = line.rstrip().split(' ')
+                    if len(fields) - 1 != embedding_dim:
+                        logger.warning("Found line with wrong number of dimensions (expected: %d; actual: %d): %s",
+                                       embedding_dim, len(fields) - 1, line[:50])
+                        continue
+                    raw_vectors_file.write(numpy.asarray(fields[1:], dtype=dtype).tobytes())
+                    token_to_row[fields[0]] = num_rows
+                    num_rows += 1
+
+        # We only know the shape of the matrix now, so we prepend the .npy header to the raw rows.
+        vectors_path = os.path.join(directory, cls.VECTORS_FILE)
+        header = {"descr": numpy.lib.format.dtype_to_descr(numpy.dtype(dtype)),
+                  "fortran_order": False,
+                  "shape": (num_rows, embedding_dim)}
+        with open(vectors_path, "wb") as vectors_file:
+            numpy.lib.format.write_array_header_1_0(vectors_file, header)
+            with open(raw_vectors_path, "rb") as raw_vectors_file:
+                shutil.copyfileobj(raw_vectors_file, vectors_file, 16 * 1024 * 1024)
+        os.remove(raw_vectors_path)
+
+        with open(os.path.join(directory, cls.TOKENS_FILE), "w", encoding="utf-8") as tokens_file:
+            for token, row in token_to_row.items():
+                tokens_file.write(f"{token} {row}\n")
+        logger.info("Wrote %d vectors (%d distinct tokens) to %s", num_rows, len(token_to_row), directory)
+        return cls(directory)
@@ -1,8 +1,12 @@
-from typing import Any, Dict, List, Optional
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+from overrides import overrides
 import torch
-from torch.nn.functional import nll_loss
+from torch.nn.functional import nll_loss, pad
 
+from allennlp.common.checks import ConfigurationError
 from allennlp.data import Vocabulary
 from allennlp.models.model import Model
 from allennlp.models.reading_comprehension.bidaf import BidirectionalAttentionFlow
@@ -11,7 +15,9 @@ from allennlp.modules import Seq2SeqEncoder, TextFieldEmbedder
 from allennlp.modules.matrix_attention.matrix_attention import MatrixAttention
 from allennlp.nn import util, InitializerApplicator, RegularizerApplicator
 from allennlp.training.metrics import BooleanAccuracy, CategoricalAccuracy, SquadEmAndF1
-from reading_comprehension.utils import memory_effient_masked_softmax as masked_softmax
+from reading_comprehension.qanet_encoder import QaNetEncoder
+from reading_comprehension.utils import kl_divergence, masked_span_scores, \
+    memory_effient_masked_softmax as masked_softmax
 
 
 @Model.register("qanet")
@@ -46,7 +52,39 @@ class QaNet(Model):
     initializer : ``InitializerApplicator``, optional (default=``InitializerApplicator()``)
         Used to initialize the model parameters.
     regularizer : ``RegularizerApplicator``, optional (default=``None``)
-        If provided, will be used to calculate the regularization penalty during training.
+        If provided, will be used to calculate the regularization penalty during training.  It
+        only applies to the trainable parameters (see :func:`get_regularization_penalty`).
+    window_size : ``int``, optional (default=``None``)
+        If given, in evaluation mode, passages longer than this are read through overlapping
+        windows of ``window_size`` tokens, so that the cost grows linearly with the passage length
+        instead of quadratically.  Only the per-token embedding layers see the whole passage: the
+        ``phrase_layer``, the passage-question attention and the ``modeling_layer`` run on each
+        window, batched together.  The best span is the best span of the window where it scores
+        highest, and the passage-level span logits are the maximum over the windows of each
+        token.  The (window-level) ``passage_question_attention`` is then not returned.  Use it
+        with a reader which does not cut the passages for evaluation, e.g. a ``squad_limited``
+        reader with ``cut_passages_for_evaluation`` set to false.
+    window_stride : ``int``, optional (default=``window_size // 2``)
+        The number of tokens between the starts of two consecutive windows, at most ``window_size``.
+    fuse_question_and_passage : ``bool``, optional (default=``False``)
+        If true, the questions and passages go through the embedding, highway and projection
+        layers in one call, concatenated along the time axis, and through the ``phrase_layer`` in
+        one call, stacked along the batch axis and padded to the same length, instead of one call
+        of each layer for the questions and another one for the passages.  A ``qanet_encoder``
+        phrase layer must set ``use_packed_sequences``, so that the question padding only costs in
+        the depthwise convolutions and self attention: without it, the phrase layer would run over
+        ``2 * batch_size * passage_length`` positions, more than the separate calls.  As with any
+        change of padding, this slightly changes the character encodings of the question words
+        (padded to the longest word of the passages too) and the convolution outputs at the end of
+        the longest question, which sees padding instead of its reflection.  In training, the
+        questions and passages of a batch also share the layer dropout decisions of the single
+        phrase layer call, where the separate calls draw them independently.
+    distillation_weight : ``float``, optional (default=0.5)
+        When the span start and end probabilities of a teacher model are given (see the
+        ``teacher_probabilities_file`` of the ``squad_limited`` reader), the training loss is
+        ``(1 - distillation_weight)`` times the negative log likelihood of the gold span, plus
+        ``distillation_weight`` times the KL divergence from the teacher's span start and end
+        distributions to the model's, so that a smaller model learns from a larger one.
     """
 
     def __init__(self, vocab: Vocabulary,
@@ -57,7 +95,11 @@ class QaNet(Model):
                  modeling_layer: Seq2SeqEncoder,
                  dropout_prob: float = 0.1,
                  initializer: InitializerApplicator = InitializerApplicator(),
-                 regularizer: Optional[RegularizerApplicator] = None) -> None:
+                 regularizer: Optional[RegularizerApplicator] = None,
+                 window_size: int = None,
+                 window_stride: int = None,
+                 fuse_question_and_passage: bool = False,
+                 distillation_weight: float = 0.5) -> None:
         super().__init__(vocab, regularizer)
 
         text_embed_dim = text_field_embedder.get_output_dim()
@@ -88,6 +130,20 @@ class QaNet(Model):
         self._squad_metrics = SquadEmAndF1()
         self._dropout = torch.nn.Dropout(p=dropout_prob)
 
+        self._window_size = window_size
+        self._window_stride = window_stride or (window_size // 2 if window_size else None)
+        # A larger stride would skip the tokens between the windows.
+        if window_size is not None and not 0 < self._window_stride <= window_size:
+            raise ConfigurationError(f"window_stride must be between 1 and window_size ({window_size}), "
+                                     f"not {self._window_stride}.")
+        # The questions padded to the passage length would cost more than the separate calls.
+        if fuse_question_and_passage and isinstance(phrase_layer, QaNetEncoder) \
+                and not phrase_layer._use_packed_sequences:  # pylint: disable=protected-access
+            raise ConfigurationError("fuse_question_and_passage needs the use_packed_sequences "
+                                     "of the qanet_encoder phrase layer.")
+        self._fuse_question_and_passage = fuse_question_and_passage
+        self._distillation_weight = distillation_weight
+
         initializer(self)
 
     def forward(self,  # type: ignore
@@ -95,7 +151,9 @@ class QaNet(Model):
                 passage: Dict[str, torch.LongTensor],
                 span_start: torch.IntTensor = None,
                 span_end: torch.IntTensor = None,
-                metadata: List[Dict[str, Any]] = None) -> Dict[str, torch.Tensor]:
+                metadata: List[Dict[str, Any]] = None,
+                span_start_teacher_probs: torch.FloatTensor = None,
+                span_end_teacher_probs: torch.FloatTensor = None) -> Dict[str, torch.Tensor]:
         # pylint: disable=arguments-differ
         """
         Parameters
@@ -121,6 +179,11 @@ class QaNet(Model):
             should be the batch size, and each dictionary should have the keys ``id``,
             ``original_passage``, and ``token_offsets``.  If you only want the best span string and
             don't care about official metrics, you can omit the ``id`` key.
+        span_start_teacher_probs : ``torch.FloatTensor``, optional
+            From an ``ArrayField``.  The span start probabilities of a teacher model, which the
+            training loss distills (see ``distillation_weight``) along with the gold span.
+        span_end_teacher_probs : ``torch.FloatTensor``, optional
+            From an ``ArrayField``.  The span end probabilities of the teacher model.
 
         Returns
         -------
@@ -149,19 +212,207 @@ class QaNet(Model):
         question_mask = util.get_text_field_mask(question).float()
         passage_mask = util.get_text_field_mask(passage).float()
 
-        embedded_question = self._dropout(self._text_field_embedder(question))
-        embedded_passage = self._dropout(self._text_field_embedder(passage))
-        embedded_question = self._highway_layer(self._embedding_proj_layer(embedded_question))
-        embedded_passage = self._highway_layer(self._embedding_proj_layer(embedded_passage))
+        if self._window_size is not None and not self.training and passage_mask.size(1) > self._window_size:
+            encoded_question = self._encode_text(question, question_mask)
+            return self._predict_windowed_span(encoded_question, question_mask, passage, passage_mask,
+                                               span_start, span_end, metadata)
+        if self._fuse_question_and_passage:
+            encoded_question, encoded_passage = self._encode_question_and_passage(question, question_mask,
+                                                                                  passage, passage_mask)
+        else:
+            encoded_question = self._encode_text(question, question_mask)
+            encoded_passage = self._encode_text(passage, passage_mask)
+
+        teacher_probs = None
+        if span_start_teacher_probs is not None:
+            teacher_probs = (span_start_teacher_probs, span_end_teacher_probs)
+        return self._predict_span(encoded_question, question_mask, encoded_passage, passage_mask,
+                                  span_start, span_end, metadata, teacher_probs)
+
+    def encode_passage(self, passage: Dict[str, torch.LongTensor]) -> Dict[str, torch.Tensor]:
+        """
+        Runs the question-independent part of the model over ``passage``: the embedding, highway
+        and projection layers and the ``phrase_layer``.  Together with :func:`answer_questions`,
+        this lets us encode a passage once and answer many questions about it.
 
-        batch_size = embedded_question.size(0)
+        Parameters
+        ----------
+        passage : Dict[str, torch.LongTensor]
+            From a ``TextField``.
 
-        projected_embedded_question = self._encoding_proj_layer(embedded_question)
-        projected_embedded_passage = self._encoding_proj_layer(embedded_passage)
+        Returns
+        -------
+        A dictionary with the ``encoded_passage``, of shape ``(batch_size, passage_length,
+        encoding_dim)``, and the float ``passage_mask``, of shape ``(batch_size, passage_length)``.
+        """
+        passage_mask = util.get_text_field_mask(passage).float()
+        return {"encoded_passage": self._encode_text(passage, passage_mask), "passage_mask": passage_mask}
 
-        encoded_question = self._dropout(self._phrase_layer(projected_embedded_question, question_mask))
-        encoded_passage = self._dropout(self._phrase_layer(projected_embedded_passage, passage_mask))
+    def answer_questions(self,
+                         question: Dict[str, torch.LongTensor],
+                         encoded_passage: torch.Tensor,
+                         passage_mask: torch.Tensor,
+                         metadata: List[Dict[str, Any]] = None) -> Dict[str, torch.Tensor]:
+        """
+        Answers a batch of questions against passages encoded with :func:`encode_passage`, running
+        only the question encoding, the context-query attention and the modeling and output layers.
+        If ``encoded_passage`` has a batch size of 1, all the questions are asked about that same
+        passage.  The output dictionary is the same as the one of :func:`forward`, without a loss.
+        """
+        question_mask = util.get_text_field_mask(question).float()
+        encoded_question = self._encode_text(question, question_mask)
+        batch_size = encoded_question.size(0)
+        if encoded_passage.size(0) == 1 and batch_size > 1:
+            encoded_passage = encoded_passage.expand(batch_size, -1, -1)
+            passage_mask = passage_mask.expand(batch_size, -1)
+        return self._predict_span(encoded_question, question_mask, encoded_passage, passage_mask,
+                                  metadata=metadata)
+
+    def _embed_text(self, text: Dict[str, torch.LongTensor]) -> torch.Tensor:
+        embedded_text = self._dropout(self._text_field_embedder(text))
+        embedded_text = self._highway_layer(self._embedding_proj_layer(embedded_text))
+        return self._encoding_proj_layer(embedded_text)
+
+    def _encode_text(self, text: Dict[str, torch.LongTensor], mask: torch.Tensor) -> torch.Tensor:
+        return self._dropout(self._phrase_layer(self._embed_text(text), mask))
+
+    def _encode_question_and_passage(self,
+                                     question: Dict[str, torch.LongTensor],
+                                     question_mask: torch.Tensor,
+                                     passage: Dict[str, torch.LongTensor],
+                                     passage_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        The same as ``_encode_text`` of the question and of the passage, with one call of each
+        layer for both (see ``fuse_question_and_passage``).
+        """
+        batch_size, question_length = question_mask.size()
+        passage_length = passage_mask.size(1)
+
+        # The embedding, highway and projection layers work token by token, so we run them over the
+        # question and passage tokens concatenated along the time axis.
+        text = {}
+        for key, question_tensor in question.items():
+            passage_tensor = passage[key]
+            if question_tensor.dim() > 2:
+                # E.g. the characters of the words, padded to the longest word of both.
+                num_characters = max(question_tensor.size(-1), passage_tensor.size(-1))
+                question_tensor = pad(question_tensor, [0, num_characters - question_tensor.size(-1)])
+                passage_tensor = pad(passage_tensor, [0, num_characters - passage_tensor.size(-1)])
+            text[key] = torch.cat([question_tensor, passage_tensor], 1)
+        # Shape: (batch_size, question_length + passage_length, encoding_dim)
+        embedded_text = self._embed_text(text)
+
+        # The phrase layer mixes the tokens of a sequence, so the questions and passages are
+        # separate sequences of one batch.
+        timesteps = max(question_length, passage_length)
+        embedded_questions = pad(embedded_text[:, :question_length], [0, 0, 0, timesteps - question_length])
+        embedded_passages = pad(embedded_text[:, question_length:], [0, 0, 0, timesteps - passage_length])
+        # Shape: (2 * batch_size, timesteps, encoding_dim)
+        embedded_sequences = torch.cat([embedded_questions, embedded_passages], 0)
+        # Shape: (2 * batch_size, timesteps)
+        sequence_mask = torch.cat([pad(question_mask, [0, timesteps - question_length]),
+                                   pad(passage_mask, [0, timesteps - passage_length])],
+                                  0)
+        encoded_sequences = self._dropout(self._phrase_layer(embedded_sequences, sequence_mask))
+        return encoded_sequences[:batch_size, :question_length], encoded_sequences[batch_size:, :passage_length]
+
+    def _predict_span(self,
+                      encoded_question: torch.Tensor,
+                      question_mask: torch.Tensor,
+                      encoded_passage: torch.Tensor,
+                      passage_mask: torch.Tensor,
+                      span_start: torch.IntTensor = None,
+                      span_end: torch.IntTensor = None,
+                      metadata: List[Dict[str, Any]] = None,
+                      teacher_probs: Tuple[torch.Tensor, torch.Tensor] = None) -> Dict[str, torch.Tensor]:
+        passage_question_attention, span_start_logits, span_end_logits = \
+                self._compute_span_logits(encoded_question, question_mask, encoded_passage, passage_mask)
+        output_dict = self._decode_spans(span_start_logits, span_end_logits, passage_mask,
+                                         span_start, span_end, metadata, teacher_probs=teacher_probs)
+        output_dict["passage_question_attention"] = passage_question_attention
+        return output_dict
 
+    def _predict_windowed_span(self,
+                               encoded_question: torch.Tensor,
+                               question_mask: torch.Tensor,
+                               passage: Dict[str, torch.LongTensor],
+                               passage_mask: torch.Tensor,
+                               span_start: torch.IntTensor = None,
+                               span_end: torch.IntTensor = None,
+                               metadata: List[Dict[str, Any]] = None) -> Dict[str, torch.Tensor]:
+        """
+        Like :func:`_predict_span`, but runs the ``phrase_layer`` and everything after it on
+        overlapping windows of the passage (see ``window_size``).
+        """
+        window_size, window_stride = self._window_size, self._window_stride
+        batch_size, passage_length = passage_mask.size()
+        num_windows = math.ceil((passage_length - window_size) / window_stride) + 1
+        padded_length = (num_windows - 1) * window_stride + window_size
+        padding = padded_length - passage_length
+
+        # Shape: (batch_size, padded_length, encoding_dim)
+        embedded_passage = pad(self._embed_text(passage), [0, 0, 0, padding])
+        # Shape: (batch_size, padded_length)
+        padded_mask = pad(passage_mask, [0, padding])
+        # Shape: (batch_size * num_windows, window_size, encoding_dim)
+        window_embeddings = embedded_passage.unfold(1, window_size, window_stride).transpose(2, 3) \
+                .reshape(batch_size * num_windows, window_size, -1)
+        # Shape: (batch_size * num_windows, window_size)
+        window_masks = padded_mask.unfold(1, window_size, window_stride).reshape(batch_size * num_windows, -1)
+
+        # We only run the windows starting with a passage token, i.e. not only made of padding.
+        # Shape: (num_used_windows,)
+        used_windows = (window_masks[:, 0] > 0).nonzero().squeeze(-1)
+        batch_indices = torch.arange(batch_size, device=passage_mask.device).unsqueeze(1) \
+                .expand(batch_size, num_windows).reshape(-1).index_select(0, used_windows)
+        used_window_masks = window_masks.index_select(0, used_windows)
+        encoded_windows = self._dropout(self._phrase_layer(window_embeddings.index_select(0, used_windows),
+                                                           used_window_masks))
+        _, used_start_logits, used_end_logits = \
+                self._compute_span_logits(encoded_question.index_select(0, batch_indices),
+                                          question_mask.index_select(0, batch_indices),
+                                          encoded_windows,
+                                          used_window_masks)
+        used_start_logits = util.replace_masked_values(used_start_logits, used_window_masks, -1e7)
+        used_end_logits = util.replace_masked_values(used_end_logits, used_window_masks, -1e7)
+        # Shape: (num_used_windows, 2)
+        used_best_spans = BidirectionalAttentionFlow.get_best_span(used_start_logits, used_end_logits)
+        used_best_scores = used_start_logits.gather(1, used_best_spans[:, :1]).squeeze(-1) + \
+                used_end_logits.gather(1, used_best_spans[:, 1:]).squeeze(-1)
+
+        # The best span of each passage is the one of its window with the best score.
+        best_scores = used_best_scores.new_full((batch_size * num_windows,), -float("inf")) \
+                .index_copy(0, used_windows, used_best_scores).view(batch_size, num_windows)
+        best_windows = best_scores.argmax(-1)
+        window_best_spans = used_best_spans.new_zeros((batch_size * num_windows, 2)) \
+                .index_copy(0, used_windows, used_best_spans).view(batch_size, num_windows, 2)
+        best_span = window_best_spans[torch.arange(batch_size, device=best_windows.device), best_windows] + \
+                (best_windows * window_stride).unsqueeze(-1)
+
+        # The passage-level logits of a token are its best logits over the windows.
+        span_logits = []
+        for used_logits in [used_start_logits, used_end_logits]:
+            window_logits = used_logits.new_full((batch_size * num_windows, window_size), -1e7) \
+                    .index_copy(0, used_windows, used_logits).view(batch_size, num_windows, window_size)
+            passage_logits = used_logits.new_full((batch_size, padded_length), -1e7)
+            for window in range(num_windows):
+                window_start = window * window_stride
+                passage_logits[:, window_start:window_start + window_size] = \
+                        torch.max(passage_logits[:, window_start:window_start + window_size],
+                                  window_logits[:, window])
+            span_logits.append(passage_logits[:, :passage_length])
+
+        return self._decode_spans(span_logits[0], span_logits[1], passage_mask,
+                                  span_start, span_end, metadata, best_span)
+
+    def _compute_span_logits(self,
+                             encoded_question: torch.Tensor,
+                             question_mask: torch.Tensor,
+                             encoded_passage: torch.Tensor,
+                             passage_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Returns the ``passage_question_attention`` and the (unmasked) span start and end logits.
+        """
         # Shape: (batch_size, passage_length, question_length)
         passage_question_similarity = self._matrix_attention(encoded_passage, encoded_question)
         # Shape: (batch_size, passage_length, question_length)
@@ -193,20 +444,39 @@ class QaNet(Model):
         # Shape: (batch_size, passage_length, encoding_dim * 4 + modeling_dim))
         span_start_input = torch.cat([modeled_passage_list[-3], modeled_passage_list[-2]], dim=-1)
         # Shape: (batch_size, passage_length)
-        span_start_logits = self._span_start_predictor(span_start_input).squeeze(-1)
-        # Shape: (batch_size, passage_length)
-        span_start_probs = masked_softmax(span_start_logits, passage_mask)
+        # The output layer works in float32 even under mixed precision, so that the -1e7 mask values
+        # of _decode_spans do not overflow, and the span scores and loss keep their precision.
+        span_start_logits = self._span_start_predictor(span_start_input).squeeze(-1).float()
 
         # Shape: (batch_size, passage_length, encoding_dim * 4 + span_end_encoding_dim)
         span_end_input = torch.cat([modeled_passage_list[-3], modeled_passage_list[-1]], dim=-1)
-        span_end_logits = self._span_end_predictor(span_end_input).squeeze(-1)
-        span_end_probs = masked_softmax(span_end_logits, passage_mask)
-        span_start_logits = util.replace_masked_values(span_start_logits, passage_mask, -1e7)
-        span_end_logits = util.replace_masked_values(span_end_logits, passage_mask, -1e7)
-        best_span = BidirectionalAttentionFlow.get_best_span(span_start_logits, span_end_logits)
+        span_end_logits = self._span_end_predictor(span_end_input).squeeze(-1).float()
+        return passage_question_attention, span_start_logits, span_end_logits
+
+    def _decode_spans(self,
+                      span_start_logits: torch.Tensor,
+                      span_end_logits: torch.Tensor,
+                      passage_mask: torch.Tensor,
+                      span_start: torch.IntTensor = None,
+                      span_end: torch.IntTensor = None,
+                      metadata: List[Dict[str, Any]] = None,
+                      best_span: torch.Tensor = None,
+                      teacher_probs: Tuple[torch.Tensor, torch.Tensor] = None) -> Dict[str, torch.Tensor]:
+        """
+        Computes the span probabilities, the best span (unless given), the loss and the metrics
+        from the span logits.  With the span start and end ``teacher_probs``, the loss distills
+        them as well.
+        """
+        batch_size = span_start_logits.size(0)
+        # One masking per head for the masked logits, the probabilities and the log probabilities.
+        # Shape: (batch_size, passage_length)
+        span_start_logits, span_start_probs, span_start_log_probs = masked_span_scores(span_start_logits,
+                                                                                       passage_mask)
+        span_end_logits, span_end_probs, span_end_log_probs = masked_span_scores(span_end_logits, passage_mask)
+        if best_span is None:
+            best_span = BidirectionalAttentionFlow.get_best_span(span_start_logits, span_end_logits)
 
         output_dict = {
-                "passage_question_attention": passage_question_attention,
                 "span_start_logits": span_start_logits,
                 "span_start_probs": span_start_probs,
                 "span_end_logits": span_end_logits,
@@ -216,11 +486,17 @@ class QaNet(Model):
 
         # Compute the loss for training.
         if span_start is not None:
-            loss = nll_loss(util.masked_log_softmax(span_start_logits, passage_mask), span_start.squeeze(-1))
+            loss = nll_loss(span_start_log_probs, span_start.squeeze(-1))
             self._span_start_accuracy(span_start_logits, span_start.squeeze(-1))
-            loss += nll_loss(util.masked_log_softmax(span_end_logits, passage_mask), span_end.squeeze(-1))
+            loss += nll_loss(span_end_log_probs, span_end.squeeze(-1))
             self._span_end_accuracy(span_end_logits, span_end.squeeze(-1))
             self._span_accuracy(best_span, torch.stack([span_start, span_end], -1))
+            if teacher_probs is not None:
+                distillation_loss = kl_divergence(_fit_to_passage(teacher_probs[0], passage_mask),
+                                                  span_start_log_probs)
+                distillation_loss += kl_divergence(_fit_to_passage(teacher_probs[1], passage_mask),
+                                                   span_end_log_probs)
+                loss = (1 - self._distillation_weight) * loss + self._distillation_weight * distillation_loss
             output_dict["loss"] = loss
 
         # Compute the EM and F1 on SQuAD and add the tokenized input to the output.
@@ -245,6 +521,26 @@ class QaNet(Model):
             output_dict['passage_tokens'] = passage_tokens
         return output_dict
 
+    @overrides
+    def get_regularization_penalty(self) -> Union[float, torch.Tensor]:
+        """
+        Unlike ``Model.get_regularization_penalty``, this skips the frozen parameters, e.g. the
+        pretrained word embeddings, by far the largest tensor of the model: their penalty is a
+        constant, with no gradient, which would only cost time in every batch.
+        """
+        # pylint: disable=protected-access
+        if self._regularizer is None:
+            return 0.0
+        accumulator = 0.0
+        for name, parameter in self.named_parameters():
+            if not parameter.requires_grad:
+                continue
+            for regex, regularizer in self._regularizer._regularizers:
+                if re.search(regex, name):
+                    accumulator = accumulator + regularizer(parameter)
+                    break
+        return accumulator
+
     def get_metrics(self, reset: bool = False) -> Dict[str, float]:
         exact_match, f1_score = self._squad_metrics.get_metric(reset)
         return {
@@ -254,3 +550,14 @@ class QaNet(Model):
                 'em': exact_match,
                 'f1': f1_score,
                 }
+
+
+def _fit_to_passage(probs: torch.Tensor, passage_mask: torch.Tensor) -> torch.Tensor:
+    """
+    Cuts or pads the ``(batch_size, length)`` span probabilities of a teacher to the passage
+    length, e.g. if the trainer cut the passages (see the ``passage_length_curriculum`` of the
+    ``ema_trainer``), and renormalizes them over the passage tokens.
+    """
+    passage_length = passage_mask.size(1)
+    probs = pad(probs[:, :passage_length], [0, max(0, passage_length - probs.size(1))]) * passage_mask
+    return probs / probs.sum(-1, keepdim=True).clamp(min=1e-20)
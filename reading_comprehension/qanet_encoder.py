@@ -8,11 +8,13 @@ from allennlp.modules.feedforward import FeedForward
 from allennlp.modules.seq2seq_encoders.multi_head_self_attention import MultiHeadSelfAttention
 from allennlp.modules.seq2seq_encoders.seq2seq_encoder import Seq2SeqEncoder
 from allennlp.nn.activations import Activation
-from allennlp.nn.util import add_positional_features, weighted_sum
+from allennlp.nn.util import weighted_sum
 from allennlp.common.checks import check_dimensions_match
 from reading_comprehension.modules.layer_dropout import ResidualWithLayerDropout
 from reading_comprehension.modules.depthwise_separable_conv import DepthwiseSeparableConv
+from reading_comprehension.modules.positional_encoding import SinusoidalPositionalEncoding
 from reading_comprehension.utils import memory_effient_masked_softmax as masked_softmax
+from reading_comprehension.utils import get_packed_indices, pack_padded, unpack_to_padded
 
 
 @Seq2SeqEncoder.register("qanet_encoder_block")
@@ -53,7 +55,8 @@ class QaNetEncoderBlock(Seq2SeqEncoder):
         Whether to add sinusoidal frequencies to the input tensor. This is strongly recommended,
         as without this feature, the self attention layers have no idea of absolute or relative
         position (as they are just computing pairwise similarity between vectors of elements),
-        which can be important features for many tasks.
+        which can be important features for many tasks.  The sinusoids are sliced from a table
+        shared by all the blocks (see :class:`SinusoidalPositionalEncoding`).
     dropout_prob : ``float``, optional, (default = 0.1)
         The dropout probability for the feedforward network.
     layer_dropout_undecayed_prob : ``float``, optional, (default = 0.1)
@@ -62,6 +65,19 @@ class QaNetEncoderBlock(Seq2SeqEncoder):
         stochastically dropped according to its layer dropout probability.
     attention_dropout_prob : ``float``, optional, (default = 0)
         The dropout probability for the attention distributions in the attention layer.
+    use_packed_sequences : ``bool``, optional, (default = False)
+        Whether to run the position-wise sublayers (layer norms, pointwise convolutions and
+        feedforward network) over the unpadded elements only, gathered into a flat tensor.  Only
+        the depthwise convolutions and the self attention then use the padded layout, with zeros
+        at the padding positions.  The default mode convolves over the (non-zero) padding
+        positions instead, so the outputs of the last ``conv_kernel_size // 2`` elements of the
+        shorter sequences of a batch differ slightly between the two modes.
+    layer_dropout_seed : ``int``, optional, (default = None)
+        If given, the layer dropout decisions are drawn from a generator seeded with this value
+        instead of the global torch random state.
+    positional_encoding_max_timesteps : ``int``, optional, (default = 512)
+        The number of positions of the positional encoding table we start with.  It grows on
+        demand for longer inputs.
     """
 
     def __init__(self,
@@ -75,12 +91,17 @@ class QaNetEncoderBlock(Seq2SeqEncoder):
                  use_positional_encoding: bool = True,
                  dropout_prob: float = 0.1,
                  layer_dropout_undecayed_prob: float = 0.1,
-                 attention_dropout_prob: float = 0) -> None:
+                 attention_dropout_prob: float = 0,
+                 use_packed_sequences: bool = False,
+                 layer_dropout_seed: int = None,
+                 positional_encoding_max_timesteps: int = 512) -> None:
         super().__init__()
 
         check_dimensions_match(input_dim, hidden_dim, 'input_dim', 'hidden_dim')
 
         self._use_positional_encoding = use_positional_encoding
+        self._positional_encoding = SinusoidalPositionalEncoding(positional_encoding_max_timesteps)
+        self._use_packed_sequences = use_packed_sequences
 
         self._conv_norm_layers = torch.nn.ModuleList([LayerNorm(hidden_dim) for _ in range(num_convs)])
         self._conv_layers = torch.nn.ModuleList([
@@ -102,7 +123,8 @@ class QaNetEncoderBlock(Seq2SeqEncoder):
                                        dropout=dropout_prob)
 
         self.dropout = Dropout(dropout_prob)
-        self.residual_with_layer_dropout = ResidualWithLayerDropout(layer_dropout_undecayed_prob)
+        self.residual_with_layer_dropout = ResidualWithLayerDropout(layer_dropout_undecayed_prob,
+                                                                    seed=layer_dropout_seed)
         self._input_dim = input_dim
         self._output_dim = hidden_dim
 
@@ -120,9 +142,14 @@ class QaNetEncoderBlock(Seq2SeqEncoder):
 
     @overrides
     def forward(self, inputs: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:  # pylint: disable=arguments-differ
+        if self._use_packed_sequences and mask is not None:
+            batch_size, timesteps = mask.size()
+            packed_indices = get_packed_indices(mask)
+            packed_output = self.forward_packed(pack_padded(inputs, packed_indices), packed_indices, mask)
+            return unpack_to_padded(packed_output, packed_indices, batch_size, timesteps)
 
         if self._use_positional_encoding:
-            output = add_positional_features(inputs)
+            output = self._positional_encoding(inputs)
         else:
             output = inputs
 
@@ -130,23 +157,80 @@ class QaNetEncoderBlock(Seq2SeqEncoder):
         sublayer_count = 0
 
         for conv_norm_layer, conv_layer in zip(self._conv_norm_layers, self._conv_layers):
+            sublayer_count += 1
+            if self.residual_with_layer_dropout.drops_layer(sublayer_count, total_sublayers):
+                continue
             conv_norm_out = self.dropout(conv_norm_layer(output))
-            conv_out = self.dropout(conv_layer(conv_norm_out.transpose_(1, 2)).transpose_(1, 2))
+            conv_out = self.dropout(conv_layer.forward_channel_last(conv_norm_out))
+            output = self.residual_with_layer_dropout(output, conv_out, sublayer_count, total_sublayers,
+                                                      skip_decision=True)
+
+        sublayer_count += 1
+        if not self.residual_with_layer_dropout.drops_layer(sublayer_count, total_sublayers):
+            attention_norm_out = self.dropout(self.attention_norm_layer(output))
+            attention_out = self.dropout(self.attention_layer(attention_norm_out, mask))
+            output = self.residual_with_layer_dropout(output, attention_out, sublayer_count, total_sublayers,
+                                                      skip_decision=True)
+
+        sublayer_count += 1
+        if not self.residual_with_layer_dropout.drops_layer(sublayer_count, total_sublayers):
+            feedforward_norm_out = self.dropout(self.feedforward_norm_layer(output))
+            feedforward_out = self.dropout(self.feedforward(feedforward_norm_out))
+            output = self.residual_with_layer_dropout(output, feedforward_out, sublayer_count, total_sublayers,
+                                                      skip_decision=True)
+
+        return output
+
+    def forward_packed(self,
+                       packed_inputs: torch.Tensor,
+                       packed_indices: torch.LongTensor,
+                       mask: torch.Tensor) -> torch.Tensor:
+        """
+        The packed version of ``forward``: ``packed_inputs`` holds the ``(num_elements, input_dim)``
+        unmasked elements of the ``(batch_size, timesteps)`` ``mask``, gathered at
+        ``packed_indices`` by :func:`~reading_comprehension.utils.pack_padded`, and the output is
+        packed the same way.
+        """
+        batch_size, timesteps = mask.size()
+
+        if self._use_positional_encoding:
+            # Shape: (timesteps, input_dim)
+            positional_features = self._positional_encoding.get_features(timesteps, packed_inputs.size(-1),
+                                                                         packed_inputs.device)
+            output = packed_inputs + positional_features.index_select(0, packed_indices % timesteps)
+        else:
+            output = packed_inputs
+
+        total_sublayers = len(self._conv_layers) + 2
+        sublayer_count = 0
+
+        for conv_norm_layer, conv_layer in zip(self._conv_norm_layers, self._conv_layers):
             sublayer_count += 1
-            output = self.residual_with_layer_dropout(output, conv_out,
-                                                      sublayer_count, total_sublayers)
+            if self.residual_with_layer_dropout.drops_layer(sublayer_count, total_sublayers):
+                continue
+            conv_norm_out = self.dropout(conv_norm_layer(output))
+            # Only the depthwise convolution mixes neighbouring elements, so only it needs the padded layout.
+            padded_conv_norm_out = unpack_to_padded(conv_norm_out, packed_indices, batch_size, timesteps)
+            depthwise_out = conv_layer.depthwise_channel_last(padded_conv_norm_out)
+            conv_out = self.dropout(conv_layer.pointwise_channel_last(pack_padded(depthwise_out, packed_indices)))
+            output = self.residual_with_layer_dropout(output, conv_out, sublayer_count, total_sublayers,
+                                                      skip_decision=True)
 
-        attention_norm_out = self.dropout(self.attention_norm_layer(output))
-        attention_out = self.dropout(self.attention_layer(attention_norm_out, mask))
         sublayer_count += 1
-        output = self.residual_with_layer_dropout(output, attention_out,
-                                                  sublayer_count, total_sublayers)
+        if not self.residual_with_layer_dropout.drops_layer(sublayer_count, total_sublayers):
+            attention_norm_out = self.dropout(self.attention_norm_layer(output))
+            padded_attention_norm_out = unpack_to_padded(attention_norm_out, packed_indices, batch_size, timesteps)
+            padded_attention_out = self.attention_layer(padded_attention_norm_out, mask)
+            attention_out = self.dropout(pack_padded(padded_attention_out, packed_indices))
+            output = self.residual_with_layer_dropout(output, attention_out, sublayer_count, total_sublayers,
+                                                      skip_decision=True)
 
-        feedforward_norm_out = self.dropout(self.feedforward_norm_layer(output))
-        feedforward_out = self.dropout(self.feedforward(feedforward_norm_out))
         sublayer_count += 1
-        output = self.residual_with_layer_dropout(output, feedforward_out,
-                                                  sublayer_count, total_sublayers)
+        if not self.residual_with_layer_dropout.drops_layer(sublayer_count, total_sublayers):
+            feedforward_norm_out = self.dropout(self.feedforward_norm_layer(output))
+            feedforward_out = self.dropout(self.feedforward(feedforward_norm_out))
+            output = self.residual_with_layer_dropout(output, feedforward_out, sublayer_count, total_sublayers,
+                                                      skip_decision=True)
 
         return output
 
@@ -180,7 +264,8 @@ class QaNetEncoder(Seq2SeqEncoder):
         Whether to add sinusoidal frequencies to the input tensor. This is strongly recommended,
         as without this feature, the self attention layers have no idea of absolute or relative
         position (as they are just computing pairwise similarity between vectors of elements),
-        which can be important features for many tasks.
+        which can be important features for many tasks.  The sinusoids are sliced from a table
+        shared by all the blocks (see :class:`SinusoidalPositionalEncoding`).
     dropout_prob : ``float``, optional, (default = 0.1)
         The dropout probability for the feedforward network.
     layer_dropout_undecayed_prob : ``float``, optional, (default = 0.1)
@@ -189,6 +274,19 @@ class QaNetEncoder(Seq2SeqEncoder):
         stochastically dropped according to its layer dropout probability.
     attention_dropout_prob : ``float``, optional, (default = 0)
         The dropout probability for the attention distributions in the attention layer.
+    use_packed_sequences : ``bool``, optional, (default = False)
+        Whether to run the position-wise sublayers (layer norms, pointwise convolutions and
+        feedforward network) over the unpadded elements only, gathered into a flat tensor.  Only
+        the depthwise convolutions and the self attention then use the padded layout, with zeros
+        at the padding positions.  The default mode convolves over the (non-zero) padding
+        positions instead, so the outputs of the last ``conv_kernel_size // 2`` elements of the
+        shorter sequences of a batch differ slightly between the two modes.
+    layer_dropout_seed : ``int``, optional, (default = None)
+        If given, the layer dropout decisions of the ``i``-th block are drawn from a generator
+        seeded with ``layer_dropout_seed + i`` instead of the global torch random state.
+    positional_encoding_max_timesteps : ``int``, optional, (default = 512)
+        The number of positions of the positional encoding table we start with.  It grows on
+        demand for longer inputs.
     """
 
     def __init__(self,
@@ -203,7 +301,10 @@ class QaNetEncoder(Seq2SeqEncoder):
                  use_positional_encoding: bool = True,
                  dropout_prob: float = 0.1,
                  layer_dropout_undecayed_prob: float = 0.1,
-                 attention_dropout_prob: float = 0) -> None:
+                 attention_dropout_prob: float = 0,
+                 use_packed_sequences: bool = False,
+                 layer_dropout_seed: int = None,
+                 positional_encoding_max_timesteps: int = 512) -> None:
         super().__init__()
 
         self._input_projection_layer = None
@@ -225,10 +326,15 @@ class QaNetEncoder(Seq2SeqEncoder):
                                               use_positional_encoding,
                                               dropout_prob,
                                               layer_dropout_undecayed_prob,
-                                              attention_dropout_prob)
+                                              attention_dropout_prob,
+                                              use_packed_sequences,
+                                              None if layer_dropout_seed is None
+                                              else layer_dropout_seed + block_index,
+                                              positional_encoding_max_timesteps)
             self.add_module(f"encoder_block_{block_index}", encoder_block)
             self._encoder_blocks.append(encoder_block)
 
+        self._use_packed_sequences = use_packed_sequences
         self._input_dim = input_dim
         self._output_dim = hidden_dim
 
@@ -246,6 +352,15 @@ class QaNetEncoder(Seq2SeqEncoder):
 
     @overrides
     def forward(self, inputs: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:  # pylint: disable=arguments-differ
+        if self._use_packed_sequences and mask is not None:
+            # We pack once for the whole stack of blocks.
+            batch_size, timesteps = mask.size()
+            packed_indices = get_packed_indices(mask)
+            output = self._input_projection_layer(pack_padded(inputs, packed_indices))
+            for encoder_block in self._encoder_blocks:
+                output = encoder_block.forward_packed(output, packed_indices, mask)
+            return unpack_to_padded(output, packed_indices, batch_size, timesteps)
+
         inputs = self._input_projection_layer(inputs)
         output = inputs
         for encoder_block in self._encoder_blocks:
@@ -0,0 +1,166 @@
+from typing import Dict, List
+
+from overrides import overrides
+import torch
+
+from allennlp.common.util import JsonDict
+from allennlp.data import DatasetReader, Instance
+from allennlp.data.dataset import Batch
+from allennlp.data.fields import TextField
+from allennlp.models import Model
+from allennlp.nn import util
+from allennlp.predictors.predictor import Predictor
+from reading_comprehension.passage_encoding_cache import PassageEncodingCache
+from reading_comprehension.utils import bfloat16_autocast, get_n_best_spans
+
+
+@Predictor.register("qanet")
+class QaNetPredictor(Predictor):
+    """
+    Predictor for the :class:`~reading_comprehension.qanet.QaNet` model, which expects a
+    :class:`~reading_comprehension.squad_reader.SquadReader` as its dataset reader.
+
+    Unlike AllenNLP's ``machine-comprehension`` predictor, we cut the question and passage with
+    the evaluation length limits of the reader, so that predictions match what the model saw
+    during validation.  Note that an archive trained with the ``EMATrainer`` already contains the
+    exponential moving averages of the weights, so this predicts with the EMA weights.
+
+    When many questions are asked about the same passage, use :func:`predict_questions`: the
+    question-independent encoding of each passage is computed once and kept in an LRU cache of at
+    most ``passage_cache_memory_mb`` megabytes.
+
+    If ``use_bfloat16`` is set, the model runs under a CPU ``bfloat16`` autocast (see
+    :func:`~reading_comprehension.utils.bfloat16_autocast`).
+    """
+    def __init__(self,
+                 model: Model,
+                 dataset_reader: DatasetReader,
+                 passage_cache_memory_mb: float = 256,
+                 use_bfloat16: bool = False) -> None:
+        super().__init__(model, dataset_reader)
+        self.passage_cache = PassageEncodingCache(passage_cache_memory_mb)
+        self.use_bfloat16 = use_bfloat16
+
+    def predict(self, question: str, passage: str) -> JsonDict:
+        """
+        Make a machine comprehension prediction on the supplied input.
+
+        Parameters
+        ----------
+        question : ``str``
+            A question about the content in the supplied paragraph.
+        passage : ``str``
+            A paragraph of information relevant to the question.
+
+        Returns
+        -------
+        A dictionary that represents the prediction made by the system.  The answer string will
+        be under the "best_span_str" key.
+        """
+        return self.predict_json({"passage": passage, "question": question})
+
+    @overrides
+    def predict_instance(self, instance: Instance) -> JsonDict:
+        with bfloat16_autocast(self.use_bfloat16):
+            return super().predict_instance(instance)
+
+    @overrides
+    def predict_batch_instance(self, instances: List[Instance]) -> List[JsonDict]:
+        with bfloat16_autocast(self.use_bfloat16):
+            return super().predict_batch_instance(instances)
+
+    @overrides
+    def _json_to_instance(self, json_dict: JsonDict) -> Instance:
+        """
+        Expects JSON that looks like ``{"question": "...", "passage": "..."}``.
+        """
+        question_text = json_dict["question"]
+        passage_text = json_dict["passage"]
+        return self._dataset_reader.text_to_instance(
+                question_text,
+                passage_text,
+                max_passage_len=self._dataset_reader.passage_length_limit_for_eval,
+                max_question_len=self._dataset_reader.question_length_limit_for_eval)
+
+    def predict_instances(self,
+                          instances: List[Instance],
+                          n_best_size: int = 0,
+                          max_span_length: int = None) -> List[JsonDict]:
+        """
+        A light-weight version of ``predict_batch_instance`` for batch scoring: we only return the
+        best span string (and, if ``n_best_size > 0``, the ``n_best_size`` best spans with their
+        scores) for each instance, instead of sanitizing every output of the model, which
+        includes some ``(passage_length, question_length)`` attention matrices.
+        """
+        with bfloat16_autocast(self.use_bfloat16):
+            outputs = self._model.forward_on_instances(instances)
+        predictions = []
+        for instance, output in zip(instances, outputs):
+            prediction = {"best_span_str": output["best_span_str"]}
+            if n_best_size > 0:
+                metadata = instance.fields["metadata"].metadata
+                passage_text = metadata["original_passage"]
+                offsets = metadata["token_offsets"]
+                passage_length = len(offsets)
+                n_best_spans = get_n_best_spans(output["span_start_logits"][:passage_length],
+                                                output["span_end_logits"][:passage_length],
+                                                n_best_size,
+                                                max_span_length)
+                prediction["n_best"] = [{"text": passage_text[offsets[start][0]:offsets[end][1]],
+                                         "span": [start, end],
+                                         "score": score}
+                                        for start, end, score in n_best_spans]
+            predictions.append(prediction)
+        return predictions
+
+    def predict_questions(self, passage: str, questions: List[str]) -> List[JsonDict]:
+        """
+        Answers all the ``questions`` about ``passage``, encoding the passage only if it is not
+        already in the passage cache.  Only the question encoder, the context-query attention and
+        the modeling and output layers run for each question.
+
+        Returns one dictionary per question, with the answer under the "best_span_str" key.
+        """
+        # pylint: disable=protected-access
+        reader = self._dataset_reader
+        device = self._model._get_prediction_device()
+
+        cache_key = PassageEncodingCache.key(passage)
+        encoding = self.passage_cache.get(cache_key)
+        if encoding is None:
+            passage_tokens = reader._tokenizer.tokenize(passage)
+            if reader.passage_length_limit_for_eval is not None:
+                passage_tokens = passage_tokens[:reader.passage_length_limit_for_eval]
+            passage_field = TextField(passage_tokens, reader._token_indexers)
+            passage_tensors = util.move_to_device(self._tensorize([{"passage": passage_field}])["passage"],
+                                                  device)
+            with torch.no_grad(), bfloat16_autocast(self.use_bfloat16):
+                encoding = self._model.encode_passage(passage_tensors)
+            encoding["passage_tokens"] = passage_tokens
+            self.passage_cache.put(cache_key, encoding)
+
+        passage_tokens = encoding["passage_tokens"]
+        passage_offsets = [(token.idx, token.idx + len(token.text)) for token in passage_tokens]
+        question_fields = []
+        metadata = []
+        for question in questions:
+            question_tokens = reader._tokenizer.tokenize(question.strip().replace("\n", ""))
+            if reader.question_length_limit_for_eval is not None:
+                question_tokens = question_tokens[:reader.question_length_limit_for_eval]
+            question_fields.append({"question": TextField(question_tokens, reader._token_indexers)})
+            metadata.append({"original_passage": passage,
+                             "token_offsets": passage_offsets,
+                             "question_tokens": [token.text for token in question_tokens],
+                             "passage_tokens": [token.text for token in passage_tokens]})
+        question_tensors = util.move_to_device(self._tensorize(question_fields)["question"], device)
+        with torch.no_grad(), bfloat16_autocast(self.use_bfloat16):
+            output_dict = self._model.answer_questions(question_tensors,
+                                                       encoding["encoded_passage"],
+                                                       encoding["passage_mask"],
+                                                       metadata)
+        return [{"best_span_str": best_span_str} for best_span_str in output_dict["best_span_str"]]
+
+    def _tensorize(self, fields: List[Dict[str, TextField]]) -> Dict[str, Dict[str, torch.Tensor]]:
+        batch = Batch([Instance(instance_fields) for instance_fields in fields])
+        batch.index_instances(self._model.vocab)
+        return batch.as_tensor_dict()
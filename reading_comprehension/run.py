@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+The AllenNLP command line, plus the subcommands defined in this package::
+
+    $ python -m reading_comprehension.run train config.json -s /output --include-package reading_comprehension
+    $ python -m reading_comprehension.run predict-squad model.tar.gz questions.jsonl --output-file out.jsonl
+"""
+import logging
+import os
+import sys
+
+if os.environ.get("ALLENNLP_DEBUG"):
+    LEVEL = logging.DEBUG
+else:
+    LEVEL = logging.INFO
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, os.pardir))))
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                    level=LEVEL)
+
+# pylint: disable=wrong-import-position
+from allennlp.commands import main
+from allennlp.common.util import import_submodules
+from reading_comprehension.commands.cache_teacher_probabilities import CacheTeacherProbabilities
+from reading_comprehension.commands.convert_pretrained_vectors import ConvertPretrainedVectors
+from reading_comprehension.commands.predict_squad import PredictSquad
+from reading_comprehension.commands.prune_archive import PruneArchive
+from reading_comprehension.commands.serve_qanet import ServeQaNet
+from reading_comprehension.commands.train_distributed import TrainDistributed
+
+
+def run():
+    # Registers the models, modules, readers and trainers of this package, so that archives using
+    # them can be loaded without `--include-package reading_comprehension`.
+    import_submodules("reading_comprehension")
+    main(prog="python -m reading_comprehension.run",
+         subcommand_overrides={"cache-teacher-probabilities": CacheTeacherProbabilities(),
+                               "convert-pretrained-vectors": ConvertPretrainedVectors(),
+                               "predict-squad": PredictSquad(),
+                               "prune-archive": PruneArchive(),
+                               "serve-qanet": ServeQaNet(),
+                               "train-distributed": TrainDistributed()})
+
+
+if __name__ == "__main__":
+    run()
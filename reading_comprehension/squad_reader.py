@@ -1,15 +1,22 @@
 import json
 import logging
-from typing import Dict, List, Tuple, Optional, Iterable
+import os
+import random
+from typing import Any, Dict, List, Tuple, Optional, Iterable, Iterator
 
 from overrides import overrides
+import numpy
+import torch
 
+from allennlp.common.checks import ConfigurationError
 from allennlp.common.file_utils import cached_path
 from allennlp.data.dataset_readers.dataset_reader import DatasetReader
 from allennlp.data.instance import Instance
 from allennlp.data.dataset_readers.reading_comprehension import util
+from allennlp.data.fields import ArrayField
 from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenIndexer
 from allennlp.data.tokenizers import Token, Tokenizer, WordTokenizer
+from reading_comprehension.utils import char_spans_to_token_spans
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -43,6 +50,37 @@ class SquadReader(DatasetReader):
         if specified, we will use this limit instead of the ``passage_length_limit`` during evaluation.
     question_length_limit_for_evaluation : ``int``, optional (default=None)
         if specified, we will use this limit instead of the ``question_length_limit`` during evaluation.
+    shard_training_data : ``bool``, optional (default=False)
+        if true and a ``torch.distributed`` process group is initialized, each process only reads
+        the training questions whose index modulo the world size is its rank.  Evaluation files
+        are always read in full.
+    cut_passages_for_evaluation : ``bool``, optional (default=True)
+        if false, passages are not cut during evaluation, whatever ``passage_length_limit`` and
+        ``passage_length_limit_for_evaluation``: use this with a model which reads long passages
+        through sliding windows (see the ``window_size`` of ``QaNet``), so that the answers beyond
+        the length limit can still be found.
+    length_index_batch_size : ``int``, optional (default=None)
+        if specified, the training instances are read in batches of this many instances of similar
+        passage and question lengths, formed over the whole training file from a sidecar index of
+        the lengths of its instances (built on the first read), the batches being in a random order.
+        The metadata of each instance holds the number of its batch, as ``length_index_batch``,
+        from which a ``length_index`` iterator (see
+        :class:`~reading_comprehension.length_index_iterator.LengthIndexIterator`) makes the same
+        batches.  With a ``lazy`` reader, only the instances of one batch are built at a time, and
+        the batches are almost as tightly padded as the ones of a ``bucket`` iterator over the whole
+        dataset.  Note that the parsed json of the whole training file stays in memory during the
+        epoch, to build the instances of each batch: it is the memory of the instances, not of the
+        dataset, that is bounded by a batch.
+    length_index_padding_noise : ``float``, optional (default=0.1)
+        the relative noise added to the passage lengths before sorting them, as with the
+        ``padding_noise`` of the ``bucket`` iterator, so that the batches change at every epoch.
+    teacher_probabilities_file : ``str``, optional (default=None)
+        if specified, the training instances get the span start and end probabilities of a
+        teacher model, saved to this file by the ``cache-teacher-probabilities`` command, as
+        ``span_start_teacher_probs`` and ``span_end_teacher_probs`` fields, which a ``qanet``
+        model distills (see its ``distillation_weight``).  The teacher must have read the
+        passages with the same tokenizer; its probabilities are cut or padded with zeros to the
+        passage lengths of this reader.
     """
     def __init__(self,
                  tokenizer: Tokenizer = None,
@@ -51,14 +89,27 @@ class SquadReader(DatasetReader):
                  passage_length_limit: int = None,
                  question_length_limit: int = None,
                  passage_length_limit_for_evaluation: int = None,
-                 question_length_limit_for_evaluation: int = None) -> None:
+                 question_length_limit_for_evaluation: int = None,
+                 shard_training_data: bool = False,
+                 cut_passages_for_evaluation: bool = True,
+                 length_index_batch_size: int = None,
+                 length_index_padding_noise: float = 0.1,
+                 teacher_probabilities_file: str = None) -> None:
         super().__init__(lazy)
         self._tokenizer = tokenizer or WordTokenizer()
         self._token_indexers = token_indexers or {'tokens': SingleIdTokenIndexer()}
         self.passage_length_limit = passage_length_limit
         self.question_length_limit = question_length_limit
         self.passage_length_limit_for_eval = passage_length_limit_for_evaluation or passage_length_limit
+        if not cut_passages_for_evaluation:
+            self.passage_length_limit_for_eval = None
         self.question_length_limit_for_eval = question_length_limit_for_evaluation or question_length_limit
+        self.shard_training_data = shard_training_data
+        self.length_index_batch_size = length_index_batch_size
+        self.length_index_padding_noise = length_index_padding_noise
+        self.teacher_probabilities_file = teacher_probabilities_file
+        # Loaded on the first read of a training file.
+        self._teacher_probabilities: Dict[str, Tuple[numpy.ndarray, numpy.ndarray]] = None
 
     @overrides
     def _read(self, file_path: str) -> Iterable[Instance]:
@@ -67,6 +118,10 @@ class SquadReader(DatasetReader):
         we first determine whether the file read is for training or evaluation,
         then we will cut the passage according to different length limits and decide
         whether to keep the invalid examples or not.
+
+        Each paragraph is tokenized once, and the answers of all its questions are aligned to its
+        tokens at once (see :func:`char_spans_to_token_spans`).  If ``length_index_batch_size`` is
+        given, the training instances are read in length sorted batches instead of in order.
         """
         # if `file_path` is a URL, redirect to the cache
         is_train = 'train' in str(file_path)
@@ -76,38 +131,198 @@ class SquadReader(DatasetReader):
         with open(file_path) as dataset_file:
             dataset_json = json.load(dataset_file)
             dataset = dataset_json['data']
+        rank, world_size = 0, 1
+        if is_train and self.shard_training_data and torch.distributed.is_available() \
+                and torch.distributed.is_initialized():
+            rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+            logger.info("Reading the training questions of shard %d out of %d", rank, world_size)
+        if is_train:
+            max_passage_len = self.passage_length_limit
+            max_question_len = self.question_length_limit
+        else:
+            max_passage_len = self.passage_length_limit_for_eval
+            max_question_len = self.question_length_limit_for_eval
+        teacher_probabilities = None
+        if is_train and self.teacher_probabilities_file is not None:
+            if self._teacher_probabilities is None:
+                logger.info("Loading the teacher probabilities at %s", self.teacher_probabilities_file)
+                self._teacher_probabilities = load_teacher_probabilities(self.teacher_probabilities_file)
+            teacher_probabilities = self._teacher_probabilities
+        if is_train and self.length_index_batch_size is not None:
+            yield from self._read_length_sorted_batches(file_path, dataset, rank, world_size,
+                                                        teacher_probabilities)
+            return
+        question_index = -1
         logger.info("Reading the dataset")
         for article in dataset:
             for paragraph_json in article['paragraphs']:
-                paragraph = paragraph_json["context"]
-                tokenized_paragraph = self._tokenizer.tokenize(paragraph)
-
+                question_answers = []
                 for question_answer in paragraph_json['qas']:
-                    question_text = question_answer["question"].strip().replace("\n", "")
-                    answer_texts = [answer['text'] for answer in question_answer['answers']]
-                    span_starts = [answer['answer_start'] for answer in question_answer['answers']]
-                    span_ends = [start + len(answer) for start, answer in zip(span_starts, answer_texts)]
-                    if is_train:
-                        instance = self.text_to_instance(question_text,
-                                                         paragraph,
-                                                         zip(span_starts, span_ends),
-                                                         answer_texts,
-                                                         tokenized_paragraph,
-                                                         max_passage_len=self.passage_length_limit,
-                                                         max_question_len=self.question_length_limit,
-                                                         drop_invalid=True)
-                    else:
-                        instance = self.text_to_instance(question_text,
-                                                         paragraph,
-                                                         zip(span_starts, span_ends),
-                                                         answer_texts,
-                                                         tokenized_paragraph,
-                                                         max_passage_len=self.passage_length_limit_for_eval,
-                                                         max_question_len=self.question_length_limit_for_eval,
-                                                         drop_invalid=False)
+                    question_index += 1
+                    if question_index % world_size == rank:
+                        question_answers.append(question_answer)
+                for instance in self._read_paragraph(paragraph_json["context"], question_answers,
+                                                     max_passage_len, max_question_len, drop_invalid=is_train,
+                                                     teacher_probabilities=teacher_probabilities):
                     if instance is not None:
                         yield instance
 
+    def _read_paragraph(self,
+                        paragraph: str,
+                        question_answers: List[Dict[str, Any]],
+                        max_passage_len: Optional[int],
+                        max_question_len: Optional[int],
+                        drop_invalid: bool,
+                        teacher_probabilities: Dict[str, Tuple[numpy.ndarray, numpy.ndarray]] = None
+                       ) -> Iterator[Optional[Instance]]:
+        """
+        Yields the instance of each of the ``question_answers`` of ``paragraph``, or ``None`` if it
+        is dropped as invalid.  The paragraph is tokenized once, and the answers of all the
+        questions are aligned to its tokens at once.  The instances get the span probabilities of
+        their question in ``teacher_probabilities``, if given.
+        """
+        if not question_answers:
+            return
+        passage_tokens = self._tokenizer.tokenize(paragraph)
+        if max_passage_len is not None:
+            passage_tokens = passage_tokens[: max_passage_len]
+        passage_offsets = self._get_token_offsets(passage_tokens)
+        question_texts = [question_answer["question"].strip().replace("\n", "")
+                          for question_answer in question_answers]
+        char_spans = [(answer['answer_start'], answer['answer_start'] + len(answer['text']))
+                      for question_answer in question_answers for answer in question_answer['answers']]
+        span_question_texts = [question_text
+                               for question_text, question_answer in zip(question_texts, question_answers)
+                               for _ in question_answer['answers']]
+        token_spans = self._align_char_spans(paragraph, passage_tokens, passage_offsets,
+                                             char_spans, span_question_texts)
+
+        num_previous_answers = 0
+        for question_text, question_answer in zip(question_texts, question_answers):
+            num_answers = len(question_answer['answers'])
+            answer_texts = [answer['text'] for answer in question_answer['answers']]
+            instance = self.text_to_instance(
+                    question_text,
+                    paragraph,
+                    answer_texts=answer_texts,
+                    passage_tokens=passage_tokens,
+                    max_passage_len=max_passage_len,
+                    max_question_len=max_question_len,
+                    drop_invalid=drop_invalid,
+                    token_spans=token_spans[num_previous_answers:num_previous_answers + num_answers])
+            num_previous_answers += num_answers
+            if instance is not None and teacher_probabilities is not None:
+                self._add_teacher_probabilities(instance, question_answer['id'], teacher_probabilities)
+            yield instance
+
+    def _add_teacher_probabilities(self,
+                                   instance: Instance,
+                                   question_id: str,
+                                   teacher_probabilities: Dict[str, Tuple[numpy.ndarray, numpy.ndarray]]) -> None:
+        if question_id not in teacher_probabilities:
+            raise ConfigurationError(f"The teacher probabilities at {self.teacher_probabilities_file} "
+                                     f"have no entry for the question {question_id}.")
+        passage_length = instance.fields["passage"].sequence_length()
+        for field_name, probs in zip(["span_start_teacher_probs", "span_end_teacher_probs"],
+                                     teacher_probabilities[question_id]):
+            probs = probs[:passage_length].astype(numpy.float32)
+            probs = numpy.pad(probs, (0, passage_length - len(probs)), mode='constant')
+            instance.add_field(field_name, ArrayField(probs))
+
+    def _read_length_sorted_batches(self,
+                                    file_path: str,
+                                    dataset: List[Dict[str, Any]],
+                                    rank: int,
+                                    world_size: int,
+                                    teacher_probabilities: Dict[str, Tuple[numpy.ndarray, numpy.ndarray]] = None
+                                   ) -> Iterator[Instance]:
+        """
+        Yields the training instances of ``dataset`` in batches of ``length_index_batch_size``
+        instances of similar lengths, the batches being in a random order, except for the last,
+        smaller one, which always comes last.  The batches are formed over the whole file from its
+        length index (see :meth:`_get_length_index`), and only the instances of the current batch
+        are built.  The metadata of each instance holds the number of its batch, as
+        ``length_index_batch``.
+        """
+        length_index = self._get_length_index(file_path, dataset)
+        length_index = length_index[length_index[:, 0] % world_size == rank]
+        paragraphs = [paragraph_json for article in dataset for paragraph_json in article['paragraphs']]
+        questions = [(paragraph_index, question_answer)
+                     for paragraph_index, paragraph_json in enumerate(paragraphs)
+                     for question_answer in paragraph_json['qas']]
+        logger.info("Reading %d training instances in length sorted batches", len(length_index))
+        for batch_number, batch in enumerate(self._get_length_sorted_batches(length_index)):
+            # The questions of the batch which share a paragraph share its tokenization.
+            paragraph_questions: Dict[int, List[Dict[str, Any]]] = {}
+            for question_index in batch:
+                paragraph_index, question_answer = questions[question_index]
+                paragraph_questions.setdefault(paragraph_index, []).append(question_answer)
+            for paragraph_index, question_answers in paragraph_questions.items():
+                for instance in self._read_paragraph(paragraphs[paragraph_index]["context"], question_answers,
+                                                     self.passage_length_limit, self.question_length_limit,
+                                                     drop_invalid=True,
+                                                     teacher_probabilities=teacher_probabilities):
+                    if instance is not None:
+                        instance.fields["metadata"].metadata["length_index_batch"] = batch_number
+                        yield instance
+
+    def _get_length_sorted_batches(self, length_index: numpy.ndarray) -> List[numpy.ndarray]:
+        """
+        Sorts the instances of ``length_index`` by their passage lengths, with a relative noise of
+        up to ``length_index_padding_noise``, then by their question lengths, and returns the
+        question indices of each batch of ``length_index_batch_size`` consecutive instances, in a
+        random order but for the last, smaller batch.
+        """
+        passage_lengths = length_index[:, 1].astype(numpy.float64)
+        noise = numpy.random.uniform(-self.length_index_padding_noise, self.length_index_padding_noise,
+                                     len(passage_lengths))
+        # `lexsort` sorts by its last key first.
+        order = numpy.lexsort((length_index[:, 2], passage_lengths * (1 + noise)))
+        batches = [order[start:start + self.length_index_batch_size]
+                   for start in range(0, len(order), self.length_index_batch_size)]
+        last_batch = []
+        if batches and len(batches[-1]) < self.length_index_batch_size:
+            last_batch.append(batches.pop())
+        random.shuffle(batches)
+        return [length_index[batch, 0] for batch in batches + last_batch]
+
+    def _get_length_index(self, file_path: str, dataset: List[Dict[str, Any]]) -> numpy.ndarray:
+        """
+        Returns the ``(num_instances, 3)`` length index of the training instances of ``dataset``:
+        for each instance, the index of its question in the file, and its numbers of passage and
+        question tokens.  The index is built by reading the whole file once, and saved in a
+        ``.length_index.npz`` sidecar next to ``file_path``, from which it is loaded as long as the
+        file and the length limits did not change.  Changing the tokenizer needs deleting it.
+        """
+        index_path = file_path + ".length_index.npz"
+        length_limits = numpy.array([-1 if limit is None else limit
+                                     for limit in (self.passage_length_limit, self.question_length_limit)])
+        if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(file_path):
+            with numpy.load(index_path) as sidecar:
+                if numpy.array_equal(sidecar["length_limits"], length_limits):
+                    logger.info("Loading the length index at %s", index_path)
+                    return sidecar["length_index"]
+
+        logger.info("Building the length index of %s", file_path)
+        rows = []
+        question_index = 0
+        for article in dataset:
+            for paragraph_json in article['paragraphs']:
+                for instance in self._read_paragraph(paragraph_json["context"], paragraph_json['qas'],
+                                                     self.passage_length_limit, self.question_length_limit,
+                                                     drop_invalid=True):
+                    if instance is not None:
+                        rows.append((question_index,
+                                     instance.fields["passage"].sequence_length(),
+                                     instance.fields["question"].sequence_length()))
+                    question_index += 1
+        length_index = numpy.array(rows, dtype=numpy.int32).reshape(-1, 3)
+        # Several processes may build the index at once: each one atomically replaces the sidecar.
+        temporary_path = f"{index_path}.{os.getpid()}.tmp.npz"
+        numpy.savez(temporary_path, length_index=length_index, length_limits=length_limits)
+        os.replace(temporary_path, index_path)
+        return length_index
+
     @overrides
     def text_to_instance(self,  # type: ignore
                          question_text: str,
@@ -117,10 +332,13 @@ class SquadReader(DatasetReader):
                          passage_tokens: List[Token] = None,
                          max_passage_len: int = None,
                          max_question_len: int = None,
-                         drop_invalid: bool = False) -> Optional[Instance]:
+                         drop_invalid: bool = False,
+                         token_spans: List[Optional[Tuple[int, int]]] = None) -> Optional[Instance]:
         """
         We cut the passage and question according to `max_passage_len` and `max_question_len` here.
-        We will drop the invalid examples if `drop_invalid` equals to true.
+        We will drop the invalid examples if `drop_invalid` equals to true.  The `token_spans` of
+        the answers in the (cut) passage tokens, with `None` for the answers beyond the cut, can be
+        given instead of their `char_spans`, if they were already aligned by the caller.
         """
         # pylint: disable=arguments-differ
         if not passage_tokens:
@@ -130,25 +348,16 @@ class SquadReader(DatasetReader):
             passage_tokens = passage_tokens[: max_passage_len]
         if max_question_len is not None:
             question_tokens = question_tokens[: max_question_len]
-        char_spans = char_spans or []
-        # We need to convert character indices in `passage_text` to token indices in
-        # `passage_tokens`, as the latter is what we'll actually use for supervision.
-        token_spans: List[Tuple[int, int]] = []
-        passage_offsets = [(token.idx, token.idx + len(token.text)) for token in passage_tokens]
-        for char_span_start, char_span_end in char_spans:
-            if char_span_end > passage_offsets[-1][1]:
-                continue
-            (span_start, span_end), error = util.char_span_to_token_span(passage_offsets,
-                                                                         (char_span_start, char_span_end))
-            if error:
-                logger.debug("Passage: %s", passage_text)
-                logger.debug("Passage tokens: %s", passage_tokens)
-                logger.debug("Question text: %s", question_text)
-                logger.debug("Answer span: (%d, %d)", char_span_start, char_span_end)
-                logger.debug("Token span: (%d, %d)", span_start, span_end)
-                logger.debug("Tokens in answer: %s", passage_tokens[span_start:span_end + 1])
-                logger.debug("Answer: %s", passage_text[char_span_start:char_span_end])
-            token_spans.append((span_start, span_end))
+        if token_spans is None:
+            # We need to convert character indices in `passage_text` to token indices in
+            # `passage_tokens`, as the latter is what we'll actually use for supervision.
+            char_spans = list(char_spans or [])
+            token_spans = self._align_char_spans(passage_text,
+                                                 passage_tokens,
+                                                 self._get_token_offsets(passage_tokens),
+                                                 char_spans,
+                                                 [question_text] * len(char_spans))
+        token_spans = [token_span for token_span in token_spans if token_span is not None]
         if not token_spans:
             if drop_invalid:
                 return None
@@ -160,3 +369,84 @@ class SquadReader(DatasetReader):
                                                         passage_text,
                                                         token_spans,
                                                         answer_texts)
+
+    @staticmethod
+    def _get_token_offsets(passage_tokens: List[Token]) -> numpy.ndarray:
+        """
+        The ``(num_tokens, 2)`` character offsets of the tokens, with exclusive ends.
+        """
+        return numpy.array([(token.idx, token.idx + len(token.text)) for token in passage_tokens],
+                           dtype=numpy.int64).reshape(-1, 2)
+
+    @staticmethod
+    def _align_char_spans(passage_text: str,
+                          passage_tokens: List[Token],
+                          passage_offsets: numpy.ndarray,
+                          char_spans: List[Tuple[int, int]],
+                          question_texts: List[str]) -> List[Optional[Tuple[int, int]]]:
+        """
+        Converts the character spans of answers in `passage_text` to token spans in
+        `passage_tokens`, all at once, with `None` for the answers ending after the last token.
+        This logs the same debug messages as aligning each span with `util.char_span_to_token_span`.
+        """
+        if not char_spans:
+            return []
+        char_span_array = numpy.array(char_spans, dtype=numpy.int64).reshape(-1, 2)
+        in_passage = char_span_array[:, 1] <= passage_offsets[-1, 1]
+        token_span_array, errors = char_spans_to_token_spans(passage_offsets, char_span_array)
+        token_spans: List[Optional[Tuple[int, int]]] = []
+        for index, (char_span_start, char_span_end) in enumerate(char_spans):
+            if not in_passage[index]:
+                token_spans.append(None)
+                continue
+            span_start, span_end = int(token_span_array[index, 0]), int(token_span_array[index, 1])
+            if logger.isEnabledFor(logging.DEBUG):
+                if passage_offsets[span_start, 0] < char_span_start:
+                    logger.debug("Bad labelling or tokenization - start offset doesn't match")
+                if span_end == span_start and passage_offsets[span_end, 1] > char_span_end:
+                    logger.debug("Bad tokenization - end offset doesn't match")
+                elif passage_offsets[span_end, 1] > char_span_end:
+                    logger.debug("Bad labelling or tokenization - end offset doesn't match")
+                if errors[index]:
+                    logger.debug("Passage: %s", passage_text)
+                    logger.debug("Passage tokens: %s", passage_tokens)
+                    logger.debug("Question text: %s", question_texts[index])
+                    logger.debug("Answer span: (%d, %d)", char_span_start, char_span_end)
+                    logger.debug("Token span: (%d, %d)", span_start, span_end)
+                    logger.debug("Tokens in answer: %s", passage_tokens[span_start:span_end + 1])
+                    logger.debug("Answer: %s", passage_text[char_span_start:char_span_end])
+            token_spans.append((span_start, span_end))
+        return token_spans
+
+
+def save_teacher_probabilities(output_path: str,
+                               teacher_probabilities: Dict[str, Tuple[numpy.ndarray, numpy.ndarray]]) -> None:
+    """
+    Saves the span start and end probabilities of a teacher model, by question id, in a compact
+    ``.npz`` file: the float16 probabilities of all the questions, concatenated, and the offsets of
+    each question's.
+    """
+    question_ids = list(teacher_probabilities.keys())
+    lengths = [len(teacher_probabilities[question_id][0]) for question_id in question_ids]
+    offsets = numpy.concatenate([[0], numpy.cumsum(lengths, dtype=numpy.int64)])
+    span_start_probs, span_end_probs = [
+            numpy.concatenate([teacher_probabilities[question_id][head] for question_id in question_ids]
+                              or [numpy.zeros(0)]).astype(numpy.float16)
+            for head in range(2)]
+    with open(output_path, "wb") as output_file:
+        numpy.savez(output_file,
+                    question_ids=numpy.array(question_ids, dtype=str),
+                    offsets=offsets,
+                    span_start_probs=span_start_probs,
+                    span_end_probs=span_end_probs)
+
+
+def load_teacher_probabilities(file_path: str) -> Dict[str, Tuple[numpy.ndarray, numpy.ndarray]]:
+    """
+    Loads the span start and end probabilities saved by :func:`save_teacher_probabilities`.
+    """
+    with numpy.load(cached_path(file_path)) as saved:
+        question_ids, offsets = saved["question_ids"], saved["offsets"]
+        span_start_probs, span_end_probs = saved["span_start_probs"], saved["span_end_probs"]
+    return {str(question_id): (span_start_probs[start:end], span_end_probs[start:end])
+            for question_id, start, end in zip(question_ids, offsets[:-1], offsets[1:])}
@@ -1,5 +1,35 @@
+import contextlib
+from typing import ContextManager, List, Tuple
+
+import numpy
 import torch
 
+from allennlp.common.checks import ConfigurationError
+
+
+def get_mask_value(dtype: torch.dtype, mask_value: float = -1e7) -> float:
+    """
+    Returns ``mask_value``, or, if adding it to the logits of a reduced precision ``dtype`` could
+    overflow (e.g. ``-1e7`` in ``float16``, whose lowest value is ``-65504``), half the lowest
+    value of ``dtype``, which is still low enough to zero out a softmax.
+    """
+    if dtype in (torch.float32, torch.float64) or not dtype.is_floating_point:
+        return mask_value
+    return max(mask_value, torch.finfo(dtype).min / 2)
+
+
+def bfloat16_autocast(enabled: bool = True) -> ContextManager:
+    """
+    A context in which the CPU operations that benefit from it (matrix multiplications and
+    convolutions) run in ``bfloat16``, while the parameters, and the operations that need the
+    precision, stay in ``float32``.  It does nothing if ``enabled`` is ``False``.
+    """
+    if not enabled:
+        return contextlib.suppress()
+    if not hasattr(torch, "autocast"):
+        raise ConfigurationError(f"bfloat16 mixed precision needs torch >= 1.10, not {torch.__version__}.")
+    return torch.autocast("cpu", dtype=torch.bfloat16)
+
 
 def memory_effient_masked_softmax(vector: torch.Tensor, mask: torch.Tensor,
                                   dim: int = -1, mask_value=-1e7) -> torch.Tensor:
@@ -8,6 +38,7 @@ def memory_effient_masked_softmax(vector: torch.Tensor, mask: torch.Tensor,
     By using less operations here than the original `masked_softmax`, we save a lot of memory.
     But you should be careful that this function does not return an array of ``0.0``, as the
     original `mask_softmax` does, in the case that the input vector is completely masked.
+    The ``mask_value`` is capped by :func:`get_mask_value` for reduced precision vectors.
     """
     if mask is None:
         result = torch.nn.functional.softmax(vector, dim=dim)
@@ -16,5 +47,124 @@ def memory_effient_masked_softmax(vector: torch.Tensor, mask: torch.Tensor,
         while mask.dim() < vector.dim():
             mask = mask.unsqueeze(1)
         # To limit numerical errors from large vector elements outside the mask, we zero these out.
+        mask_value = get_mask_value(vector.dtype, mask_value)
         result = torch.nn.functional.softmax(vector + (1 - mask) * mask_value, dim=dim)
     return result
+
+
+def masked_span_scores(logits: torch.Tensor,
+                       mask: torch.Tensor,
+                       mask_value: float = -1e7) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Returns the masked logits, probabilities and log probabilities of the ``(batch_size, length)``
+    span start or end ``logits``, i.e. what ``allennlp.nn.util.replace_masked_values``,
+    :func:`memory_effient_masked_softmax` and ``allennlp.nn.util.masked_log_softmax`` compute, but
+    from a single masking of the logits and a single ``log_softmax``, whose exponential gives the
+    probabilities.  The log probabilities of the masked positions are about ``mask_value``
+    instead of ``log(1e-45)`` below their logit; the ones of the unmasked positions are the same.
+    """
+    mask_value = get_mask_value(logits.dtype, mask_value)
+    masked_logits = logits.masked_fill(mask == 0, mask_value)
+    log_probs = torch.nn.functional.log_softmax(masked_logits, dim=-1)
+    return masked_logits, log_probs.exp(), log_probs
+
+
+def kl_divergence(target_probs: torch.Tensor, log_probs: torch.Tensor) -> torch.Tensor:
+    """
+    The mean over the batch of ``KL(target || model)`` between the ``(batch_size, length)`` target
+    distributions ``target_probs`` (e.g. the span start probabilities of a teacher model) and the
+    ``log_probs`` of the model.  The positions where the target is zero, e.g. the padding, where
+    the log probabilities are about the mask value, count for nothing.
+    """
+    target_probs = target_probs.float()
+    divergence = target_probs * (target_probs.clamp(min=1e-20).log() - log_probs.float())
+    return divergence.sum(-1).mean()
+
+
+def get_n_best_spans(span_start_logits: numpy.ndarray,
+                     span_end_logits: numpy.ndarray,
+                     n_best_size: int,
+                     max_span_length: int = None) -> List[Tuple[int, int, float]]:
+    """
+    Returns the ``n_best_size`` highest scoring ``(start, end, score)`` spans with ``start <= end``,
+    best first, where the score of a span is the sum of its start and end logits.  This is the
+    n-best version of `BidirectionalAttentionFlow.get_best_span`, for a single passage.  If
+    ``max_span_length`` is given, longer spans are never returned.
+    """
+    passage_length = span_start_logits.shape[0]
+    span_scores = span_start_logits[:, numpy.newaxis] + span_end_logits[numpy.newaxis, :]
+    valid_spans = numpy.triu(numpy.ones((passage_length, passage_length), dtype=bool))
+    if max_span_length is not None:
+        valid_spans &= numpy.tril(valid_spans, max_span_length - 1)
+    span_scores = numpy.where(valid_spans, span_scores, -numpy.inf).ravel()
+    num_spans = min(n_best_size, int(valid_spans.sum()))
+    if num_spans <= 0:
+        return []
+    best_spans = numpy.argpartition(-span_scores, num_spans - 1)[:num_spans]
+    best_spans = best_spans[numpy.argsort(-span_scores[best_spans], kind="mergesort")]
+    return [(int(index // passage_length), int(index % passage_length), float(span_scores[index]))
+            for index in best_spans]
+
+
+def get_packed_indices(mask: torch.Tensor) -> torch.LongTensor:
+    """
+    Returns the positions of the unmasked elements of a ``(batch_size, timesteps)`` mask in the
+    flattened ``(batch_size * timesteps)`` layout, in order.  These are the rows that
+    :func:`pack_padded` keeps.
+    """
+    return mask.contiguous().view(-1).nonzero().squeeze(-1)
+
+
+def pack_padded(tensor: torch.Tensor, packed_indices: torch.LongTensor) -> torch.Tensor:
+    """
+    Gathers the ``(batch_size, timesteps, dim)`` rows at ``packed_indices`` (see
+    :func:`get_packed_indices`) into a ``(num_elements, dim)`` tensor without any padding.
+    """
+    return tensor.contiguous().view(-1, tensor.size(-1)).index_select(0, packed_indices)
+
+
+def unpack_to_padded(packed: torch.Tensor,
+                     packed_indices: torch.LongTensor,
+                     batch_size: int,
+                     timesteps: int) -> torch.Tensor:
+    """
+    The inverse of :func:`pack_padded`: scatters the ``(num_elements, dim)`` rows of ``packed`` back
+    to a ``(batch_size, timesteps, dim)`` tensor whose padding positions are zeros.
+    """
+    padded = packed.new_zeros(batch_size * timesteps, packed.size(-1))
+    return padded.index_copy(0, packed_indices, packed).view(batch_size, timesteps, -1)
+
+
+def char_spans_to_token_spans(token_offsets: numpy.ndarray,
+                              char_spans: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    A vectorized ``char_span_to_token_span`` of
+    ``allennlp.data.dataset_readers.reading_comprehension.util``: maps all the ``(num_spans, 2)``
+    character spans ``char_spans`` (with exclusive ends) to inclusive token spans at once, with two
+    binary searches over the sorted ``(num_tokens, 2)`` character ``token_offsets``, instead of a
+    linear scan over the tokens for each span.
+
+    Returns the ``(num_spans, 2)`` token spans, and whether each character span does not start
+    and end exactly on token boundaries, which are the same as the ones of
+    ``char_span_to_token_span`` for all the spans ending within the last token.  The spans starting
+    inside the last token (for which ``char_span_to_token_span`` fails) are mapped to that token.
+    """
+    token_starts = token_offsets[:, 0]
+    token_ends = token_offsets[:, 1]
+    num_tokens = len(token_offsets)
+    char_starts = char_spans[:, 0]
+    char_ends = char_spans[:, 1]
+
+    # The first token starting at or after the span start...
+    start_indices = numpy.searchsorted(token_starts, char_starts, side='left')
+    # ... or the previous one, if the span starts inside a token.  As with ``char_span_to_token_span``,
+    # a span starting before the first token gets a start index of -1, i.e. the last token.
+    start_overshoots = (start_indices == num_tokens) | \
+            (token_starts[numpy.minimum(start_indices, num_tokens - 1)] > char_starts)
+    start_indices = start_indices - start_overshoots
+    # The first token ending at or after the span end, but not before the start token.
+    end_indices = numpy.maximum(start_indices, numpy.searchsorted(token_ends, char_ends, side='left'))
+    end_indices = numpy.where(start_indices < 0, start_indices, numpy.minimum(end_indices, num_tokens - 1))
+
+    errors = (token_starts[start_indices] != char_starts) | (token_ends[end_indices] != char_ends)
+    return numpy.stack([start_indices, end_indices], axis=-1), errors
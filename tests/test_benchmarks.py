@@ -0,0 +1,32 @@
+import json
+import os
+import tempfile
+
+from benchmarks.common import compare_with_baseline, synthesize_squad_file
+
+
+def test_compare_with_baseline_flags_only_regressions_beyond_threshold():
+    baseline = {"train_step_seconds_p400_b16": 1.0,
+                "reader_instances_per_second_p400": 100.0,
+                "peak_memory_mb_p400": 500.0}
+    results = {"train_step_seconds_p400_b16": 1.05,
+               "reader_instances_per_second_p400": 80.0,
+               "peak_memory_mb_p400": 400.0,
+               "inference_seconds_p400_b1": 3.0}
+    regressions = compare_with_baseline(results, baseline, threshold=0.1)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("reader_instances_per_second_p400")
+
+
+def test_synthesize_squad_file_keeps_answer_offsets_valid():
+    output_path = os.path.join(tempfile.mkdtemp(), "synthetic_dev.json")
+    synthesize_squad_file(output_path, passage_length=400, num_questions=7)
+    with open(output_path) as dataset_file:
+        paragraphs = json.load(dataset_file)["data"][0]["paragraphs"]
+    assert sum(len(paragraph["qas"]) for paragraph in paragraphs) == 7
+    for paragraph in paragraphs:
+        assert len(paragraph["context"].split()) >= 400
+        for question_answer in paragraph["qas"]:
+            for answer in question_answer["answers"]:
+                start = answer["answer_start"]
+                assert paragraph["context"][start:start + len(answer["text"])] == answer["text"]
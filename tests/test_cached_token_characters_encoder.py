@@ -0,0 +1,65 @@
+# pylint: disable=no-self-use,invalid-name,protected-access
+import torch
+from numpy.testing import assert_almost_equal
+
+from allennlp.common import Params
+from allennlp.common.testing import AllenNlpTestCase
+from allennlp.data import Vocabulary
+from allennlp.modules.token_embedders import TokenCharactersEncoder
+from reading_comprehension.modules.cached_token_characters_encoder import CachedTokenCharactersEncoder
+
+
+class TestCachedTokenCharactersEncoder(AllenNlpTestCase):
+    def setUp(self):
+        super().setUp()
+        self.vocab = Vocabulary()
+        for character in "abcdefgh":
+            self.vocab.add_token_to_namespace(character, "token_characters")
+        params = {"embedding": {"embedding_dim": 3},
+                  "encoder": {"type": "cnn", "embedding_dim": 3, "num_filters": 4, "ngram_filter_sizes": [2]}}
+        self.encoder = TokenCharactersEncoder.from_params(self.vocab, Params(params))
+        self.cached_encoder = CachedTokenCharactersEncoder.from_params(self.vocab, Params(params))
+        self.cached_encoder.load_state_dict(self.encoder.state_dict())
+        self.encoder.eval()
+        self.cached_encoder.eval()
+        # Shape: (batch_size, num_tokens, num_characters), with repeated and padding tokens.
+        self.inputs = torch.LongTensor([[[2, 3, 4], [5, 6, 0], [2, 3, 4]],
+                                        [[5, 6, 0], [7, 0, 0], [0, 0, 0]]])
+
+    def test_forward_matches_uncached_encoder(self):
+        expected = self.encoder(self.inputs).detach().numpy()
+        assert_almost_equal(self.cached_encoder(self.inputs).detach().numpy(), expected)
+        # The second batch is only read from the cache.
+        assert len(self.cached_encoder._cache) == 4
+        assert_almost_equal(self.cached_encoder(self.inputs).detach().numpy(), expected)
+
+    def test_training_mode_clears_the_cache(self):
+        self.cached_encoder(self.inputs)
+        self.cached_encoder.train()
+        assert not self.cached_encoder._cache
+        self.cached_encoder(self.inputs)
+        assert not self.cached_encoder._cache
+
+    def test_saved_cache_is_only_loaded_with_the_same_weights(self):
+        cache_file = str(self.TEST_DIR / "characters_cache.th")
+        self.cached_encoder(self.inputs)
+        self.cached_encoder.save_cache(cache_file)
+
+        self.cached_encoder.clear_cache()
+        self.cached_encoder.load_cache(cache_file)
+        assert len(self.cached_encoder._cache) == 4
+
+        self.cached_encoder.clear_cache()
+        for parameter in self.cached_encoder.parameters():
+            parameter.data.add_(1.0)
+        self.cached_encoder.load_cache(cache_file)
+        assert not self.cached_encoder._cache
+
+    def test_training_gradients_match_uncached_encoder(self):
+        self.encoder.train()
+        self.cached_encoder.train()
+        self.encoder(self.inputs).pow(2).sum().backward()
+        self.cached_encoder(self.inputs).pow(2).sum().backward()
+        gradients = {name: parameter.grad for name, parameter in self.encoder.named_parameters()}
+        for name, parameter in self.cached_encoder.named_parameters():
+            assert_almost_equal(parameter.grad.numpy(), gradients[name].numpy(), decimal=5)
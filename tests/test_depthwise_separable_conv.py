@@ -0,0 +1,21 @@
+# pylint: disable=no-self-use,invalid-name
+import torch
+from numpy.testing import assert_almost_equal
+
+from allennlp.common.testing import AllenNlpTestCase
+from reading_comprehension.modules.depthwise_separable_conv import DepthwiseSeparableConv
+
+
+class TestDepthwiseSeparableConv(AllenNlpTestCase):
+    def test_forward_channel_last_matches_forward(self):
+        for kernel_size in [1, 4, 5, 7]:
+            conv = DepthwiseSeparableConv(6, 8, kernel_size, activation="relu", dim=1)
+            inputs = torch.randn(3, 9, 6, requires_grad=True)
+            expected = conv(inputs.transpose(1, 2)).transpose(1, 2)
+            output = conv.forward_channel_last(inputs)
+            assert_almost_equal(output.data.numpy(), expected.data.numpy(), decimal=5)
+
+            expected_gradients = torch.autograd.grad(expected.pow(2).sum(), [inputs] + list(conv.parameters()))
+            gradients = torch.autograd.grad(output.pow(2).sum(), [inputs] + list(conv.parameters()))
+            for gradient, expected_gradient in zip(gradients, expected_gradients):
+                assert_almost_equal(gradient.numpy(), expected_gradient.numpy(), decimal=4)
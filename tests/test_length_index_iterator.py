@@ -0,0 +1,53 @@
+# pylint: disable=no-self-use,invalid-name
+import math
+import os
+import shutil
+
+from allennlp.common.testing import AllenNlpTestCase
+from allennlp.data import Vocabulary
+from reading_comprehension.length_index_iterator import LengthIndexIterator
+from reading_comprehension.squad_reader import SquadReader
+
+
+class TestLengthIndexIterator(AllenNlpTestCase):
+    def setUp(self):
+        super().setUp()
+        fixture_path = os.path.join(os.path.dirname(__file__), os.pardir, "fixtures", "qanet", "squad.json")
+        # The reader only sorts by length in files read for training.
+        self.train_path = os.path.join(self.TEST_DIR, "squad_train.json")
+        shutil.copyfile(fixture_path, self.train_path)
+        self.validation_path = os.path.join(self.TEST_DIR, "squad_dev.json")
+        shutil.copyfile(fixture_path, self.validation_path)
+
+    def test_iterator_makes_the_batches_of_the_length_index(self):
+        for lazy in [True, False]:
+            reader = SquadReader(lazy=lazy, passage_length_limit=400, length_index_batch_size=2)
+            instances = reader.read(self.train_path)
+            iterator = LengthIndexIterator(batch_size=32)
+            iterator.index_with(Vocabulary.from_instances(instances))
+            batches = list(iterator(instances, num_epochs=1, shuffle=True))
+            num_instances = sum(1 for _ in instances)
+            assert num_instances > 2
+            # The batches are the ones of the reader, whatever the batch size of the iterator.
+            assert sorted(batch["passage"]["tokens"].size(0) for batch in batches) == \
+                    [num_instances % 2] * (num_instances % 2) + [2] * (num_instances // 2)
+            for batch in batches:
+                assert len({metadata["length_index_batch"] for metadata in batch["metadata"]}) == 1
+
+    def test_iterator_batches_the_other_instances_as_a_basic_iterator(self):
+        instances = SquadReader(length_index_batch_size=2).read(self.validation_path)
+        assert all("length_index_batch" not in instance.fields["metadata"].metadata for instance in instances)
+        iterator = LengthIndexIterator(batch_size=3)
+        iterator.index_with(Vocabulary.from_instances(instances))
+        batches = list(iterator(instances, num_epochs=1, shuffle=False))
+        assert [batch["passage"]["tokens"].size(0) for batch in batches] == [3, len(instances) - 3]
+
+    def test_get_num_batches_counts_the_batches_of_the_length_index(self):
+        reader = SquadReader(passage_length_limit=400, length_index_batch_size=2)
+        instances = reader.read(self.train_path) + SquadReader().read(self.validation_path)
+        iterator = LengthIndexIterator(batch_size=32)
+        iterator.index_with(Vocabulary.from_instances(instances))
+        num_batches = len(list(iterator(instances, num_epochs=1, shuffle=False)))
+        assert iterator.get_num_batches(instances) == num_batches
+        # Not ceil(len(instances) / batch_size), which would cut the epoch short in distributed training.
+        assert num_batches > math.ceil(len(instances) / 32)
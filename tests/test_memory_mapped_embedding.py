@@ -0,0 +1,35 @@
+# pylint: disable=no-self-use,invalid-name
+import numpy
+import torch
+from numpy.testing import assert_almost_equal
+
+from allennlp.common import Params
+from allennlp.common.checks import ConfigurationError
+from allennlp.common.testing import AllenNlpTestCase
+from allennlp.data import Vocabulary
+from reading_comprehension.modules.memory_mapped_embedding import MemoryMappedEmbedding
+
+
+class TestMemoryMappedEmbedding(AllenNlpTestCase):
+    def setUp(self):
+        super().setUp()
+        self.vocab = Vocabulary()
+        for word in ["the", "cat", "sat"]:
+            self.vocab.add_token_to_namespace(word)
+        self.weight = numpy.random.rand(self.vocab.get_vocab_size(), 4).astype(numpy.float16)
+        self.embedding_file = str(self.TEST_DIR / "tokens.npy")
+        numpy.save(self.embedding_file, self.weight)
+
+    def test_forward_looks_up_float32_rows(self):
+        embedding = MemoryMappedEmbedding.from_params(self.vocab, Params({"embedding_file": self.embedding_file}))
+        inputs = torch.LongTensor([[2, 3, 0], [4, 1, 0]])
+        embedded = embedding(inputs)
+        assert embedded.size() == (2, 3, 4)
+        assert embedded.dtype == torch.float32
+        assert_almost_equal(embedded.numpy(), self.weight[inputs.numpy()].astype(numpy.float32))
+        assert not list(embedding.parameters())
+
+    def test_from_params_checks_vocabulary_size(self):
+        self.vocab.add_token_to_namespace("mat")
+        with self.assertRaises(ConfigurationError):
+            MemoryMappedEmbedding.from_params(self.vocab, Params({"embedding_file": self.embedding_file}))
@@ -0,0 +1,27 @@
+# pylint: disable=no-self-use,invalid-name
+import torch
+
+from allennlp.common.testing import AllenNlpTestCase
+from reading_comprehension.passage_encoding_cache import PassageEncodingCache
+
+
+class TestPassageEncodingCache(AllenNlpTestCase):
+    def test_cache_evicts_least_recently_used_entries_beyond_memory_cap(self):
+        # Each entry holds 64K floats, i.e. a quarter of a megabyte.
+        cache = PassageEncodingCache(max_memory_mb=0.6)
+        keys = [PassageEncodingCache.key(f"passage {i}") for i in range(3)]
+        cache.put(keys[0], {"encoded_passage": torch.zeros(1, 256, 256)})
+        cache.put(keys[1], {"encoded_passage": torch.zeros(1, 256, 256)})
+        assert cache.get(keys[0]) is not None
+        cache.put(keys[2], {"encoded_passage": torch.zeros(1, 256, 256)})
+        assert keys[0] in cache
+        assert keys[1] not in cache
+        assert keys[2] in cache
+        assert cache.memory_bytes == 2 * 256 * 256 * 4
+        assert cache.hits == 1
+
+    def test_cache_skips_entries_larger_than_the_cap(self):
+        cache = PassageEncodingCache(max_memory_mb=0.1)
+        cache.put("key", {"encoded_passage": torch.zeros(1, 256, 256)})
+        assert len(cache) == 0
+        assert cache.get("key") is None
@@ -0,0 +1,27 @@
+# pylint: disable=no-self-use,invalid-name,protected-access
+import torch
+from numpy.testing import assert_almost_equal
+
+from allennlp.common.testing import AllenNlpTestCase
+from allennlp.nn.util import add_positional_features
+from reading_comprehension.modules.positional_encoding import SinusoidalPositionalEncoding
+
+
+class TestSinusoidalPositionalEncoding(AllenNlpTestCase):
+    def test_forward_matches_add_positional_features_and_grows_on_demand(self):
+        SinusoidalPositionalEncoding._shared_tables.clear()
+        positional_encoding = SinusoidalPositionalEncoding(max_timesteps=8)
+        for timesteps in [5, 8, 13]:
+            for dim in [6, 7]:
+                inputs = torch.randn(2, timesteps, dim)
+                assert_almost_equal(positional_encoding(inputs).numpy(),
+                                    add_positional_features(inputs).numpy(), decimal=6)
+        table = SinusoidalPositionalEncoding._shared_tables[(6, 1.0, 1.0e4, torch.device("cpu"))]
+        assert table.size() == (16, 6)
+
+    def test_instances_share_one_table(self):
+        SinusoidalPositionalEncoding._shared_tables.clear()
+        first_features = SinusoidalPositionalEncoding().get_features(10, 4, torch.device("cpu"))
+        second_features = SinusoidalPositionalEncoding().get_features(20, 4, torch.device("cpu"))
+        assert first_features.data_ptr() == second_features.data_ptr()
+        assert len(SinusoidalPositionalEncoding._shared_tables) == 1
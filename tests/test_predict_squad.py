@@ -0,0 +1,103 @@
+# pylint: disable=invalid-name,protected-access
+import argparse
+import json
+import os
+import pathlib
+from unittest import mock
+
+from allennlp.common import Params
+from allennlp.common.testing import ModelTestCase
+from allennlp.data import DatasetReader
+from reading_comprehension.commands import predict_squad
+from reading_comprehension.qanet import QaNet  # pylint: disable=unused-import
+from reading_comprehension.qanet_predictor import QaNetPredictor
+
+
+class TestPredictSquad(ModelTestCase):
+
+    PROJECT_ROOT = (pathlib.Path(__file__).parent / "..").resolve()  # pylint: disable=no-member
+    FIXTURES_ROOT = PROJECT_ROOT / "fixtures"
+
+    def setUp(self):
+        super().setUp()
+        self.set_up_model(self.FIXTURES_ROOT / "qanet" / "experiment.json",
+                          self.FIXTURES_ROOT / "qanet" / "squad.json")
+        self.model.eval()
+        reader = DatasetReader.from_params(Params.from_file(self.param_file).pop("dataset_reader"))
+        self.predictor = QaNetPredictor(self.model, reader)
+        self.input_file = str(self.FIXTURES_ROOT / "qanet" / "squad.json")
+        self.question_ids = [question["id"] for question in predict_squad.read_questions(self.input_file, "squad")]
+
+    def get_args(self, output_file, n_best_file=None):
+        return argparse.Namespace(archive_file="model.tar.gz", input_file=self.input_file, output_file=output_file,
+                                  input_format=None, n_best_file=n_best_file, n_best_size=3, max_span_length=None,
+                                  batch_size=2, max_instances_in_memory=3, num_threads=None, cuda_device=-1,
+                                  bfloat16=False, overrides="")
+
+    def predict_shard(self, args, shard_index, num_shards):
+        # The archive is stubbed out: every shard predicts with the fixture model.
+        with mock.patch.object(predict_squad, "load_archive"), \
+                mock.patch.object(predict_squad.Predictor, "from_archive", return_value=self.predictor):
+            predict_squad._predict_shard(args, shard_index, num_shards)
+
+    @staticmethod
+    def read_predictions(path):
+        predictions = {}
+        with open(path) as predictions_file:
+            for line in predictions_file:
+                prediction = json.loads(line)
+                # Every question is predicted exactly once.
+                assert not predictions.keys() & prediction.keys()
+                predictions.update(prediction)
+        return predictions
+
+    def test_load_completed_ids_truncates_a_partial_last_line(self):
+        predictions_path = os.path.join(self.TEST_DIR, "predictions.jsonl")
+        assert predict_squad._load_completed_ids(predictions_path) == set()
+        complete_lines = json.dumps({"q1": "an answer"}) + "\n" + json.dumps({"q2": "another"}) + "\n"
+        with open(predictions_path, "w") as predictions_file:
+            predictions_file.write(complete_lines + '{"q3": "a partial')
+        assert predict_squad._load_completed_ids(predictions_path) == {"q1", "q2"}
+        with open(predictions_path) as predictions_file:
+            assert predictions_file.read() == complete_lines
+
+    def test_shard_path(self):
+        assert predict_squad._shard_path("predictions.jsonl", 0, 1) == "predictions.jsonl"
+        assert predict_squad._shard_path(None, 1, 4) is None
+        assert predict_squad._shard_path("predictions.jsonl", 1, 4) == "predictions.jsonl.part1-of-4"
+
+    def test_interrupted_prediction_resumes_with_the_remaining_questions(self):
+        expected_path = os.path.join(self.TEST_DIR, "expected.jsonl")
+        self.predict_shard(self.get_args(expected_path), 0, 1)
+        expected_predictions = self.read_predictions(expected_path)
+        assert sorted(expected_predictions) == sorted(self.question_ids)
+
+        # The process was killed while writing the second prediction.
+        predictions_path = os.path.join(self.TEST_DIR, "predictions.jsonl")
+        with open(expected_path) as expected_file:
+            first_line, second_line = expected_file.readlines()[:2]
+        with open(predictions_path, "w") as predictions_file:
+            predictions_file.write(first_line + second_line[:5])
+        self.predict_shard(self.get_args(predictions_path), 0, 1)
+        assert self.read_predictions(predictions_path) == expected_predictions
+
+    def test_shards_split_the_questions_by_index_and_merge_into_one_file(self):
+        expected_path = os.path.join(self.TEST_DIR, "expected.jsonl")
+        self.predict_shard(self.get_args(expected_path), 0, 1)
+        expected_predictions = self.read_predictions(expected_path)
+
+        predictions_path = os.path.join(self.TEST_DIR, "predictions.jsonl")
+        n_best_path = os.path.join(self.TEST_DIR, "n_best.jsonl")
+        args = self.get_args(predictions_path, n_best_path)
+        for shard_index in range(2):
+            self.predict_shard(args, shard_index, 2)
+            shard_path = predict_squad._shard_path(predictions_path, shard_index, 2)
+            assert sorted(self.read_predictions(shard_path)) == sorted(self.question_ids[shard_index::2])
+
+        predict_squad._merge_shards(predictions_path, 2)
+        predict_squad._merge_shards(n_best_path, 2)
+        assert not os.path.exists(predict_squad._shard_path(predictions_path, 0, 2))
+        assert self.read_predictions(predictions_path) == expected_predictions
+        n_best_predictions = self.read_predictions(n_best_path)
+        assert sorted(n_best_predictions) == sorted(self.question_ids)
+        assert all(0 < len(n_best) <= 3 for n_best in n_best_predictions.values())
@@ -0,0 +1,46 @@
+# pylint: disable=no-self-use,invalid-name
+from numpy.testing import assert_almost_equal
+
+from allennlp.common import Params
+from allennlp.common.testing import AllenNlpTestCase
+from allennlp.data import Vocabulary
+from reading_comprehension.modules.vector_store_embedding import VectorStoreEmbedding
+from reading_comprehension.pretrained_vector_store import PretrainedVectorStore
+
+
+class TestPretrainedVectorStore(AllenNlpTestCase):
+    def setUp(self):
+        super().setUp()
+        self.embeddings_file = str(self.TEST_DIR / "embeddings.txt")
+        with open(self.embeddings_file, "w") as embeddings_file:
+            embeddings_file.write("the 1.0 2.0 3.0\n")
+            embeddings_file.write("cat 4.0 5.0 6.0\n")
+            embeddings_file.write("bad 1.0 2.0\n")
+            embeddings_file.write("sat 7.0 8.0 9.0\n")
+        self.store_dir = str(self.TEST_DIR / "store")
+        self.vocab = Vocabulary()
+        for word in ["cat", "dog", "the"]:
+            self.vocab.add_token_to_namespace(word)
+
+    def test_convert_skips_malformed_lines(self):
+        store = PretrainedVectorStore.convert(self.embeddings_file, self.store_dir, embedding_dim=3)
+        assert store.vectors.shape == (3, 3)
+        assert store.token_to_row == {"the": 0, "cat": 1, "sat": 2}
+        assert_almost_equal(store.vectors[2], [7.0, 8.0, 9.0])
+
+    def test_store_tokens_file_can_be_read_as_pretrained_tokens(self):
+        PretrainedVectorStore.convert(self.embeddings_file, self.store_dir, embedding_dim=3)
+        vocab = Vocabulary(counter={"tokens": {"cat": 3, "dog": 2, "sat": 1}},
+                           pretrained_files={"tokens": self.store_dir + "/tokens.txt"},
+                           only_include_pretrained_words=True)
+        assert set(vocab.get_token_to_index_vocabulary("tokens")) == {"@@PADDING@@", "@@UNKNOWN@@", "cat", "sat"}
+
+    def test_vector_store_embedding_reads_vocabulary_rows(self):
+        PretrainedVectorStore.convert(self.embeddings_file, self.store_dir, embedding_dim=3)
+        embedding = VectorStoreEmbedding.from_params(self.vocab, Params({"pretrained_file": self.store_dir,
+                                                                         "embedding_dim": 3,
+                                                                         "trainable": False}))
+        weight = embedding.weight.data.numpy()
+        assert weight.shape == (self.vocab.get_vocab_size(), 3)
+        assert_almost_equal(weight[self.vocab.get_token_index("cat")], [4.0, 5.0, 6.0])
+        assert_almost_equal(weight[self.vocab.get_token_index("the")], [1.0, 2.0, 3.0])
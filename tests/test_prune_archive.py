@@ -0,0 +1,118 @@
+# pylint: disable=invalid-name,protected-access
+import argparse
+import json
+import os
+import pathlib
+import shutil
+
+import pytest
+import torch
+from numpy.testing import assert_almost_equal
+
+from allennlp.common import Params
+from allennlp.common.checks import ConfigurationError
+from allennlp.common.testing import ModelTestCase
+from allennlp.data import DatasetReader, Vocabulary
+from allennlp.models.archival import archive_model, load_archive, CONFIG_NAME
+from allennlp.predictors.predictor import Predictor
+from reading_comprehension.commands.prune_archive import _prune_archive, count_corpus_tokens, prune_namespace
+from reading_comprehension.qanet import QaNet  # pylint: disable=unused-import
+from reading_comprehension.qanet_predictor import QaNetPredictor  # pylint: disable=unused-import
+
+
+class TestPruneArchive(ModelTestCase):
+
+    PROJECT_ROOT = (pathlib.Path(__file__).parent / "..").resolve()  # pylint: disable=no-member
+    FIXTURES_ROOT = PROJECT_ROOT / "fixtures"
+
+    def setUp(self):
+        super().setUp()
+        self.set_up_model(self.FIXTURES_ROOT / "qanet" / "experiment.json",
+                          self.FIXTURES_ROOT / "qanet" / "squad.json")
+        self.reader = DatasetReader.from_params(Params.from_file(self.param_file).pop("dataset_reader"))
+        with open(self.FIXTURES_ROOT / "qanet" / "squad.json") as dataset_file:
+            paragraph = json.load(dataset_file)["data"][0]["paragraphs"][0]
+        self.questions = [{"id": question_answer["id"],
+                           "question": question_answer["question"],
+                           "passage": paragraph["context"]} for question_answer in paragraph["qas"]]
+        self.corpus_file = os.path.join(self.TEST_DIR, "traffic.jsonl")
+        with open(self.corpus_file, "w") as corpus_file:
+            for question in self.questions:
+                corpus_file.write(json.dumps(question) + "\n")
+
+    def archive_fixture_model(self):
+        serialization_dir = os.path.join(self.TEST_DIR, "model")
+        os.makedirs(serialization_dir)
+        self.vocab.save_to_files(os.path.join(serialization_dir, "vocabulary"))
+        torch.save(self.model.state_dict(), os.path.join(serialization_dir, "weights.th"))
+        shutil.copyfile(self.param_file, os.path.join(serialization_dir, CONFIG_NAME))
+        archive_model(serialization_dir, weights="weights.th")
+        return os.path.join(serialization_dir, "model.tar.gz")
+
+    def get_args(self, archive_file, output_archive, fp16=False, memory_mapped_embedding=None):
+        return argparse.Namespace(archive_file=archive_file, corpus_files=[self.corpus_file],
+                                  output_archive=output_archive, input_format=None, token_embedder="tokens",
+                                  min_count=1, fp16=fp16, memory_mapped_embedding=memory_mapped_embedding)
+
+    def test_count_corpus_tokens_counts_a_shared_passage_once(self):
+        counter = count_corpus_tokens(self.reader, [self.corpus_file])
+        passage_tokens = self.reader._tokenizer.tokenize(self.questions[0]["passage"])
+        question_tokens = [token for question in self.questions
+                           for token in self.reader._tokenizer.tokenize(question["question"])]
+        word = passage_tokens[0].text.lower()
+        expected_count = sum(token.text.lower() == word for token in passage_tokens + question_tokens)
+        assert counter["tokens"][word] == expected_count
+        assert set(counter) == {"tokens", "token_characters"}
+
+    def test_prune_namespace_keeps_padding_oov_and_observed_tokens(self):
+        vocab = Vocabulary()
+        for word in ["the", "cat", "sat", "mat"]:
+            vocab.add_token_to_namespace(word)
+        kept_indices = prune_namespace(vocab, "tokens", {"mat": 1, "the": 2, "dog": 1})
+        assert kept_indices == [0, 1, vocab.get_token_index("the"), vocab.get_token_index("mat")]
+
+    def test_pruned_archive_makes_the_same_predictions_on_observed_words(self):
+        archive_file = self.archive_fixture_model()
+        output_archive = os.path.join(self.TEST_DIR, "slim_model.tar.gz")
+        _prune_archive(self.get_args(archive_file, output_archive))
+
+        predictor = Predictor.from_archive(load_archive(archive_file), "qanet")
+        slim_predictor = Predictor.from_archive(load_archive(output_archive), "qanet")
+        slim_vocab = slim_predictor._model.vocab
+        observed_words = count_corpus_tokens(self.reader, [self.corpus_file])["tokens"].keys()
+        # The padding and OOV tokens, and the observed words that were in the vocabulary.
+        num_kept_words = len(observed_words & self.vocab.get_token_to_index_vocabulary("tokens").keys())
+        assert slim_vocab.get_vocab_size("tokens") == num_kept_words + 2
+        assert slim_vocab.get_vocab_size("token_characters") == self.vocab.get_vocab_size("token_characters")
+        for question in self.questions:
+            inputs = {"question": question["question"], "passage": question["passage"]}
+            prediction = predictor.predict_json(inputs)
+            slim_prediction = slim_predictor.predict_json(inputs)
+            assert slim_prediction["best_span_str"] == prediction["best_span_str"]
+            assert_almost_equal(slim_prediction["span_start_logits"], prediction["span_start_logits"], decimal=5)
+
+    def test_fp16_requires_a_memory_mapped_embedding(self):
+        output_archive = os.path.join(self.TEST_DIR, "slim_model.tar.gz")
+        with pytest.raises(ConfigurationError):
+            _prune_archive(self.get_args("model.tar.gz", output_archive, fp16=True))
+
+    def test_fp16_memory_mapped_archive_round_trip(self):
+        archive_file = self.archive_fixture_model()
+        output_archive = os.path.join(self.TEST_DIR, "slim_model.tar.gz")
+        embedding_file = os.path.join(self.TEST_DIR, "slim_tokens.npy")
+        _prune_archive(self.get_args(archive_file, output_archive,
+                                     fp16=True, memory_mapped_embedding=embedding_file))
+
+        slim_model = load_archive(output_archive).model
+        assert not any("token_embedder_tokens" in name for name, _ in slim_model.named_parameters())
+        slim_model.eval()
+        self.model.eval()
+        # An instance is indexed with the vocabulary of the first model it goes through, so each
+        # model gets its own.
+        question = self.questions[0]
+        output_dict = self.model.forward_on_instance(
+                self.reader.text_to_instance(question["question"], question["passage"]))
+        slim_output_dict = slim_model.forward_on_instance(
+                self.reader.text_to_instance(question["question"], question["passage"]))
+        # Up to the float16 rounding of the embeddings.
+        assert_almost_equal(slim_output_dict["span_start_logits"], output_dict["span_start_logits"], decimal=2)
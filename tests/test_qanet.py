@@ -1,10 +1,27 @@
 #pylint: disable=unused-import
+import copy
+import os
 import pathlib
+import random
+from unittest import mock
+
+import numpy
+import pytest
+import torch
+from numpy.testing import assert_almost_equal
+from allennlp.common import Params
+from allennlp.common.checks import ConfigurationError
 from allennlp.common.testing import ModelTestCase
+from allennlp.data import DatasetReader
+from allennlp.data.dataset import Batch
+from allennlp.data.iterators import BasicIterator
+from allennlp.models import Model
+from allennlp.nn import RegularizerApplicator, util
+from allennlp.nn.regularizers import L1Regularizer, L2Regularizer
 from reading_comprehension.qanet import QaNet
 from reading_comprehension.qanet_encoder import QaNetEncoder
 from reading_comprehension.squad_reader import SquadReader
-from reading_comprehension.ema_trainer import EMATrainer
+from reading_comprehension.ema_trainer import EMATrainer, _slice_batch, partition_parameters
 
 
 class QANetModelTest(ModelTestCase):
@@ -21,3 +38,328 @@ class QANetModelTest(ModelTestCase):
 
     def test_model_can_train_save_and_load(self):
         self.ensure_model_can_train_save_and_load(self.param_file)
+
+    def test_answer_questions_with_encoded_passage_matches_forward(self):
+        self.model.eval()
+        tensors = self.dataset.as_tensor_dict()
+        output_dict = self.model(**tensors)
+        encoding = self.model.encode_passage(tensors["passage"])
+        answer_dict = self.model.answer_questions(tensors["question"],
+                                                  encoding["encoded_passage"],
+                                                  encoding["passage_mask"],
+                                                  tensors["metadata"])
+        assert_almost_equal(answer_dict["span_start_logits"].data.numpy(),
+                            output_dict["span_start_logits"].data.numpy(), decimal=5)
+        assert_almost_equal(answer_dict["span_end_logits"].data.numpy(),
+                            output_dict["span_end_logits"].data.numpy(), decimal=5)
+        assert answer_dict["best_span_str"] == output_dict["best_span_str"]
+
+    def test_windowed_forward_finds_spans_in_the_whole_passage(self):
+        # pylint: disable=protected-access
+        self.model.eval()
+        self.model._window_size = 10
+        self.model._window_stride = 5
+        tensors = self.dataset.as_tensor_dict()
+        output_dict = self.model(**tensors)
+        passage_lengths = [len(metadata["passage_tokens"]) for metadata in tensors["metadata"]]
+        assert output_dict["span_start_logits"].size() == (len(passage_lengths), max(passage_lengths))
+        assert "passage_question_attention" not in output_dict
+        for (span_start, span_end), passage_length in zip(output_dict["best_span"].tolist(), passage_lengths):
+            assert 0 <= span_start <= span_end < passage_length
+            # Both ends of the span come from the same window.
+            assert span_end - span_start < 10
+        assert len(output_dict["best_span_str"]) == len(passage_lengths)
+
+    def test_window_stride_larger_than_the_window_is_rejected(self):
+        params = Params.from_file(self.param_file).pop("model")
+        params["window_size"] = 10
+        params["window_stride"] = 11
+        with pytest.raises(ConfigurationError):
+            Model.from_params(vocab=self.vocab, params=params)
+
+    def test_fused_encoding_requires_a_packed_phrase_layer(self):
+        params = Params.from_file(self.param_file).pop("model")
+        params["fuse_question_and_passage"] = True
+        params["phrase_layer"]["use_packed_sequences"] = False
+        with pytest.raises(ConfigurationError):
+            Model.from_params(vocab=self.vocab, params=params.duplicate())
+        params["phrase_layer"]["use_packed_sequences"] = True
+        assert Model.from_params(vocab=self.vocab, params=params)._fuse_question_and_passage  # pylint: disable=protected-access
+
+    def test_fused_question_and_passage_encoding_matches_separate_encoding(self):
+        # pylint: disable=protected-access
+        self.model.eval()
+        tensors = self.dataset.as_tensor_dict()
+        output_dict = self.model(**tensors)
+        self.model._fuse_question_and_passage = True
+        fused_output_dict = self.model(**tensors)
+        for key in ["span_start_logits", "span_end_logits", "best_span", "passage_question_attention"]:
+            assert fused_output_dict[key].size() == output_dict[key].size()
+        assert len(fused_output_dict["best_span_str"]) == len(output_dict["best_span_str"])
+
+        # With passages that are copies of the questions, the questions and passages have the same
+        # padded length and longest word, so the fused encoding pads nothing more.
+        reader = DatasetReader.from_params(Params.from_file(self.param_file).pop("dataset_reader"))
+        questions = [" ".join(instance.fields["metadata"].metadata["question_tokens"])
+                     for instance in self.instances]
+        assert len({len(question.split()) for question in questions}) > 1
+        batch = Batch([reader.text_to_instance(question, question) for question in questions])
+        batch.index_instances(self.vocab)
+        tensors = batch.as_tensor_dict()
+        question_mask = util.get_text_field_mask(tensors["question"]).float()
+        passage_mask = util.get_text_field_mask(tensors["passage"]).float()
+        for use_packed_sequences in [False, True]:
+            self.model._phrase_layer._use_packed_sequences = use_packed_sequences
+            encoded_question = self.model._encode_text(tensors["question"], question_mask)
+            encoded_passage = self.model._encode_text(tensors["passage"], passage_mask)
+            fused_encoded_question, fused_encoded_passage = self.model._encode_question_and_passage(
+                    tensors["question"], question_mask, tensors["passage"], passage_mask)
+            # The padding positions are not compared.
+            for encoded, fused_encoded, mask in [(encoded_question, fused_encoded_question, question_mask),
+                                                 (encoded_passage, fused_encoded_passage, passage_mask)]:
+                assert fused_encoded.size() == encoded.size()
+                assert_almost_equal((fused_encoded * mask.unsqueeze(-1)).detach().numpy(),
+                                    (encoded * mask.unsqueeze(-1)).detach().numpy(), decimal=5)
+
+    def test_regularization_penalty_skips_frozen_parameters(self):
+        expected_penalty = sum(1e-7 * parameter.pow(2).sum().item()
+                               for parameter in self.model.parameters() if parameter.requires_grad)
+        assert any(not parameter.requires_grad for parameter in self.model.parameters())
+        assert_almost_equal(self.model.get_regularization_penalty().item(), expected_penalty, decimal=6)
+
+    def test_weight_decay_from_regularizer_matches_an_sgd_step_with_the_l2_penalty(self):
+        # pylint: disable=protected-access
+        self.model.eval()
+        initial_state = copy.deepcopy(self.model.state_dict())
+        iterator = BasicIterator(batch_size=len(self.instances))
+        iterator.index_with(self.vocab)
+        batch = next(iterator(self.instances, num_epochs=1, shuffle=False))
+
+        def sgd_step(weight_decay_from_regularizer):
+            self.model.load_state_dict(initial_state)
+            self.model._regularizer = RegularizerApplicator([(".*", L2Regularizer(alpha=0.01))])
+            # The optimizer also holds the frozen parameters, which must not be decayed.
+            optimizer = torch.optim.SGD(self.model.parameters(), lr=0.1)
+            trainer = EMATrainer(self.model, optimizer, iterator, self.instances, num_epochs=1,
+                                 weight_decay_from_regularizer=weight_decay_from_regularizer)
+            optimizer.zero_grad()
+            trainer._accumulate_gradients([batch])
+            trainer._optimizer_step()
+            return trainer, {name: parameter.detach().clone() for name, parameter in self.model.named_parameters()}
+
+        _, expected_parameters = sgd_step(weight_decay_from_regularizer=False)
+        trainer, parameters = sgd_step(weight_decay_from_regularizer=True)
+        assert self.model._regularizer is None
+        assert trainer._weight_decays
+        for _, weight_decay, decayed_parameters in trainer._weight_decays:
+            assert weight_decay == 0.02
+            assert all(parameter.requires_grad for parameter in decayed_parameters)
+        for name, parameter in self.model.named_parameters():
+            assert_almost_equal(parameters[name].numpy(), expected_parameters[name].numpy(), decimal=6)
+            if not parameter.requires_grad:
+                assert_almost_equal(parameters[name].numpy(), initial_state[name].numpy())
+
+    def test_weight_decay_from_regularizer_rejects_other_regularizers(self):
+        # pylint: disable=protected-access
+        self.model._regularizer = RegularizerApplicator([(".*", L1Regularizer(alpha=0.01))])
+        optimizer = torch.optim.SGD([p for p in self.model.parameters() if p.requires_grad], lr=0.1)
+        iterator = BasicIterator(batch_size=2)
+        iterator.index_with(self.vocab)
+        with pytest.raises(ConfigurationError):
+            EMATrainer(self.model, optimizer, iterator, self.instances, weight_decay_from_regularizer=True)
+
+    def test_training_resumes_at_the_batch_after_a_mid_epoch_checkpoint(self):
+        # pylint: disable=protected-access
+        initial_state = copy.deepcopy(self.model.state_dict())
+        # The layer dropout decisions come from generators of the model, which are seeded once.
+        model_params = Params.from_file(self.param_file).pop("model")
+        for seed, layer in enumerate(["phrase_layer", "modeling_layer"]):
+            model_params[layer]["layer_dropout_seed"] = 100 * seed
+
+        def get_trainer(serialization_dir):
+            random.seed(0)
+            numpy.random.seed(0)
+            torch.manual_seed(0)
+            self.model = Model.from_params(vocab=self.vocab, params=model_params.duplicate())
+            self.model.load_state_dict(initial_state)
+            optimizer = torch.optim.Adam([p for p in self.model.parameters() if p.requires_grad], lr=0.001)
+            iterator = BasicIterator(batch_size=1)
+            iterator.index_with(self.vocab)
+            # Saves a mid-epoch checkpoint after every batch.
+            return EMATrainer(self.model, optimizer, iterator, self.instances, num_epochs=2,
+                              serialization_dir=serialization_dir, model_save_interval=0.0,
+                              exponential_moving_average_decay=0.9)
+
+        trainer = get_trainer(os.path.join(self.TEST_DIR, "uninterrupted"))
+        assert any(getattr(module, "_generator", None) is not None for module in self.model.modules())
+        trainer.train()
+        expected_parameters = {name: parameter.detach().clone()
+                               for name, parameter in self.model.named_parameters()}
+        expected_averages = trainer.exp_moving_average.state_dict()
+
+        trainer = get_trainer(os.path.join(self.TEST_DIR, "interrupted"))
+        optimizer_step = trainer._optimizer_step
+
+        def interrupted_optimizer_step():
+            if trainer._batch_num_total == 3:
+                raise KeyboardInterrupt
+            optimizer_step()
+        trainer._optimizer_step = interrupted_optimizer_step
+        with pytest.raises(KeyboardInterrupt):
+            trainer.train()
+        training_state = torch.load(trainer.find_latest_checkpoint()[1])
+        assert training_state["model"].keys() == {name for name, parameter in self.model.named_parameters()
+                                                  if parameter.requires_grad}
+
+        trainer = get_trainer(os.path.join(self.TEST_DIR, "interrupted"))
+        trainer.train()
+        assert trainer._batch_num_total == 2 * len(self.instances)
+        for name, parameter in self.model.named_parameters():
+            assert_almost_equal(parameter.detach().numpy(), expected_parameters[name].numpy(), decimal=6)
+        for name, average in trainer.exp_moving_average.state_dict().items():
+            assert_almost_equal(average.numpy(), expected_averages[name].numpy(), decimal=6)
+
+    def test_accumulated_and_micro_batch_gradients_match_the_full_batch_gradients(self):
+        # pylint: disable=protected-access
+        # Without dropout, the gradients of the mean loss do not depend on how the batch is split.
+        self.model.eval()
+        iterator = BasicIterator(batch_size=len(self.instances))
+        iterator.index_with(self.vocab)
+        batch = next(iterator(self.instances, num_epochs=1, shuffle=False))
+
+        def get_gradients(max_tokens_per_micro_batch, batches):
+            optimizer = torch.optim.SGD([p for p in self.model.parameters() if p.requires_grad], lr=0.1)
+            trainer = EMATrainer(self.model, optimizer, iterator, self.instances, num_epochs=1,
+                                 max_tokens_per_micro_batch=max_tokens_per_micro_batch)
+            optimizer.zero_grad()
+            trainer._accumulate_gradients(batches)
+            return {name: parameter.grad.clone() for name, parameter in self.model.named_parameters()
+                    if parameter.grad is not None}
+
+        expected_gradients = get_gradients(None, [batch])
+        # The slices keep the padding of the whole batch, which would otherwise change the outputs.
+        accumulated_gradients = get_gradients(None, [_slice_batch(batch, 0, 2),
+                                                     _slice_batch(batch, 2, len(self.instances))])
+        # A budget of one padded token makes a micro-batch of every instance.
+        micro_batch_gradients = get_gradients(1, [batch])
+        for gradients in [accumulated_gradients, micro_batch_gradients]:
+            assert gradients.keys() == expected_gradients.keys()
+            for name, gradient in gradients.items():
+                assert_almost_equal(gradient.numpy(), expected_gradients[name].numpy(), decimal=5)
+
+    def test_distributed_training_runs_the_batches_of_the_smallest_lazy_shard(self):
+        # pylint: disable=protected-access
+        reader_params = Params.from_file(self.param_file).pop("dataset_reader")
+        reader_params["lazy"] = True
+        lazy_instances = DatasetReader.from_params(reader_params).read(
+                str(self.FIXTURES_ROOT / "qanet" / "squad.json"))
+        num_instances = sum(1 for _ in lazy_instances)
+        assert num_instances > 2
+
+        torch.distributed.init_process_group("gloo", init_method=f"file://{self.TEST_DIR / 'rendezvous'}",
+                                             rank=0, world_size=1)
+        try:
+            optimizer = torch.optim.Adam([p for p in self.model.parameters() if p.requires_grad], lr=0.001)
+            iterator = BasicIterator(batch_size=1)
+            iterator.index_with(self.vocab)
+            trainer = EMATrainer(self.model, optimizer, iterator, lazy_instances, num_epochs=1, distributed=True)
+            accumulate_gradients = trainer._accumulate_gradients
+            batch_groups = []
+
+            def recording_accumulate_gradients(batch_group):
+                batch_groups.append(batch_group)
+                return accumulate_gradients(batch_group)
+            trainer._accumulate_gradients = recording_accumulate_gradients
+            trainer._train_epoch(0)
+            assert len(batch_groups) == num_instances
+
+            # Another process only has two batches.
+            def all_reduce(tensor, op):  # pylint: disable=unused-argument
+                tensor.clamp_(max=2)
+            batch_groups.clear()
+            with mock.patch.object(torch.distributed, "all_reduce", all_reduce):
+                trainer._train_epoch(1)
+            assert len(batch_groups) == 2
+        finally:
+            torch.distributed.destroy_process_group()
+
+    def test_partition_parameters_balances_the_trainable_parameters(self):
+        trainable_parameters = {name: parameter.numel() for name, parameter in self.model.named_parameters()
+                                if parameter.requires_grad}
+        # The model has a frozen word embedding, which has no optimizer state to shard.
+        assert not self.model._text_field_embedder.token_embedder_tokens.weight.requires_grad  # pylint: disable=protected-access
+        for world_size in [2, 3]:
+            parameter_owners = partition_parameters(self.model, world_size)
+            assert parameter_owners.keys() == trainable_parameters.keys()
+            rank_sizes = [sum(numel for name, numel in trainable_parameters.items()
+                              if parameter_owners[name] == rank)
+                          for rank in range(world_size)]
+            assert min(rank_sizes) > 0
+            # The greedy partition is off by at most the largest parameter.
+            assert max(rank_sizes) - min(rank_sizes) <= max(trainable_parameters.values())
+
+    def test_sharded_optimizer_state_rejects_mid_epoch_checkpoints(self):
+        optimizer = torch.optim.Adam([p for p in self.model.parameters() if p.requires_grad], lr=0.001)
+        iterator = BasicIterator(batch_size=2)
+        iterator.index_with(self.vocab)
+        with pytest.raises(ConfigurationError):
+            EMATrainer(self.model, optimizer, iterator, self.instances, serialization_dir=str(self.TEST_DIR),
+                       model_save_interval=60.0, shard_optimizer_state=True)
+
+    def test_passage_length_curriculum_trains_on_passage_windows_holding_the_answer(self):
+        # pylint: disable=protected-access
+        optimizer = torch.optim.Adam([p for p in self.model.parameters() if p.requires_grad], lr=0.001)
+        iterator = BasicIterator(batch_size=2)
+        iterator.index_with(self.vocab)
+        trainer = EMATrainer(self.model, optimizer, iterator, self.instances, num_epochs=2,
+                             exponential_moving_average_decay=0.9, passage_length_curriculum=[(1, 1000), (0, 50)])
+        assert [trainer._get_passage_length_limit(epoch) for epoch in range(3)] == [50, 1000, 1000]
+
+        accumulate_gradients = trainer._accumulate_gradients
+        batch_groups = []
+
+        def recording_accumulate_gradients(batch_group):
+            batch_groups.append(batch_group)
+            return accumulate_gradients(batch_group)
+        trainer._accumulate_gradients = recording_accumulate_gradients
+        trainer._train_epoch(0)
+
+        def answer(metadata, span_start, span_end):
+            offsets = metadata["token_offsets"]
+            return tuple(metadata["question_tokens"]), \
+                    metadata["original_passage"][offsets[span_start][0]:offsets[span_end][1]]
+
+        # The instances whose answer ends after the limit are trained on too.
+        assert any(instance.fields["span_end"].sequence_index >= 50 for instance in self.instances)
+        expected_answers = {answer(instance.fields["metadata"].metadata,
+                                   instance.fields["span_start"].sequence_index,
+                                   instance.fields["span_end"].sequence_index) for instance in self.instances}
+        answers = set()
+        for batch in [batch for batch_group in batch_groups for batch in batch_group]:
+            passage_lengths = util.get_text_field_mask(batch["passage"]).sum(-1)
+            assert batch["passage"]["tokens"].size(1) <= 50
+            assert (batch["span_start"].view(-1) >= 0).all()
+            assert (batch["span_end"].view(-1) < passage_lengths).all()
+            for metadata, span_start, span_end in zip(batch["metadata"], batch["span_start"].view(-1).tolist(),
+                                                      batch["span_end"].view(-1).tolist()):
+                assert len(metadata["token_offsets"]) <= 50
+                answers.add(answer(metadata, span_start, span_end))
+        assert answers == expected_answers
+
+    def test_distillation_loss_mixes_the_gold_and_teacher_losses(self):
+        # pylint: disable=protected-access
+        self.model.eval()
+        tensors = self.dataset.as_tensor_dict()
+        output_dict = self.model(**tensors)
+        # Distilling from itself costs nothing.
+        self.model._distillation_weight = 1.0
+        distilled_output_dict = self.model(span_start_teacher_probs=output_dict["span_start_probs"].detach(),
+                                           span_end_teacher_probs=output_dict["span_end_probs"].detach(),
+                                           **tensors)
+        assert_almost_equal(distilled_output_dict["loss"].item(), 0.0, decimal=4)
+        # The teacher probabilities are cut or padded to the passage length.
+        self.model._distillation_weight = 0.0
+        distilled_output_dict = self.model(span_start_teacher_probs=output_dict["span_start_probs"][:, :5],
+                                           span_end_teacher_probs=output_dict["span_end_probs"][:, :5],
+                                           **tensors)
+        assert_almost_equal(distilled_output_dict["loss"].item(), output_dict["loss"].item(), decimal=5)
@@ -0,0 +1,50 @@
+# pylint: disable=no-self-use,invalid-name
+import torch
+from numpy.testing import assert_almost_equal
+
+from allennlp.common.testing import AllenNlpTestCase
+from reading_comprehension.qanet_encoder import QaNetEncoder
+
+
+class TestQaNetEncoder(AllenNlpTestCase):
+    def setUp(self):
+        super().setUp()
+        self.encoder_params = dict(input_dim=12, hidden_dim=8, attention_projection_dim=8,
+                                   feedforward_hidden_dim=16, num_blocks=2, num_convs_per_block=2,
+                                   conv_kernel_size=3, num_attention_heads=2)
+        self.encoder = QaNetEncoder(**self.encoder_params)
+        self.packed_encoder = QaNetEncoder(**self.encoder_params, use_packed_sequences=True)
+        self.packed_encoder.load_state_dict(self.encoder.state_dict())
+        self.encoder.eval()
+        self.packed_encoder.eval()
+
+    def test_packed_sequences_match_padded_ones_without_padding(self):
+        inputs = torch.randn(3, 5, 12)
+        mask = torch.ones(3, 5)
+        assert_almost_equal(self.packed_encoder(inputs, mask).data.numpy(),
+                            self.encoder(inputs, mask).data.numpy(), decimal=5)
+
+    def test_packed_sequences_ignore_padding(self):
+        inputs = torch.randn(2, 6, 12)
+        mask = torch.FloatTensor([[1, 1, 1, 1, 1, 1], [1, 1, 1, 0, 0, 0]])
+        output = self.packed_encoder(inputs, mask)
+        assert output.size() == (2, 6, 8)
+        assert not output[1, 3:].data.any()
+
+        inputs[1, 3:] = torch.randn(3, 12)
+        assert_almost_equal(self.packed_encoder(inputs, mask).data.numpy(), output.data.numpy(), decimal=6)
+
+    def test_seeded_layer_dropout_is_reproducible(self):
+        params = dict(self.encoder_params, dropout_prob=0.0, layer_dropout_undecayed_prob=0.5,
+                      layer_dropout_seed=3)
+        encoder = QaNetEncoder(**params)
+        other_encoder = QaNetEncoder(**params)
+        other_encoder.load_state_dict(encoder.state_dict())
+        inputs = torch.randn(2, 4, 12)
+        mask = torch.ones(2, 4)
+        for _ in range(3):
+            assert_almost_equal(encoder(inputs, mask).data.numpy(), other_encoder(inputs, mask).data.numpy())
+
+        residuals = [block.residual_with_layer_dropout for block in encoder._encoder_blocks]  # pylint: disable=protected-access
+        assert sum(residual.num_decisions for residual in residuals) == 3 * 2 * 4
+        assert sum(residual.num_dropped for residual in residuals) > 0
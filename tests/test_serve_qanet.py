@@ -0,0 +1,96 @@
+# pylint: disable=no-self-use,invalid-name,protected-access
+import io
+import json
+import queue
+import sys
+import time
+from unittest import mock
+
+import torch
+
+from allennlp.common.testing import AllenNlpTestCase
+from reading_comprehension.commands import serve_qanet
+
+
+class _StubPredictor:
+    """
+    Answers each question with its upper-cased text, and records the size of every micro-batch.
+    """
+    def __init__(self):
+        self.batch_sizes = []
+
+    def _json_to_instance(self, inputs):
+        return inputs["question"]
+
+    def predict_instances(self, instances, n_best_size, max_span_length):  # pylint: disable=unused-argument
+        self.batch_sizes.append(len(instances))
+        return [{"best_span_str": question.upper()} for question in instances]
+
+
+class _StubServer:
+    def submit(self, inputs):
+        pending = serve_qanet._PendingRequest(time.time())
+        pending.result = {"best_span_str": inputs["question"].upper()}
+        pending.done.set()
+        return pending
+
+    def get_metrics(self):
+        return {}
+
+
+class TestServeQaNet(AllenNlpTestCase):
+    def run_worker(self, predictor, requests, max_batch_size):
+        request_queue = queue.Queue()
+        response_queue = queue.Queue()
+        for request_id, inputs in enumerate(requests):
+            request_queue.put((request_id, inputs, time.time()))
+        request_queue.put(None)
+        serve_qanet._worker_loop(predictor, request_queue, response_queue, torch.get_num_threads(),
+                                 max_batch_size, max_batch_latency=1.0, n_best_size=0, max_span_length=None)
+        responses = {}
+        while not response_queue.empty():
+            request_id, prediction, error = response_queue.get()
+            responses[request_id] = (prediction, error)
+        return responses
+
+    def test_worker_splits_the_requests_into_micro_batches(self):
+        predictor = _StubPredictor()
+        responses = self.run_worker(predictor, [{"question": f"q{i}"} for i in range(5)], max_batch_size=2)
+        assert predictor.batch_sizes == [2, 2, 1]
+        assert responses == {i: ({"best_span_str": f"Q{i}"}, None) for i in range(5)}
+
+    def test_a_malformed_request_only_fails_itself(self):
+        predictor = _StubPredictor()
+        requests = [{"question": "first"}, {"passage": "no question"}, {"question": "third"}]
+        responses = self.run_worker(predictor, requests, max_batch_size=8)
+        assert predictor.batch_sizes == [2]
+        assert responses[0] == ({"best_span_str": "FIRST"}, None)
+        assert responses[1][0] is None
+        assert responses[1][1].startswith("KeyError")
+        assert responses[2] == ({"best_span_str": "THIRD"}, None)
+
+    def test_stdin_answers_every_line_in_order_despite_invalid_json(self):
+        lines = [json.dumps({"question": "first"}), "{not json", "", json.dumps({"question": "third"})]
+        stdout = io.StringIO()
+        with mock.patch.object(sys, "stdin", io.StringIO("\n".join(lines) + "\n")), \
+                mock.patch.object(sys, "stdout", stdout):
+            serve_qanet._serve_stdin(_StubServer(), max_in_flight=2)
+        results = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        assert len(results) == 3
+        assert results[0] == {"best_span_str": "FIRST"}
+        assert results[1]["error"].startswith("invalid json")
+        assert results[2] == {"best_span_str": "THIRD"}
+
+    def test_latency_metrics(self):
+        metrics = serve_qanet.LatencyMetrics(window_size=100)
+        assert metrics.get_metrics()["latency_p50_ms"] == 0.0
+        # Only the 100 most recent latencies, 1 to 100 milliseconds, count for the percentiles.
+        for latency_ms in [1000] * 10 + list(range(1, 101)):
+            metrics.record(latency_ms / 1000, error=latency_ms % 10 == 0)
+        results = metrics.get_metrics()
+        assert results["num_requests"] == 110
+        assert results["num_errors"] == 20
+        assert abs(results["latency_p50_ms"] - 51) < 1e-6
+        assert abs(results["latency_p90_ms"] - 91) < 1e-6
+        assert abs(results["latency_p99_ms"] - 100) < 1e-6
+        assert results["requests_per_second"] > 0
@@ -0,0 +1,67 @@
+# pylint: disable=no-self-use,invalid-name,protected-access
+import json
+import os
+import shutil
+
+import numpy
+from numpy.testing import assert_almost_equal
+
+from allennlp.common.testing import AllenNlpTestCase
+from reading_comprehension.squad_reader import SquadReader, save_teacher_probabilities
+
+
+class TestSquadReader(AllenNlpTestCase):
+    def setUp(self):
+        super().setUp()
+        fixture_path = os.path.join(os.path.dirname(__file__), os.pardir, "fixtures", "qanet", "squad.json")
+        # The reader only drops invalid examples and sorts by length in files read for training.
+        self.train_path = os.path.join(self.TEST_DIR, "squad_train.json")
+        shutil.copyfile(fixture_path, self.train_path)
+
+    def test_length_sorted_batches_read_the_same_instances(self):
+        reader = SquadReader(passage_length_limit=30, question_length_limit=10)
+        instances = reader.read(self.train_path)
+        sorted_reader = SquadReader(passage_length_limit=30, question_length_limit=10, length_index_batch_size=2)
+        sorted_instances = sorted_reader.read(self.train_path)
+        assert os.path.exists(self.train_path + ".length_index.npz")
+
+        def key(instance):
+            return (instance.fields["metadata"].metadata["original_passage"],
+                    " ".join(instance.fields["metadata"].metadata["question_tokens"]))
+        assert sorted(key(instance) for instance in sorted_instances) == \
+                sorted(key(instance) for instance in instances)
+
+        length_index = sorted_reader._get_length_index(self.train_path, None)
+        assert len(length_index) == len(instances)
+        assert length_index[:, 1].max() <= 30
+        assert length_index[:, 2].max() <= 10
+
+    def test_length_sorted_batches_group_similar_lengths(self):
+        reader = SquadReader(length_index_batch_size=3, length_index_padding_noise=0.0)
+        length_index = numpy.array([(index, passage_length, 5)
+                                    for index, passage_length in enumerate([50, 10, 40, 11, 51, 12, 41, 52])])
+        batches = reader._get_length_sorted_batches(length_index)
+        assert [len(batch) for batch in batches][-1] == 2
+        assert sorted(sorted(batch.tolist()) for batch in batches[:-1]) == [[0, 2, 6], [1, 3, 5]]
+        assert sorted(batches[-1].tolist()) == [4, 7]
+
+    def test_training_instances_get_the_cached_teacher_probabilities(self):
+        instances = SquadReader(passage_length_limit=30).read(self.train_path)
+        with open(self.train_path) as train_file:
+            question_ids = [question_answer["id"] for article in json.load(train_file)["data"]
+                            for paragraph in article["paragraphs"] for question_answer in paragraph["qas"]]
+        # The teacher read 20 tokens of every passage.
+        probabilities = {question_id: (numpy.full(20, 0.05), numpy.eye(20)[index % 20])
+                         for index, question_id in enumerate(question_ids)}
+        teacher_probabilities_path = os.path.join(self.TEST_DIR, "teacher_probabilities.npz")
+        save_teacher_probabilities(teacher_probabilities_path, probabilities)
+
+        reader = SquadReader(passage_length_limit=30, teacher_probabilities_file=teacher_probabilities_path)
+        distilled_instances = reader.read(self.train_path)
+        assert len(distilled_instances) == len(instances)
+        for instance in distilled_instances:
+            span_start_probs = instance.fields["span_start_teacher_probs"].array
+            assert span_start_probs.shape == (instance.fields["passage"].sequence_length(),)
+            assert_almost_equal(span_start_probs[:20], numpy.full(20, 0.05), decimal=3)
+            assert not span_start_probs[20:].any()
+            assert_almost_equal(instance.fields["span_end_teacher_probs"].array.sum(), 1.0)
@@ -0,0 +1,71 @@
+# pylint: disable=no-self-use,invalid-name
+import numpy
+from numpy.testing import assert_almost_equal
+import torch
+
+from allennlp.common.testing import AllenNlpTestCase
+from allennlp.data.dataset_readers.reading_comprehension import util
+from allennlp.nn.util import masked_log_softmax, replace_masked_values
+from reading_comprehension.utils import char_spans_to_token_spans, get_mask_value, get_n_best_spans, \
+    get_packed_indices, kl_divergence, masked_span_scores, memory_effient_masked_softmax, pack_padded, \
+    unpack_to_padded
+
+
+class TestUtils(AllenNlpTestCase):
+    def test_get_n_best_spans_ranks_valid_spans_by_score(self):
+        span_start_logits = numpy.array([0.1, 3.0, 0.2, -1e7])
+        span_end_logits = numpy.array([2.0, 0.5, 1.0, -1e7])
+        n_best_spans = get_n_best_spans(span_start_logits, span_end_logits, n_best_size=3)
+        assert [(start, end) for start, end, _ in n_best_spans] == [(1, 2), (1, 1), (0, 0)]
+        numpy.testing.assert_almost_equal(n_best_spans[0][2], 4.0)
+
+    def test_get_n_best_spans_respects_max_span_length(self):
+        span_start_logits = numpy.array([5.0, 0.0, 0.0])
+        span_end_logits = numpy.array([0.0, 0.0, 5.0])
+        n_best_spans = get_n_best_spans(span_start_logits, span_end_logits, n_best_size=10, max_span_length=2)
+        assert (0, 2) not in [(start, end) for start, end, _ in n_best_spans]
+        assert len(n_best_spans) == 5
+
+    def test_pack_padded_round_trips_unmasked_elements(self):
+        tensor = torch.randn(2, 3, 4)
+        mask = torch.LongTensor([[1, 1, 0], [1, 0, 0]])
+        packed_indices = get_packed_indices(mask)
+        packed = pack_padded(tensor, packed_indices)
+        assert packed.size() == (3, 4)
+        unpacked = unpack_to_padded(packed, packed_indices, 2, 3)
+        numpy.testing.assert_almost_equal(unpacked.numpy(), (tensor * mask.unsqueeze(-1).float()).numpy())
+
+    def test_get_mask_value_fits_reduced_precision_types(self):
+        assert get_mask_value(torch.float32) == -1e7
+        assert get_mask_value(torch.float16) > torch.finfo(torch.float16).min
+        masked_vector = torch.zeros(3, dtype=torch.float16) + get_mask_value(torch.float16)
+        assert not torch.isinf(masked_vector).any()
+
+    def test_char_spans_to_token_spans_matches_char_span_to_token_span(self):
+        # "The 1854-1855 war ended ." with a tokenization issue in "1854-1855".
+        token_offsets = [(0, 3), (4, 13), (14, 17), (18, 23), (24, 25)]
+        char_spans = [(start, end) for start in range(0, 24) for end in range(start + 1, 26)]
+        token_spans, errors = char_spans_to_token_spans(numpy.array(token_offsets), numpy.array(char_spans))
+        for char_span, token_span, error in zip(char_spans, token_spans.tolist(), errors.tolist()):
+            expected_token_span, expected_error = util.char_span_to_token_span(token_offsets, char_span)
+            assert tuple(token_span) == expected_token_span
+            assert error == expected_error
+
+    def test_masked_span_scores_matches_separate_masking(self):
+        logits = torch.randn(3, 7) * 5
+        mask = torch.FloatTensor([[1] * 7, [1] * 4 + [0] * 3, [1] + [0] * 6])
+        masked_logits, probs, log_probs = masked_span_scores(logits, mask)
+        assert_almost_equal(masked_logits.numpy(), replace_masked_values(logits, mask, -1e7).numpy())
+        assert_almost_equal(probs.numpy(), memory_effient_masked_softmax(logits, mask).numpy(), decimal=6)
+        expected_log_probs = masked_log_softmax(logits, mask)
+        assert_almost_equal((log_probs * mask).numpy(), (expected_log_probs * mask).numpy(), decimal=5)
+
+    def test_kl_divergence_ignores_positions_without_target_mass(self):
+        logits = torch.randn(2, 5)
+        mask = torch.FloatTensor([[1] * 5, [1] * 3 + [0] * 2])
+        _, _, log_probs = masked_span_scores(logits, mask)
+        target_probs = torch.FloatTensor([[0.1, 0.2, 0.3, 0.4, 0.0], [0.5, 0.5, 0.0, 0.0, 0.0]])
+        expected = torch.nn.functional.kl_div(log_probs[0, :4], target_probs[0, :4], reduction='sum') + \
+                torch.nn.functional.kl_div(log_probs[1, :2], target_probs[1, :2], reduction='sum')
+        assert_almost_equal(kl_divergence(target_probs, log_probs).item(), expected.item() / 2, decimal=5)
+        assert_almost_equal(kl_divergence(log_probs.exp(), log_probs).item(), 0.0, decimal=5)